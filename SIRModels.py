@@ -39,6 +39,19 @@ def estimate_beta(x, gamma):
     Td = doubling_time(x)
     return beta_from_doubling_time(Td, gamma)[-7:].mean()
 
+def batchEstimateBeta(x, gamma):
+    """estimate_beta of each row of x, an array of case series along
+    the last axis (any leading shape). NaN where estimate_beta has no
+    doubling times to average.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Td = np.log(2)/np.gradient(np.log(x), axis=-1)
+        valid = np.isfinite(Td) & (Td!=0)
+        # the last 7 valid doubling times of each row
+        valid &= np.cumsum(valid[..., ::-1], axis=-1)[..., ::-1] <= 7
+        beta = np.where(valid, beta_from_doubling_time(Td, gamma), 0)
+        return beta.sum(axis=-1)/valid.sum(axis=-1)
+
 # The SIR model differential equations.
 def SIR(y, t, N, beta, gamma):
     S, I, R = y
@@ -61,6 +74,34 @@ def continuousSIR(beta, gamma, N, I0, timepts):
 
     return {'S':S,'I':I,'R':R, 'Inew':Inew}
 
+def batchSIR(beta, gamma, N, I0, timepts):
+    """continuousSIR for many independent regions at once.
+    beta, N and I0 are arrays with a value per region (beta and
+    gamma can also be scalars). The regions are solved as one
+    system, which is much faster than a loop of continuousSIR.
+    Returns S, I, R and Inew arrays of shape (regions, timepts).
+    """
+    N = np.asarray(N, dtype=float)
+    I0 = np.asarray(I0, dtype=float)
+    n = len(N)
+
+    # the state is S, I, R of each region in turn, so the Jacobian is
+    # banded. Otherwise odeint sets aside a dense (3n)^2 Jacobian in
+    # case the system turns stiff, which runs out of memory for tens
+    # of thousands of regions.
+    def SIRs(y, t):
+        S, I, R = y.reshape(n, 3).T
+        new = beta * S * I / N
+        return np.stack([-new, new - gamma * I, gamma * I], axis=1).ravel()
+
+    y0 = np.stack([N - I0, I0, np.zeros(n)], axis=1).ravel()
+    result = odeint(SIRs, y0, timepts, ml=2, mu=2)
+    S, I, R = result.reshape(len(timepts), n, 3).transpose(2, 1, 0)
+
+    Inew = -np.gradient(S, axis=1)
+
+    return {'S':S,'I':I,'R':R, 'Inew':Inew}
+
 # Discrete SIR model. Adapted from
 # https://code-for-philly.gitbook.io/chime/what-is-chime/sir-modeling
 def discreteSIR(beta, gamma, N, I0, tsteps):
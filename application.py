@@ -1,28 +1,47 @@
 # -*- coding: utf-8 -*-
+import logging
+
+from startup import StartupTimer, AppData, startupMode
+import metrics
+import profiling
+
+startuptimer = StartupTimer()
+
 import numpy as np
 import pandas as pd
 from datetime import date, timedelta, datetime
 import json
+import math
+import os
+import urllib.parse
+from functools import lru_cache
 
+import flask
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import dash_bootstrap_components as dbc
 
 from  util import *
-from SIRModels import discreteSIR, continuousSIR, estimate_beta, doubling_time
-from loadCaseData import (
-    loadStateData,
-    loadCountyData,
-    createCountyList
-)
+import cogic
+from compartmentModels import models as epimodels
+from outcomeModels import category, categories
+from loadCaseData import loadStateData
+from caseStore import caseStorePath
 
-from populationModels import census2cdc, loadUSPopulation
-from hospCensusModels import HospitalCensus
+from populationModels import loadUSPopulation
+from regionGroups import loadRegionGroups, regionCurves, summary, laggedCensus
+from bedCapacity import loadCapacityCache, capacity_cache
+import countyMap
+import exportData
+import jobQueue
+import scenarioStore
 
-createcensus = HospitalCensus()
+startuptimer.mark('imports')
+
+logger = logging.getLogger(__name__)
 
 theme = dbc.themes.FLATLY
 mathjax = 'https://cdnjs.cloudflare.com/ajax/libcds/mathjax/2.7.4/MathJax.js?config=TeX-MML-AM_CHTML'
@@ -32,6 +51,27 @@ external_stylesheets = [theme, mathjax]
 
 graph_height = '400'
 
+# Compact figure and store payloads: a single start date + step for
+# the date axis instead of a list of date strings per trace, and
+# values rounded to payload_decimals.
+compact_payloads = os.environ.get('COGIC_COMPACT_PAYLOADS', '1')=='1'
+payload_decimals = 1
+
+# Background jobs: with COGIC_JOBS=1, projections of at least
+# COGIC_JOB_TSTEPS days are computed by a job queue (see jobQueue.py)
+# instead of in the callback, and the graphs are filled in by polling.
+job_mode = os.environ.get('COGIC_JOBS', '0')=='1'
+job_tsteps = int(os.environ.get('COGIC_JOB_TSTEPS', 365))
+job_workers = int(os.environ.get('COGIC_JOB_WORKERS', 2))
+job_poll_interval = 1000 # ms
+
+# Computed projections and comparisons are kept in a content-addressed
+# store (see scenarioStore.py), shared by every user and worker
+scenario_cache = os.environ.get('COGIC_SCENARIO_CACHE', '1')=='1'
+
+# county groups offered in the region comparison, see regionGroups.py
+region_groups_file = os.environ.get('COGIC_REGION_GROUPS', 'data/region_groups_example.csv')
+
 if theme==dbc.themes.DARKLY:
     plot_bgcolor = 'rgb(45, 45, 45)'
     paper_bgcolor = 'rgb(45, 45, 45)'
@@ -46,189 +86,286 @@ else:
 # Load data
 #######################################################################
 
-statedata = loadStateData()
-# list of states
-states = statedata.columns.get_level_values(0)
-t_tot = len(statedata.index)
+def loaddata():
+    """Loads everything the app needs that is too slow to do at
+    import time in the lazy and background startup modes.
+    Returned values are attributes of appdata.
+    """
+    # rate tables, county data and Rt, as for cogic.project
+    data = cogic.loadModelData(timer=startuptimer.stage)
 
+    with startuptimer.stage('loadStateData'):
+        data['statedata'] = loadStateData()
+    # list of states
+    data['states'] = data['statedata'].columns.get_level_values(0).unique()
 
-uscountydata = loadCountyData()
-# list of counties
-# uscountylist[State] - > list of counties
+    with startuptimer.stage('loadUSPopulation'):
+        data['us_population'] = loadUSPopulation()
 
-uscountylist = createCountyList(uscountydata)
+    if os.path.exists(region_groups_file):
+        data['regiongroups'] = loadRegionGroups(region_groups_file)
+    else:
+        data['regiongroups'] = pd.DataFrame(columns=['group', 'state', 'county', 'weight'])
 
-us_population = loadUSPopulation()
+    # for the scenario store's keys
+    with startuptimer.stage('dataVersion'):
+        data['dataversion'] = scenarioStore.dataVersion(data['uscountydata'], caseStorePath())
 
-controls = [
-    dbc.Row([
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label('State'),
-                    dcc.Dropdown(
-                        options = [{
-                            'label':state, 'value':state
-                            } for state in states],
-                        value = 'Minnesota',
-                        id = 'state-dropdown'
-                    )
-                ]
-            ), md=12
-        )
-    ]),
-    dbc.Row([
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label('County'),
-                    dcc.Dropdown(
-                            value = 'Brown',
-                            id = 'county-dropdown'
-                    )
-                ]
-            ), md=12
-        )
-    ]),
-    dbc.Row(
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label('Days to project'),
-                    dbc.Input(
-                        id = 'tsteps',
-                        type = 'number',
-                        value = 200
-                    )
-                ]
-            ), md=12
-        )
-    ),
-    dbc.Row([
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label('Percentage Asymptomatic/Untested'),
-                    dcc.Slider(
-                        min = 0.0,
-                        max = 1,
-                        step = 0.05,
-                        marks = {i:str(int(100*i))+'%' for i in np.arange(0.0, 1.1, 0.2)},
-                        value = 0.5,
-                        id = 'silent-slider'
-                    )
-                ]
-            ), md=12
-        )
-    ]),
-    dbc.Row(
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label('Hospital LOS - days'),
-                    dbc.Input(
-                        id = 'hosp_LOS',
-                        type = 'number',
-                        value = 7
-                    )
-                ]
-            ), md=12
-        )
-    ),
-    dbc.Row(
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label('ICU LOS - days'),
-                    dbc.Input(
-                        id = 'ICU_LOS',
-                        type = 'number',
-                        value = 9
-                    )
-                ]
-            ), md=12
-        )
-    ),
-    dbc.Row(dbc.Col(html.Hr('Hospitalization rate'), md=12)),
-    dbc.Row(
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label('Hospitalization and fatality rate data'),
-                    dcc.RadioItems(
-                        options=[
-                            {'label':'Verity, et al. MedrXiv preprint', 'value':'Verity'},
-                            {'label': 'CDC MMWR 3/26/20            .', 'value':'CDC'},
-                            {'label': 'Custom (below)', 'value':'Custom'},
-                        ],
-                        value='Verity',
-                        style={'display': 'block'},
-                        id = 'hospmodel'
-                    )
-                ]
-            ),md=12
-        )
-    ),
-    dbc.Row(
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label('Hospitalization rate'),
-                    dcc.Slider(
-                        min = 0.01,
-                        max = 0.1,
-                        step = 0.005,
-                        marks = {i:str(int(100*i))+'%' for i in np.arange(0, 0.11, 0.01)},
-                        value = 0.025,
-                        id = 'hospitalizationrate-slider'
-                    ),
-                ]
-            ), md=12
-        )
-    ),
-    dbc.Row(
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label('ICU rate'),
-                    dcc.Slider(
-                        min = 0.00,
-                        max = 0.05,
-                        step = 0.001,
-                        marks = {i:str(int(100*i))+'%' for i in np.arange(0, 0.06, 0.01)},
-                        value = 0.01,
-                        id = 'icurate-slider'
-                    )
-                ]
-            ), md=12
-        )
-    ),
-    dbc.Row(
-        dbc.Col(
-            dbc.FormGroup(
-                [
-                    dbc.Label('Death Rate'),
-                    dcc.Slider(
-                        id = 'deathrate-slider',
-                        min = 0.001,
-                        max = 0.03,
-                        step = 0.001,
-                        marks = {
-                            0.001: '0.1%',
-                            0.005: '0.5%',
-                            0.01: '1.0%',
-                            0.015: '1.5%',
-                            0.02: '2.0%',
-                            0.025: '2.5%',
-                            0.03: '3.0%',
-                        },
-                        value = 0.005
-                    )
-                ]
+    logger.info('data loaded\n' + startuptimer.report())
+    return data
+
+appdata = AppData(loaddata)
+# the projections use the app's data
+cogic.useData(appdata)
+
+startup_mode = startupMode()
+if startup_mode=='eager':
+    appdata.load()
+elif startup_mode=='background':
+    appdata.warmup()
+
+def makecontrols(states):
+    return [
+        dbc.Row([
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('State'),
+                        dcc.Dropdown(
+                            options = [{
+                                'label':state, 'value':state
+                                } for state in states],
+                            value = 'Minnesota',
+                            id = 'state-dropdown'
+                        )
+                    ]
+                ), md=12
             )
-        )
-    ),
-]
+        ]),
+        dbc.Row([
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('County'),
+                        dcc.Dropdown(
+                                value = 'Brown',
+                                id = 'county-dropdown'
+                        )
+                    ]
+                ), md=12
+            )
+        ]),
+        dbc.Row(
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('Days to project'),
+                        dbc.Input(
+                            id = 'tsteps',
+                            type = 'number',
+                            value = 200,
+                            # only re-solve on enter/blur, not per keystroke
+                            debounce = True
+                        )
+                    ]
+                ), md=12
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('Transmission rate from'),
+                        dcc.RadioItems(
+                            id = 'beta-source',
+                            options = [
+                                {'label': ' State doubling time ', 'value': 'doubling'},
+                                {'label': ' Rt ', 'value': 'Rt'}
+                            ],
+                            value = 'doubling',
+                            labelStyle = {'display': 'inline-block', 'margin-right': '10px'}
+                        )
+                    ]
+                ), md=12
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('Epidemic model'),
+                        dcc.RadioItems(
+                            id = 'epi-model',
+                            options = [
+                                {'label': ' {} '.format(name), 'value': name}
+                                for name in epimodels
+                            ],
+                            value = 'SIR',
+                            labelStyle = {'display': 'inline-block', 'margin-right': '10px'}
+                        )
+                    ]
+                ), md=12
+            )
+        ),
+        dbc.Row([
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('Percentage Asymptomatic/Untested'),
+                        dcc.Slider(
+                            min = 0.0,
+                            max = 1,
+                            step = 0.05,
+                            marks = {i:str(int(100*i))+'%' for i in np.arange(0.0, 1.1, 0.2)},
+                            value = 0.5,
+                            # re-solves the model, so only on release
+                            updatemode = 'mouseup',
+                            id = 'silent-slider'
+                        )
+                    ]
+                ), md=12
+            )
+        ]),
+        dbc.Row(
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('Hospital LOS - days'),
+                        dbc.Input(
+                            id = 'hosp_LOS',
+                            type = 'number',
+                            value = 7
+                        )
+                    ]
+                ), md=12
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('ICU LOS - days'),
+                        dbc.Input(
+                            id = 'ICU_LOS',
+                            type = 'number',
+                            value = 9
+                        )
+                    ]
+                ), md=12
+            )
+        ),
+        dbc.Row(dbc.Col(html.Hr('Hospitalization rate'), md=12)),
+        dbc.Row(
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('Hospitalization and fatality rate data'),
+                        dcc.RadioItems(
+                            options=[
+                                {'label':'Verity, et al. MedrXiv preprint', 'value':'Verity'},
+                                {'label': 'CDC MMWR 3/26/20            .', 'value':'CDC'},
+                                {'label': 'Custom (below)', 'value':'Custom'},
+                            ],
+                            value='Verity',
+                            style={'display': 'block'},
+                            id = 'hospmodel'
+                        )
+                    ]
+                ),md=12
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('Hospitalization rate'),
+                        dcc.Slider(
+                            min = 0.01,
+                            max = 0.1,
+                            step = 0.005,
+                            marks = {i:str(int(100*i))+'%' for i in np.arange(0, 0.11, 0.01)},
+                            value = 0.025,
+                            # handled client-side, so update while dragging
+                            updatemode = 'drag',
+                            id = 'hospitalizationrate-slider'
+                        ),
+                    ]
+                ), md=12
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('ICU rate'),
+                        dcc.Slider(
+                            min = 0.00,
+                            max = 0.05,
+                            step = 0.001,
+                            marks = {i:str(int(100*i))+'%' for i in np.arange(0, 0.06, 0.01)},
+                            value = 0.01,
+                            # handled client-side, so update while dragging
+                            updatemode = 'drag',
+                            id = 'icurate-slider'
+                        )
+                    ]
+                ), md=12
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('Death Rate'),
+                        dcc.Slider(
+                            id = 'deathrate-slider',
+                            # handled client-side, so update while dragging
+                            updatemode = 'drag',
+                            min = 0.001,
+                            max = 0.03,
+                            step = 0.001,
+                            marks = {
+                                0.001: '0.1%',
+                                0.005: '0.5%',
+                                0.01: '1.0%',
+                                0.015: '1.5%',
+                                0.02: '2.0%',
+                                0.025: '2.5%',
+                                0.03: '3.0%',
+                            },
+                            value = 0.005
+                        )
+                    ]
+                )
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dbc.FormGroup(
+                    [
+                        dbc.Label('Export projections'),
+                        dcc.RadioItems(
+                            id = 'export-format',
+                            options = [
+                                {'label': ' CSV ', 'value': 'csv'},
+                                {'label': ' Excel ', 'value': 'xlsx'},
+                                {'label': ' Parquet ', 'value': 'parquet'}
+                            ],
+                            value = 'csv',
+                            labelStyle = {'display': 'inline-block', 'margin-right': '10px'}
+                        ),
+                        # hrefs are set client-side from the controls
+                        html.Div([
+                            html.A('County', id='export-county'), ' | ',
+                            html.A('Counties of the state', id='export-state'), ' | ',
+                            html.A('Compared regions', id='export-compare')
+                        ]),
+                        html.Div(html.A('Link to this scenario', id='scenario-link'))
+                    ]
+                ), md=12
+            )
+        ),
+    ]
 
 basetext = html.Div([
     html.P([
@@ -265,6 +402,8 @@ modeltext = html.Div([
         * The models are US state and county specific
         * The beta parameter for the SIR model is calculated from the 7-day averaged
         observed doubling time.
+        * SEIR, SEIRD (deaths kept apart) and SIRH (with a hospital compartment) models
+        can be used instead of SIR, with beta from the same growth rate.
         * 2018 US population estimates at the state and county levels are used for epidemic curve modeling
         * Hospital census data are calculated based on one of several methods:
             * Adjustable parameters as in CHIME
@@ -302,27 +441,112 @@ modeltext = html.Div([
         )
 """
 
-censusgraph = [dbc.Row(
-            [
-                dbc.Col(controls, md=3),
-                dbc.Col(
+def makecensusgraph():
+    return [dbc.Row(
+                [
+                    dbc.Col(makecontrols(appdata.states), md=3),
+                    dbc.Col(
+                        [
+                            dbc.Row(dbc.Col(html.Div(id='job-status'))),
+                            dbc.Row(dbc.Col(dcc.Graph(id='countysir-graph'))),
+                            dbc.Row(dbc.Col(dcc.Graph(id='countymodel-graph'))),
+                            dbc.Row(dbc.Col(dcc.Graph(id='countyadmissions-graph'))),
+                            dbc.Row(dbc.Col(html.Div(id='countymodel-text'))),
+                            dbc.Row(dbc.Col(dcc.Graph(id='countydeath-graph'))),
+                            dbc.Row(dbc.Col(dcc.Graph(id='statesir-graph'))),
+                            dbc.Row(dbc.Col(dcc.Graph(id='statemodel-graph'))),
+                            dbc.Row(dbc.Col(dcc.Graph(id='stateadmissions-graph'))),
+                            dbc.Row(dbc.Col(html.Div(id='statemodel-text'))),
+                            dbc.Row(dbc.Col(dcc.Graph(id='statedeath-graph'))),
+                            dbc.Col(modeltext),
+                            dbc.Col(basetext),
+                            dcc.Store(id='county-projection'),
+                            dcc.Store(id='state-projection'),
+                            dcc.Store(id='projection-job'),
+                            dcc.Interval(
+                                id='job-poll',
+                                interval=job_poll_interval,
+                                disabled=True
+                            )
+                        ], md=9
+                    ),
+                ]
+            ),
+        ]
+
+def makecomparison():
+    return [
+        html.H4('Compare regions'),
+        dbc.Row([
+            dbc.Col(
+                dbc.FormGroup(
                     [
-                        dbc.Row(dbc.Col(dcc.Graph(id='countysir-graph'))),
-                        dbc.Row(dbc.Col(dcc.Graph(id='countymodel-graph'))),
-                        dbc.Row(dbc.Col(dcc.Graph(id='countyadmissions-graph'))),
-                        dbc.Row(dbc.Col(html.Div(id='countymodel-text'))),
-                        dbc.Row(dbc.Col(dcc.Graph(id='countydeath-graph'))),
-                        dbc.Row(dbc.Col(dcc.Graph(id='statesir-graph'))),
-                        dbc.Row(dbc.Col(dcc.Graph(id='statemodel-graph'))),
-                        dbc.Row(dbc.Col(dcc.Graph(id='stateadmissions-graph'))),
-                        dbc.Row(dbc.Col(html.Div(id='statemodel-text'))),
-                        dbc.Row(dbc.Col(dcc.Graph(id='statedeath-graph'))),
-                        dbc.Col(modeltext),
-                        dbc.Col(basetext)
-                    ], md=9
-                ),
-            ]
+                        dbc.Label('Counties, states and county groups'),
+                        dcc.Dropdown(
+                            id = 'compare-dropdown',
+                            multi = True,
+                            value = []
+                        )
+                    ]
+                ), md=10
+            ),
+            dbc.Col(
+                # the comparison uses the controls above as they are
+                # when it's run, so moving them doesn't re-run it
+                dbc.Button('Compare', id='compare-button', color='primary',
+                           className='mt-4'),
+                md=2
+            )
+        ]),
+        dbc.Row(dbc.Col(dcc.Graph(id='compare-census-graph'))),
+        dbc.Row(dbc.Col(dcc.Graph(id='compare-admissions-graph'))),
+        dbc.Row(dbc.Col(dcc.Graph(id='compare-death-graph'))),
+        dbc.Row(dbc.Col(
+            dash_table.DataTable(
+                id = 'compare-table',
+                columns = [{'name': name, 'id': name} for name in [
+                    'Region', 'Population', 'Peak census', 'Peak date',
+                    'Peak ICU census', 'Total deaths'
+                ]],
+                style_cell = {'textAlign': 'left'}
+            )
+        ))
+    ]
+
+capacity_page_size = 25
+
+def makecapacity():
+    return [
+        html.H4('Time to capacity'),
+        html.Div(id='capacity-info'),
+        dash_table.DataTable(
+            id = 'capacity-table',
+            # sorted and paged on the server, there are ~3000 rows
+            page_action = 'custom',
+            page_current = 0,
+            page_size = capacity_page_size,
+            sort_action = 'custom',
+            sort_mode = 'single',
+            sort_by = [],
+            style_cell = {'textAlign': 'left'}
         ),
+        html.A('Download CSV', href='/capacity.csv')
+    ]
+
+def makecountymap():
+    return [
+        html.H4('County map'),
+        dcc.RadioItems(
+            id = 'map-metric',
+            options = [
+                {'label': ' {} '.format(name), 'value': name}
+                for name in countyMap.metrics
+            ],
+            value = 'growth rate',
+            labelStyle = {'display': 'inline-block', 'margin-right': '10px'}
+        ),
+        html.Div(id='map-info'),
+        dcc.Graph(id='county-map')
     ]
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
@@ -331,49 +555,128 @@ app.title = "COGIC"
 application = app.server
 
 
-app.layout = dbc.Container(
-    [
-        html.H2('COVID-19 Geographic Impact Calculator (COGIC)'),
-        html.Hr(),
-        html.Div(censusgraph)
-    ],
-    fluid=True
-)
+pagelayout = []
+
+def servelayout():
+    """The page layout needs the state list, so it's built on the
+    first page load rather than at import (unless startup is eager).
+    """
+    if not appdata.ready.is_set() and not (flask.has_request_context()
+            and flask.request.path.endswith('_dash-layout')):
+        # Dash also calls this to validate callbacks as they're
+        # registered and before the first request of any kind,
+        # e.g. /ready. Don't wait for the data then.
+        return html.Div()
+    if not pagelayout:
+        appdata.load()
+        with startuptimer.stage('layout'):
+            pagelayout.append(dbc.Container(
+                [
+                    # scenarios shared as links, see loadscenario
+                    dcc.Location(id='url', refresh=False),
+                    html.H2('COVID-19 Geographic Impact Calculator (COGIC)'),
+                    html.Hr(),
+                    html.Div(makecensusgraph()),
+                    html.Hr(),
+                    html.Div(makecomparison()),
+                    html.Hr(),
+                    html.Div(makecountymap()),
+                    html.Hr(),
+                    html.Div(makecapacity())
+                ],
+                fluid=True
+            ))
+    return pagelayout[0]
+
+app.layout = servelayout
+
+def preload():
+    """Loads the data and builds the layout up front. Used by the
+    gunicorn master (see gunicorn.conf.py) so that workers forked
+    from it share everything copy-on-write instead of each loading
+    their own copy.
+    """
+    appdata.load()
+    servelayout()
+    # simplifying the county shapes takes a while
+    countyshapesjson()
+
+if startup_mode=='eager':
+    servelayout()
+
+@application.route('/ready')
+def ready():
+    """Readiness probe. 200 once the data is loaded, 503 until then,
+    with the startup timings so far.
+    """
+    status = 200 if appdata.ready.is_set() else 503
+    return flask.jsonify({
+        'ready': appdata.ready.is_set(),
+        'startup_mode': startup_mode,
+        'error': appdata.error,
+        'startup': dict(startuptimer.stages)
+    }), status
 
 @app.callback(
     Output('county-dropdown', 'options'),
     [Input('state-dropdown', 'value')]
 )
+@metrics.timedCallback
 def countrydropdownoptions(state):
     return [
         {'label':county, 'value':county}
-        for county in sorted(uscountylist[state])
+        for county in sorted(appdata.uscountylist[state])
     ]
 
-def sirgraph(state, county,
-            silent,tsteps):
-    data, popstructure, N = createcensus.createPopulation(state, county, uscountydata, None)
-
-    statedata = data['state']
-    county_data = data['county'] #this may actually also be whole state data
-    known_infected = county_data['Confirmed'].values[-7:]
-    estimated_infected = known_infected/(1-silent)
-    infected_for_beta = statedata['Confirmed'].values[-7:]
-    #infected_for_beta = county_data['Confirmed'].values[-7:]
-
-    #df, popstructure = df['county'] * susceptible, popstructure['county'] * susceptible
+def dateaxis(start, tsteps):
+    """x values for a daily series of length tsteps beginning at start"""
+    if compact_payloads:
+        return {'x0': start.isoformat(), 'dx': 86400000}
+    return {
+        'x': pd.date_range(start, periods=tsteps).strftime('%m/%d').tolist()
+    }
 
-    I0 = estimated_infected[-1] #current cases as initial condition
-    t = np.arange(tsteps)
-    dates = [(date.today() + timedelta(int(i))).strftime('%m/%d') for i in t]
-    pastdates = pd.to_datetime(county_data.index[-7:]).strftime('%m/%d')
+def pastdateaxis(index):
+    if compact_payloads:
+        return pd.to_datetime(index).strftime('%Y-%m-%d').tolist()
+    return pd.to_datetime(index).strftime('%m/%d').tolist()
+
+def xaxislayout():
+    if compact_payloads:
+        return {'title':'Date', 'type':'date', 'tickformat':'%m/%d'}
+    return {'title':'Date'}
+
+def payloadvalues(values):
+    if compact_payloads:
+        values = np.round(values, payload_decimals)
+    return values.tolist()
+
+def runsir(state, county, silent, tsteps, betasource='doubling', epimodel='SIR'):
+    """Projects a region with cogic.project, with the dates and title
+    the graphs need. Everything shown for the region (SIR graph and
+    the projection store) is built from this.
+    """
+    run = cogic.project(state, county, silent, tsteps, betasource, epimodel,
+                        timer=metrics.timed)
+    run.update(
+        title = state if county=='All' else (county + ' County'),
+        dates = dateaxis(date.today(), tsteps),
+        pastdates = pastdateaxis(run['pastdates'])
+    )
+    return run
 
-    gamma = 1./14
-    beta = estimate_beta(infected_for_beta, gamma)
-    Td = doubling_time(infected_for_beta).mean()
+def sirtitle(run):
+    Rt = run.get('Rt')
+    if Rt is None:
+        return ', Current Td: {:0.1f}'.format(run['Td']) + ' days'
+    return ', Current {}Rt: {:0.2f} ({:0.2f}-{:0.2f})'.format(
+        '' if Rt['county'] or run['county']=='All' else 'state ', Rt['Rt'], Rt['low'], Rt['high'])
 
-    sol = continuousSIR(beta, gamma, N, I0, t)
-    projected_infected = sol['I']
+def sirfigure(run):
+    sol = run['sol']
+    dates = run['dates']
+    pastdates = run['pastdates']
+    known_infected = run['known_infected']
 
     knowntrace = [
         {
@@ -391,44 +694,10 @@ def sirgraph(state, county,
                 'showlegend': True,
         }
     ]
-    SIR = [
-        {
-            'x': dates,
-            'y': y,
-                'mode':'line',
-                'opacity':0.7,
-                'line':{
-                    'width': 4,
-                    #'color': 'blue' if i==1 else 'green',
-                    'opacity':0.9
-                    },
-                'id':{0:'S', 1:'I', 2:'R'}[i],
-                'name':{0:'S', 1:'I', 2:'R'}[i],
-                'showlegend': True,
-        } for i,y in enumerate([sol[c] for c in ['S','I','R']])
-    ]
-
-    I = [
-        {
-            'x': dates,
-            'y': sol['I'],
-                'mode':'line',
-                'opacity':0.7,
-                'line':{
-                    'width': 4,
-                    'color': 'blue',
-                    'opacity':0.9
-                    },
-                'id':'Confirmed',
-                'name':'Estimated Infected',
-                'showlegend': True,
-        }
-    ]
-
     Inew = [
         {
-            'x': dates,
-            'y': sol['Inew'],
+            **dates,
+            'y': payloadvalues(sol['Inew']),
                 'mode':'line',
                 'opacity':0.7,
                 'line':{
@@ -445,16 +714,14 @@ def sirgraph(state, county,
     figure = {
         'data': knowntrace + Inew,
         'layout': {
-            'xaxis': {'title':'Date'},
+            'xaxis': xaxislayout(),
             'yaxis': {
                 #'title': 'Patients',
                 'type':'linear'
                 },
             'hovermode':'closest',
             'title':{
-                'text': (
-                    state if county=='All' else (county + ' County')
-                    ) + ' SIR model' + ', Current Td: {:0.1f}'.format(Td) + ' days'
+                'text': run['title'] + ' ' + run['epimodel'] + ' model' + sirtitle(run)
                 },
             'margin':{'l':75, 'r':40, 'b':120, 't':40},
             'hoveron':'points+fills',
@@ -478,52 +745,157 @@ def sirgraph(state, county,
     }
     return figure
 
-def censusgraph(state, county,
-            silent, hosprate, icurate, deathrate,
-            hosp_LOS, ICU_LOS, tsteps, title, model):
-    data, popstructure, N = createcensus.createPopulation(state, county, uscountydata, model)
-
-    statedata = data['state']
-    county_data = data['county'] #this may actually also be whole state data
-    known_infected = county_data['Confirmed'].values[-7:]
-    estimated_infected = known_infected/(1-silent)
-    infected_for_beta = statedata['Confirmed'].values[-7:]
-    #infected_for_beta = county_data['Confirmed'].values[-7:]
-
-    I0 = estimated_infected[-1] #current cases as initial condition
-
-    t = np.arange(tsteps)
-    dates = [(date.today() + timedelta(int(i))).strftime('%m/%d') for i in t]
-    pastdates = pd.to_datetime(county_data.index).strftime('%m/%d')
-
-    gamma = 1./14
-    beta = estimate_beta(infected_for_beta, gamma)
-
-    sol = continuousSIR(beta, gamma, N, I0, t)
-    projected_infected = sol['I']
+def sirgraph(state, county,
+            silent,tsteps):
+    return sirfigure(runsir(state, county, silent, tsteps))
+
+def censuslayout(title):
+    return {
+        'xaxis': xaxislayout(),
+        'yaxis': {
+            'title': 'Patients',
+            'type':'linear'
+            },
+        'hovermode':'closest',
+        'title':{
+            'text': title + ' - Hospital Census'
+            },
+        'margin':{'l':75, 'r':40, 'b':120, 't':40},
+        'hoveron':'points+fills',
+        'mode':'lines',
+        'marker':{
+            'size': 15,
+            'line': {'width': 0.5, 'color': 'blue'}
+        },
+        'legend':{
+            'xanchor': 'center',
+            'x': 0.5,
+            'y':-0.3,
+            'orientation': 'h'
+            },
+        'legend_orientation': 'h',
+        'height': graph_height,
+        "plot_bgcolor": plot_bgcolor,
+        'paper_bgcolor': paper_bgcolor,
+        'font':{'color': font_color}
+    }
 
-    admissionrates = createcensus.calcAdmissionRates(
-            popstructure,
-            hosprate,
-            icurate,
-            model
-            )
+def admissionslayout():
+    return {
+        'xaxis': xaxislayout(),
+        'yaxis': {
+            'title': 'Patients',
+            'type':'linear'
+            },
+        'hovermode':'closest',
+        'title':{
+            'text': 'Admissions'
+            },
+        'margin':{'l':75, 'r':40, 'b':120, 't':40},
+        'hoveron':'points+fills',
+        'mode':'lines',
+        'marker':{
+            'size': 15,
+            'line': {'width': 0.5, 'color': 'blue'}
+        },
+        'height': str(2*int(graph_height)/3),
+        "plot_bgcolor": plot_bgcolor,
+        'paper_bgcolor': paper_bgcolor,
+        'font':{'color': font_color}
+    }
 
-    LOS = createcensus.calcLOS(hosp_LOS, ICU_LOS, model)
+def deathlayout():
+    return {
+        'xaxis': xaxislayout(),
+        'yaxis': {
+            'title': 'Patients',
+            'type':'linear'
+            },
+        'hovermode':'closest',
+        'title':{
+            'text': 'Deaths'
+            },
+        'margin':{'l':75, 'r':40, 'b':120, 't':40},
+        'hoveron':'points+fills',
+        'mode':'lines',
+        'marker':{
+            'size': 15,
+            'line': {'width': 0.5, 'color': 'blue'}
+        },
+        'legend': {
+            'xanchor': 'center',
+            'x': 0.5,
+            'y':-0.3,
+            'orientation': 'h'
+            },
+        'height': graph_height,
+        "plot_bgcolor": plot_bgcolor,
+        'paper_bgcolor': paper_bgcolor,
+        'font':{'color': font_color}
+    }
 
-    census = createcensus.calcCensus(
-        incidence = sol['Inew'],
-        admissionrates = admissionrates,
-        LOS = LOS
-    )
+def projectionstore(run):
+    """Collects everything the census, admissions and death graphs
+    need that doesn't depend on the rate or length-of-stay controls.
+    Admissions, census and deaths are linear in Inew and R, so this
+    is kept in a dcc.Store and post-processed in the browser (see
+    assets/clientside.js). The *figure functions below do the same
+    post-processing in python.
+    """
+    # rate tables for the published models. The custom model takes
+    # its rates straight from the sliders.
+    with metrics.timed('rateTables'):
+        ratetables = appdata.createcensus.calcRateTables(run['state'], run['county'])
+    # admissions and deaths are these times the rates
+    return {
+        'xaxis': run['dates'],
+        'incidence': {name: payloadvalues(run['delayed'][name]) for name in categories},
+        'admissionrates': {
+            model: tables['admissions'].to_dict()
+            for model, tables in ratetables.items()
+        },
+        'deathrates': {
+            model: tables['deaths'].to_dict()
+            for model, tables in ratetables.items()
+        },
+        'layouts': {
+            'census': censuslayout(run['title']),
+            'admissions': admissionslayout(),
+            'deaths': deathlayout()
+        }
+    }
 
-    admissions = dict()
-    for idx in admissionrates.index:
-        admissions[idx] = np.round(sol['Inew'] * admissionrates.loc[idx])
+def projection(state, county, silent, tsteps):
+    return projectionstore(runsir(state, county, silent, tsteps))
+
+def projectionadmissionrates(proj, hosprate, icurate, model):
+    if model in proj['admissionrates']:
+        return pd.Series(proj['admissionrates'][model])
+    return appdata.createcensus.calcAdmissionRates(None, hosprate, icurate, model)
+
+def outcomes(proj, rates):
+    """Daily admissions or deaths for each of rates (a Series), an
+    array with a row per rate: the incidence delayed to the outcome
+    category of each, times the rate.
+    """
+    incidence = np.array([proj['incidence'][name] for name in categories])
+    rows = [categories.index(category(key)) for key in rates.index]
+    return rates.values[:, None]*incidence[rows]
+
+def censusfigure(proj, hosprate, icurate, hosp_LOS, ICU_LOS, model):
+    """Python equivalent of cogic.censusFigure in assets/clientside.js"""
+    admissionrates = projectionadmissionrates(proj, hosprate, icurate, model)
+    admissions = np.round(outcomes(proj, admissionrates))
+
+    LOS = appdata.createcensus.calcLOS(hosp_LOS, ICU_LOS, model)
+    census = pd.DataFrame({
+        key: laggedCensus(admissions[i:i + 1], int(LOS[key]))[0]
+        for i, key in enumerate(admissionrates.index)
+    })
 
     censustraces = [
         {
-            'x': dates,
+            **proj['xaxis'],
             'y': census[col],
             'mode':'line',
             'opacity':0.7,
@@ -540,80 +912,19 @@ def censusgraph(state, county,
         for col in census.columns
     ]
 
-    figure = {
+    return {
         'data': censustraces,
-        'layout': {
-            'xaxis': {'title':'Date'},
-            'yaxis': {
-                'title': 'Patients',
-                'type':'linear'
-                },
-            'hovermode':'closest',
-            'title':{
-                'text': (state if county=='All' else (county + ' County')) + ' - Hospital Census'
-                },
-            'margin':{'l':75, 'r':40, 'b':120, 't':40},
-            'hoveron':'points+fills',
-            'mode':'lines',
-            'marker':{
-                'size': 15,
-                'line': {'width': 0.5, 'color': 'blue'}
-            },
-            'legend':{
-                'xanchor': 'center',
-                'x': 0.5,
-                'y':-0.3,
-                'orientation': 'h'
-                },
-            'legend_orientation': 'h',
-            'height': graph_height,
-            "plot_bgcolor": plot_bgcolor,
-            'paper_bgcolor': paper_bgcolor,
-            'font':{'color': font_color}
-        }
+        'layout': proj['layouts']['census']
     }
-    return figure
-
-def admissionsgraph(state, county,
-            silent, hosprate, icurate, deathrate,
-            hosp_LOS, ICU_LOS, tsteps, title, model):
-    data, popstructure, N = createcensus.createPopulation(state, county, uscountydata, model)
-
-    statedata = data['state']
-    county_data = data['county'] #this may actually also be whole state data
-    known_infected = county_data['Confirmed'].values[-7:]
-    estimated_infected = known_infected/(1-silent)
-    infected_for_beta = statedata['Confirmed'].values[-7:]
-    #infected_for_beta = county_data['Confirmed'].values[-7:]
-
-    #df, popstructure = df['county'] * susceptible, popstructure['county'] * susceptible
-
-    I0 = estimated_infected[-1] #current cases as initial condition
 
-    t = np.arange(tsteps)
-    dates = [(date.today() + timedelta(int(i))).strftime('%m/%d') for i in t]
-    pastdates = pd.to_datetime(county_data.index).strftime('%m/%d')
-
-    gamma = 1./14
-    beta = estimate_beta(infected_for_beta, gamma)
-
-    sol = continuousSIR(beta, gamma, N, I0, t)
-    projected_infected = sol['I']
-
-    admissionrates = createcensus.calcAdmissionRates(
-            popstructure,
-            hosprate,
-            icurate,
-            model
-            )
-
-    admissions = dict()
-    for idx in admissionrates.index:
-        admissions[idx] = np.round(sol['Inew'] * admissionrates.loc[idx])
+def admissionsfigure(proj, hosprate, icurate, model):
+    """Python equivalent of cogic.admissionsFigure in assets/clientside.js"""
+    admissionrates = projectionadmissionrates(proj, hosprate, icurate, model)
+    admissions = dict(zip(admissionrates.index, np.round(outcomes(proj, admissionrates))))
 
     admissionstraces = [
         {
-            'x': dates,
+            **proj['xaxis'],
             'y': admissions[dispo],
             'type':'line',
             'opacity':0.7,
@@ -629,107 +940,26 @@ def admissionsgraph(state, county,
         }
         for dispo in admissions.keys()
     ]
-    knowntrace = [
-        {
-            'x': pastdates,
-            'y': known_infected,
-                'mode':'line',
-                'opacity':0.7,
-                'line':{
-                    'width': 4,
-                    'color': 'black',
-                    'opacity':0.9
-                    },
-                'id':'Known Infected',
-                'name':'Known Infected',
-                'showlegend': True,
-        }
-    ]
-    Inew = [
-        {
-            'x': dates,
-            'y': sol['Inew'],
-                'mode':'line',
-                'opacity':0.7,
-                'line':{
-                    'width': 4,
-                    'color': 'green',
-                    'opacity':0.9
-                    },
-                'id':'Confirmed',
-                'name':'New Infections',
-                'showlegend': True,
-        }
-    ]
 
-    figure = {
+    return {
         'data': admissionstraces,
-        'layout': {
-            'xaxis': {'title':'Date'},
-            'yaxis': {
-                'title': 'Patients',
-                'type':'linear'
-                },
-            'hovermode':'closest',
-            'title':{
-                'text': 'Admissions'
-                },
-            'margin':{'l':75, 'r':40, 'b':120, 't':40},
-            'hoveron':'points+fills',
-            'mode':'lines',
-            'marker':{
-                'size': 15,
-                'line': {'width': 0.5, 'color': 'blue'}
-            },
-            'height': str(2*int(graph_height)/3),
-            "plot_bgcolor": plot_bgcolor,
-            'paper_bgcolor': paper_bgcolor,
-            'font':{'color': font_color}
-        }
+        'layout': proj['layouts']['admissions']
     }
-    return figure
-
-def deathgraph(state, county,
-            silent, deathrate,
-            tsteps, model):
-    data, popstructure, N = createcensus.createPopulation(state, county, uscountydata, model)
-
-    statedata = data['state']
-    county_data = data['county'] #this may actually also be whole state data
-    known_infected = county_data['Confirmed'].values[-7:]
-    estimated_infected = known_infected/(1-silent)
-    infected_for_beta = statedata['Confirmed'].values[-7:]
-    #infected_for_beta = county_data['Confirmed'].values[-7:]
-
-    #df, popstructure = df['county'] * susceptible, popstructure['county'] * susceptible
-
-    I0 = estimated_infected[-1] #current cases as initial condition
-
-    t = np.arange(tsteps)
-    dates = [(date.today() + timedelta(int(i))).strftime('%m/%d') for i in t]
-
-    gamma = 1./14
-    beta = estimate_beta(infected_for_beta, gamma)
-
-    sol = continuousSIR(beta, gamma, N, I0, t)
-
-    deathrates = createcensus.calcDeathRates(deathrate, popstructure, model)
-
-    deaths = dict()
-    deathsperday = dict()
-    if model==None:
-        deaths['Deaths'] = np.round(deathrates * sol['R'])
-        deathsperday['Deaths per day'] = np.round(np.gradient(deaths['Deaths']))
 
+def deathfigure(proj, deathrate, model):
+    """Python equivalent of cogic.deathFigure in assets/clientside.js"""
+    if model in proj['deathrates']:
+        deathrates = pd.Series(proj['deathrates'][model])
     else:
-        for idx in deathrates.index:
-            deaths[idx] = np.round(sol['R'] * deathrates.loc[idx])
-        for key in deaths.keys():
-            deathsperday[idx] = np.round(np.gradient(deaths[key]))
+        deathrates = pd.Series({'Deaths': deathrate})
+
+    daily = outcomes(proj, deathrates)
+    deaths = dict(zip(deathrates.index, np.round(np.cumsum(daily, axis=1))))
+    deathsperday = dict(zip(deathrates.index + ' per day', np.round(daily)))
 
     deathtrace = [
         {
-            'x': dates,
+            **proj['xaxis'],
             'y': val,
             'mode':'line',
             'opacity':0.7,
@@ -747,7 +977,7 @@ def deathgraph(state, county,
 
     deathratetrace = [
         {
-            'x': dates,
+            **proj['xaxis'],
             'y': val,
             'type':'bar',
             'opacity':0.7,
@@ -762,187 +992,652 @@ def deathgraph(state, county,
         } for key, val in deathsperday.items()
     ]
 
-    figure = {
+    return {
         'data': deathtrace + deathratetrace,
-        'layout': {
-            'xaxis': {'title':'Date'},
-            'yaxis': {
-                'title': 'Patients',
-                'type':'linear'
-                },
-            'hovermode':'closest',
-            'title':{
-                'text': 'Deaths'
-                },
-            'margin':{'l':75, 'r':40, 'b':120, 't':40},
-            'hoveron':'points+fills',
-            'mode':'lines',
-            'marker':{
-                'size': 15,
-                'line': {'width': 0.5, 'color': 'blue'}
-            },
-            'legend': { 
-                'xanchor': 'center', 
-                'x': 0.5, 
-                'y':-0.3, 
-                'orientation': 'h'
-                },
-            'height': graph_height,
-            "plot_bgcolor": plot_bgcolor,
-            'paper_bgcolor': paper_bgcolor,
-            'font':{'color': font_color}
-        }
+        'layout': proj['layouts']['deaths']
     }
-    return figure
+
+def censusgraph(state, county,
+            silent, hosprate, icurate, deathrate,
+            hosp_LOS, ICU_LOS, tsteps, title, model):
+    proj = projection(state, county, silent, tsteps)
+    return censusfigure(proj, hosprate, icurate, hosp_LOS, ICU_LOS, model)
+
+def admissionsgraph(state, county,
+            silent, hosprate, icurate, deathrate,
+            hosp_LOS, ICU_LOS, tsteps, title, model):
+    proj = projection(state, county, silent, tsteps)
+    return admissionsfigure(proj, hosprate, icurate, model)
+
+def deathgraph(state, county,
+            silent, deathrate,
+            tsteps, model):
+    proj = projection(state, county, silent, tsteps)
+    return deathfigure(proj, deathrate, model)
+
+def figures(run):
+    """SIR graph and projection store for a region"""
+    with metrics.timed('sirfigure'):
+        sirfig = sirfigure(run)
+    with metrics.timed('projectionstore'):
+        store = projectionstore(run)
+    return [sirfig, store]
+
+model_version = scenarioStore.modelVersion()
+
+def scenarioversions():
+    return {'model': model_version, 'data': appdata.dataversion}
+
+scenariostore = scenarioStore.ScenarioStore(scenarioversions) if scenario_cache else None
+
+def scenario(kind, params, compute):
+    """compute(), or its result from the scenario store if the same
+    thing has been computed today with the same code and data
+    """
+    if scenariostore is None:
+        return compute()
+    # results have today's dates, and the payloads depend on
+    # compact_payloads
+    params = dict(params, date=date.today().isoformat(), compact=compact_payloads)
+    return scenariostore.cached(kind, params, compute)
+
+def projectionoutputs(state, county, silent, tsteps, regions, betasource='doubling',
+                      epimodel='SIR', progress=None):
+    """SIR graphs and projection stores for the county and the state,
+    or None for a region not in regions.
+    """
+    outputs = [None]*4
+    for i, region in enumerate(['county', 'state']):
+        if region in regions:
+            if progress:
+                progress(i/len(regions), 'Solving the {} model'.format(region))
+            params = dict(state=state, county=county if region=='county' else 'All',
+                          silent=silent, tsteps=tsteps, betasource=betasource,
+                          epimodel=epimodel)
+            outputs[2*i:2*i + 2] = scenario('projection', params,
+                                            lambda: figures(runsir(**params)))
+    return outputs
+
+def projectionjob(params, progress):
+    # the date is only part of the job id, since projections start today
+    params = {k: v for k, v in params.items() if k!='date'}
+    return projectionoutputs(progress=progress, **params)
+
+jobQueue.register('projections', projectionjob)
+jobqueue = jobQueue.JobQueue() if job_mode else None
+
+def jobprogress(job):
+    """Progress bar for a queued or running job"""
+    if job['status']=='queued':
+        message = 'Queued, {} job(s) ahead'.format(job['ahead'])
+    else:
+        message = job['message'] or 'Running'
+    return html.Div([
+        dbc.Progress(value=max(5, 100*job['progress']), striped=True, animated=True),
+        html.Small(message)
+    ])
+
+def joboutputs(outputs):
+    return [dash.no_update if output is None else output for output in outputs]
 
 @app.callback(
-    Output(component_id='countysir-graph', component_property='figure'),
+    [
+        Output('countysir-graph', 'figure'),
+        Output('county-projection', 'data'),
+        Output('statesir-graph', 'figure'),
+        Output('state-projection', 'data'),
+        Output('projection-job', 'data'),
+        Output('job-poll', 'disabled'),
+        Output('job-status', 'children')
+    ],
     [
         Input('state-dropdown', 'value'),
         Input('county-dropdown', 'value'),
         Input('silent-slider', 'value'),
-        Input('tsteps', 'value')
-    ]
+        Input('tsteps', 'value'),
+        Input('beta-source', 'value'),
+        Input('epi-model', 'value'),
+        Input('job-poll', 'n_intervals')
+    ],
+    [State('projection-job', 'data')]
 )
-def countysirgraph(state, county,
-            silent,tsteps):
-    return sirgraph(state, county, silent, tsteps)
+@metrics.timedCallback
+def updateprojections(state, county,
+            silent, tsteps, betasource, epimodel, n_intervals, jobid):
+    """The only modelling callback on the server. Each region is
+    solved once, its SIR graph and projection store are built from
+    the same solution, and the other graphs are rendered from the
+    stores client-side.
+
+    Long projections are handed to the job queue when it's enabled.
+    The job id is kept in projection-job, and job-poll calls back
+    here until the job is done.
+    """
+    nochange = [dash.no_update]*4
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if triggered==['job-poll.n_intervals']:
+        job = jobqueue.status(jobid) if (jobqueue and jobid) else None
+        if job is None:
+            return nochange + [None, True, None]
+        if job['status']=='done':
+            return joboutputs(job['result']) + [None, True, None]
+        if job['status']=='failed':
+            return nochange + [None, True, dbc.Alert('Projection failed', color='danger')]
+        return nochange + [dash.no_update, dash.no_update, jobprogress(job)]
+
+    regions = []
+    # the state changed and a county in it hasn't been picked yet
+    if county in appdata.uscountylist[state]:
+        regions.append('county')
+    # state projection doesn't depend on the county
+    if triggered!=['county-dropdown.value']:
+        regions.append('state')
+
+    if jobqueue and (tsteps or 0) >= job_tsteps:
+        jobid = jobqueue.submit('projections', {
+            'state': state, 'county': county, 'silent': silent,
+            'tsteps': tsteps, 'regions': regions, 'betasource': betasource,
+            'epimodel': epimodel,
+            'date': date.today().isoformat()
+        }, job_workers, scenarioversions())
+        job = jobqueue.status(jobid)
+        if job['status']=='done':
+            return joboutputs(job['result']) + [None, True, None]
+        return nochange + [jobid, False, jobprogress(job)]
+
+    outputs = projectionoutputs(state, county, silent, tsteps, regions, betasource, epimodel)
+    # a synchronous result replaces any job still running
+    return joboutputs(outputs) + [None, True, None]
+
+def regionlabel(region):
+    """Dropdown values are 'county:State|County', 'state:State'
+    or 'group:Name'. Exports also take 'counties:State', every
+    county of the state as a separate region.
+    """
+    kind, name = region.split(':', 1)
+    if kind=='county':
+        state, county = name.split('|')
+        return county + ', ' + state
+    return name
 
 @app.callback(
-    Output(component_id='statesir-graph', component_property='figure'),
-    [
-        Input('state-dropdown', 'value'),
-        Input('county-dropdown', 'value'),
-        Input('silent-slider', 'value'),
-        Input('tsteps', 'value')
-    ]
+    Output('compare-dropdown', 'options'),
+    [Input('state-dropdown', 'value')],
+    [State('compare-dropdown', 'value')]
 )
-def statesirgraph(state, county,
-            silent,tsteps):
-    return sirgraph(state, 'All', silent, tsteps)
+def compareoptions(state, selected):
+    """Groups, states and the counties of the selected state, plus
+    anything already picked, so the option list stays short.
+    """
+    regions = ['group:' + name for name in appdata.regiongroups['group'].unique()]
+    regions += ['state:' + name for name in appdata.states]
+    regions += [
+        'county:' + state + '|' + county
+        for county in sorted(appdata.uscountylist[state])
+    ]
+    regions += [region for region in selected or [] if region not in regions]
+    return [{'label': regionlabel(region), 'value': region} for region in regions]
+
+def checkregion(region):
+    """Raises ValueError unless region (as in comparisongroups) is in
+    the data
+    """
+    kind, name = region.split(':', 1) if ':' in region else (None, region)
+    # uscountylist is a defaultdict, so check membership
+    if kind=='county':
+        state, county = name.split('|', 1) if '|' in name else (name, None)
+        if state not in appdata.uscountylist or county not in appdata.uscountylist[state]:
+            raise ValueError('unknown county ' + name)
+    elif kind in ('state', 'counties'):
+        if name not in appdata.uscountylist:
+            raise ValueError('unknown state ' + name)
+    elif kind=='group':
+        if name not in set(appdata.regiongroups['group']):
+            raise ValueError('unknown group ' + name)
+    else:
+        raise ValueError('unknown region ' + region)
+
+def comparisongroups(regions):
+    """The counties in each region, as a groups table for rollup"""
+    groups = []
+    for region in regions:
+        kind, name = region.split(':', 1)
+        label = regionlabel(region)
+        if kind=='county':
+            state, county = name.split('|')
+            groups.append((label, state, county, 1.0))
+        elif kind=='state':
+            groups += [(label, name, county, 1.0) for county in appdata.uscountylist[name]]
+        elif kind=='counties':
+            groups += [
+                (county + ', ' + name, name, county, 1.0)
+                for county in sorted(appdata.uscountylist[name])
+            ]
+        else:
+            members = appdata.regiongroups[appdata.regiongroups['group']==name]
+            groups += [
+                (label, row.state, row.county, row.weight)
+                for row in members.itertuples()
+            ]
+    return pd.DataFrame(groups, columns=['group', 'state', 'county', 'weight'])
+
+@lru_cache(maxsize=8)
+def countyprojections(counties, silent, tsteps, epimodel='SIR', betasource='doubling'):
+    """Batched projections of a tuple of (state, county)"""
+    return cogic.batchProject(list(counties), silent, tsteps, epimodel, betasource=betasource)
+
+def comparison(regions, silent, tsteps, model, hosp_LOS, ICU_LOS,
+               hosprate, icurate, deathrate, epimodel='SIR', betasource='doubling'):
+    """Census, admissions and death figures with a trace per region,
+    and the summary table. Every county involved is solved in one
+    batch and the regions are rolled up from them.
+    """
+    groups = comparisongroups(regions)
+    with metrics.timed('compare-solve'):
+        projections = countyprojections(
+            tuple(sorted(set(zip(groups['state'], groups['county'])))), silent, tsteps,
+            epimodel, betasource)
+    with metrics.timed('rollup'):
+        rolled = projections.rollup(groups)
+
+    rates = (model, hosp_LOS, ICU_LOS, hosprate, icurate, deathrate)
+    curves = {name: regionCurves(proj, *rates) for name, proj in rolled.items()}
+    dates = dateaxis(date.today(), tsteps)
+
+    def figure(curve, layout, title):
+        return {
+            'data': [
+                {
+                    **dates,
+                    'y': payloadvalues(np.round(values[curve])),
+                    'mode': 'line',
+                    'name': name
+                } for name, values in curves.items()
+            ],
+            'layout': {**layout, 'title': {'text': title}}
+        }
+
+    table = summary(rolled, *rates)
+    rows = [
+        {
+            'Region': name,
+            'Population': '{:,.0f}'.format(row['population']),
+            'Peak census': '{:,.0f}'.format(row['peak hospital census']),
+            'Peak date': (date.today() + timedelta(days=int(row['peak day']))).isoformat(),
+            'Peak ICU census': '{:,.0f}'.format(row['peak ICU census']),
+            'Total deaths': '{:,.0f}'.format(row['deaths'])
+        } for name, row in table.iterrows()
+    ]
+    return [
+        figure('census', censuslayout('Compared regions'), 'Compared regions - Hospital Census'),
+        figure('admissions', admissionslayout(), 'Hospital admissions'),
+        figure('deaths', deathlayout(), 'Deaths'),
+        rows
+    ]
 
 @app.callback(
-    Output(component_id='statemodel-graph', component_property='figure'),
     [
-        Input('state-dropdown', 'value'),
-        Input('county-dropdown', 'value'),
-        Input('silent-slider', 'value'),
-        Input('hospitalizationrate-slider', 'value'),
-        Input('icurate-slider', 'value'),
-        Input('deathrate-slider', 'value'),
-        Input('hospmodel', 'value'),
-        Input('hosp_LOS', 'value'),
-        Input('ICU_LOS', 'value'),
-        Input('tsteps', 'value')
+        Output('compare-census-graph', 'figure'),
+        Output('compare-admissions-graph', 'figure'),
+        Output('compare-death-graph', 'figure'),
+        Output('compare-table', 'data')
+    ],
+    [
+        Input('compare-dropdown', 'value'),
+        Input('compare-button', 'n_clicks')
+    ],
+    [
+        State('silent-slider', 'value'),
+        State('tsteps', 'value'),
+        State('hospmodel', 'value'),
+        State('hosp_LOS', 'value'),
+        State('ICU_LOS', 'value'),
+        State('hospitalizationrate-slider', 'value'),
+        State('icurate-slider', 'value'),
+        State('deathrate-slider', 'value'),
+        State('epi-model', 'value'),
+        State('beta-source', 'value')
     ]
 )
-def statecensusgraph(state, county,
-            silent, hosprate, icurate, deathrate, model,
-            hosp_LOS, ICU_LOS, tsteps):
-    return censusgraph(state, 'All', silent,
-        hosprate, icurate, deathrate,
-        hosp_LOS, ICU_LOS, tsteps, state, model)
+@metrics.timedCallback
+def updatecomparison(regions, n_clicks, *controls):
+    if not regions:
+        raise dash.exceptions.PreventUpdate
+    return scenario('comparison', {'regions': regions, 'controls': controls},
+                    lambda: comparison(regions, *controls))
+
+@application.route('/export.<fmt>')
+def exportprojections(fmt):
+    """Projected series of the regions given by region= parameters
+    (values as in the comparison dropdown), or of every county if
+    there are none, as CSV, Excel or Parquet. The other parameters
+    are the controls, with the same defaults.
+    """
+    args = flask.request.args
+    try:
+        exportData.checkFormat(fmt)
+        controls = dict(
+            silent = float(args.get('silent', 0.5)),
+            tsteps = int(args.get('tsteps', 200)),
+            model = args.get('model', 'Verity'),
+            hosp_LOS = int(args.get('hosp_LOS', 7)),
+            ICU_LOS = int(args.get('ICU_LOS', 9)),
+            hosprate = float(args.get('hosprate', 0.025)),
+            icurate = float(args.get('icurate', 0.01)),
+            deathrate = float(args.get('deathrate', 0.005)),
+            epimodel = args.get('epimodel', 'SIR')
+        )
+        betasource = args.get('betasource', 'doubling')
+        # the same values a scenario link may set
+        choices = scenariochoices()
+        for name, value in [*controls.items(), ('betasource', betasource)]:
+            if name in choices and value not in choices[name]:
+                raise ValueError('{} must be one of {}'.format(
+                    name, ', '.join(sorted(choices[name]))))
+            if name in scenario_ranges and not (
+                    math.isfinite(value) and scenario_ranges[name](value)):
+                raise ValueError(name + ' is out of range')
+        regions = args.getlist('region') or [
+            'counties:' + state for state in sorted(appdata.uscountylist)
+        ]
+        # before the response starts, since a bad region would only
+        # fail once the download is streaming
+        for region in regions:
+            checkregion(region)
+        groups = comparisongroups(regions)
+    except (ValueError, KeyError) as e:
+        return flask.jsonify({'error': str(e)}), 400
+
+    chunks = exportData.exportChunks(
+        appdata.createcensus, appdata.uscountydata, groups, **controls,
+        regionrt=appdata.regionrt if betasource=='Rt' else None)
+    return flask.Response(
+        exportData.writers[fmt](chunks),
+        mimetype = exportData.formats[fmt],
+        headers = {'Content-Disposition': 'attachment; filename=cogic-projections.' + fmt}
+    )
+
+filecache = dict()
+
+def batchresult(path, build):
+    """build(path) for a file written by a nightly batch, kept until
+    the file changes. None if there's no file.
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    if path not in filecache or filecache[path][0]!=mtime:
+        filecache[path] = (mtime, build(path))
+    return filecache[path][1]
+
+def capacitytable():
+    """The time to capacity table written by the nightly batch (see
+    bedCapacity.py) and its parameters
+    """
+    return batchresult(capacity_cache, loadCapacityCache) or (None, None)
+
+@application.route('/capacity.csv')
+def capacitycsv():
+    if not os.path.exists(capacity_cache):
+        flask.abort(404)
+    return flask.send_file(os.path.abspath(capacity_cache), mimetype='text/csv',
+                           as_attachment=True, download_name='time_to_capacity.csv')
 
 @app.callback(
-    Output(component_id='countymodel-graph', component_property='figure'),
     [
-        Input('state-dropdown', 'value'),
-        Input('county-dropdown', 'value'),
-        Input('silent-slider', 'value'),
-        Input('hospitalizationrate-slider', 'value'),
-        Input('icurate-slider', 'value'),
-        Input('deathrate-slider', 'value'),
-        Input('hospmodel', 'value'),
-        Input('hosp_LOS', 'value'),
-        Input('ICU_LOS', 'value'),
-        Input('tsteps', 'value')
+        Output('capacity-table', 'columns'),
+        Output('capacity-table', 'data'),
+        Output('capacity-table', 'page_count'),
+        Output('capacity-info', 'children')
+    ],
+    [
+        Input('capacity-table', 'page_current'),
+        Input('capacity-table', 'page_size'),
+        Input('capacity-table', 'sort_by')
     ]
 )
-def countycensusgraph(state, county,
-            silent, hosprate, icurate, deathrate, model,
-            hosp_LOS, ICU_LOS, tsteps):
-    return censusgraph(state, county, silent,
-        hosprate, icurate, deathrate,
-        hosp_LOS, ICU_LOS, tsteps, (county+' County'), model)
+def capacitypage(page, pagesize, sortby):
+    table, params = capacitytable()
+    if table is None:
+        return [], [], 1, 'No bed capacity data. Run bedCapacity.py to compute it.'
+    if sortby:
+        table = table.sort_values(
+            sortby[0]['column_id'], ascending=sortby[0]['direction']=='asc',
+            na_position='last')
+    page, pagesize = page or 0, pagesize or capacity_page_size
+    rows = table.iloc[page*pagesize:(page + 1)*pagesize]
+    info = 'Computed {} for {} days, {} model, {:.0%} asymptomatic/untested.'.format(
+        params.get('computed', '?'), params.get('tsteps', '?'),
+        params.get('model', '?'), params.get('silent', 0))
+    return (
+        [{'name': c, 'id': c} for c in table.columns],
+        rows.where(rows.notna(), None).to_dict('records'),
+        max(1, -(-len(table)//pagesize)),
+        info
+    )
+
+def maptable():
+    """The county metrics written by the nightly batch (see
+    countyMap.py), with the FIPS codes of the shapes and the row of
+    each
+    """
+    def build(path):
+        table, params = loadCapacityCache(path)
+        locations, rows = countyMap.mapLocations(table, countyshapes())
+        return dict(table=table, params=params, locations=locations, rows=rows)
+    return batchresult(countyMap.metrics_cache, build)
+
+@lru_cache(maxsize=1)
+def countyshapes():
+    """The simplified county shapes, loaded once"""
+    return countyMap.loadShapes()
+
+@lru_cache(maxsize=1)
+def countyshapesjson():
+    return json.dumps(countyshapes(), separators=(',', ':'))
+
+@application.route('/counties.geojson')
+def countiesgeojson():
+    # served on its own so the browser fetches the shapes once, and
+    # the map figure only carries the values
+    if countyshapes() is None:
+        flask.abort(404)
+    response = flask.Response(countyshapesjson(), mimetype='application/geo+json')
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
 
 @app.callback(
-    Output(component_id='countyadmissions-graph', component_property='figure'),
     [
+        Output('county-map', 'figure'),
+        Output('map-info', 'children')
+    ],
+    [Input('map-metric', 'value')]
+)
+@metrics.timedCallback
+def mapfigure(metric):
+    if countyshapes() is None:
+        return {}, 'No county shapes. Set COGIC_COUNTY_GEOJSON to a county GeoJSON file.'
+    cached = maptable()
+    if cached is None:
+        return {}, 'No county metrics. Run countyMap.py to compute them.'
+    values = cached['table'][metric].values[cached['rows']]
+    shown = ~np.isnan(values)
+    style = dict(countyMap.metrics[metric])
+    title = style.pop('title')
+    if 'zmid' not in style and shown.any():
+        # past the 98th percentile is all the same color
+        style.update(zmin=np.nanmin(values), zmax=np.nanpercentile(values, 98))
+    figure = {
+        'data': [dict(
+            type = 'choropleth',
+            geojson = '/counties.geojson',
+            featureidkey = 'id',
+            locations = np.array(cached['locations'])[shown],
+            z = values[shown].round(3),
+            marker = {'line': {'width': 0}},
+            colorbar = {'title': title},
+            **style
+        )],
+        'layout': dict(
+            geo = {'scope': 'usa', 'projection': {'type': 'albers usa'}},
+            margin = {'l': 0, 'r': 0, 't': 0, 'b': 0},
+            height = 500,
+            uirevision = 'county-map'
+        )
+    }
+    params = cached['params']
+    info = 'Computed {} for {} days, {:.0%} asymptomatic/untested, {} counties.'.format(
+        params.get('computed', '?'), params.get('tsteps', '?'), params.get('silent', 0),
+        shown.sum())
+    return figure, info
+
+app.clientside_callback(
+    ClientsideFunction(namespace='cogic', function_name='exportLinks'),
+    [
+        Output('export-county', 'href'),
+        Output('export-state', 'href'),
+        Output('export-compare', 'href')
+    ],
+    [
+        Input('export-format', 'value'),
         Input('state-dropdown', 'value'),
         Input('county-dropdown', 'value'),
+        Input('compare-dropdown', 'value'),
         Input('silent-slider', 'value'),
-        Input('hospitalizationrate-slider', 'value'),
-        Input('icurate-slider', 'value'),
-        Input('deathrate-slider', 'value'),
+        Input('tsteps', 'value'),
         Input('hospmodel', 'value'),
         Input('hosp_LOS', 'value'),
         Input('ICU_LOS', 'value'),
-        Input('tsteps', 'value')
-    ]
-)
-def countyadmissionsgraph(state, county,
-            silent, hosprate, icurate, deathrate, model,
-            hosp_LOS, ICU_LOS, tsteps):
-    return admissionsgraph(state, county, silent,
-        hosprate, icurate, deathrate,
-        hosp_LOS, ICU_LOS, tsteps, 'Admissions',model)
-
-@app.callback(
-    Output(component_id='stateadmissions-graph', component_property='figure'),
-    [
-        Input('state-dropdown', 'value'),
-        Input('county-dropdown', 'value'),
-        Input('silent-slider', 'value'),
         Input('hospitalizationrate-slider', 'value'),
         Input('icurate-slider', 'value'),
         Input('deathrate-slider', 'value'),
-        Input('hospmodel', 'value'),
-        Input('hosp_LOS', 'value'),
-        Input('ICU_LOS', 'value'),
-        Input('tsteps', 'value')
+        Input('epi-model', 'value'),
+        Input('beta-source', 'value')
     ]
 )
-def stateadmissionsgraph(state, county,
-            silent, hosprate, icurate, deathrate, model,
-            hosp_LOS, ICU_LOS, tsteps):
-    return admissionsgraph(state, 'All', silent,
-        hosprate, icurate, deathrate,
-        hosp_LOS, ICU_LOS, tsteps, 'Admissions', model)
 
-@app.callback(
-    Output(component_id='countydeath-graph', component_property='figure'),
-    [
-        Input('state-dropdown', 'value'),
-        Input('county-dropdown', 'value'),
-        Input('silent-slider', 'value'),
-        Input('deathrate-slider', 'value'),
-        Input('hospmodel', 'value'),
-        Input('tsteps', 'value')
-    ]
-)
-def countydeathgraph(state, county,
-            silent,deathrate, model, tsteps):
-    return deathgraph(state, county,
-            silent, deathrate,
-            tsteps,model)
+# Scenarios are shared as links with the controls in the query
+# string, named as in the export URLs, plus region= for each compared
+# region. The link is built client-side (scenarioLink), and opening
+# one sets the controls (loadscenario), whose projections then come
+# from the scenario store.
+scenario_controls = [
+    ('state-dropdown', 'state', str),
+    ('county-dropdown', 'county', str),
+    ('silent-slider', 'silent', float),
+    ('tsteps', 'tsteps', int),
+    ('beta-source', 'betasource', str),
+    ('epi-model', 'epimodel', str),
+    ('hospmodel', 'model', str),
+    ('hosp_LOS', 'hosp_LOS', int),
+    ('ICU_LOS', 'ICU_LOS', int),
+    ('hospitalizationrate-slider', 'hosprate', float),
+    ('icurate-slider', 'icurate', float),
+    ('deathrate-slider', 'deathrate', float),
+]
+
+def scenariochoices():
+    """The values allowed for the controls that have a fixed set"""
+    return {
+        'state': set(appdata.states),
+        'betasource': {'doubling', 'Rt'},
+        'epimodel': set(epimodels),
+        'model': {'Verity', 'CDC', 'Custom'},
+    }
+
+# the values allowed for the numeric controls
+scenario_ranges = {
+    'silent': lambda value: 0 <= value < 1,
+    'tsteps': lambda value: value >= 1,
+    'hosp_LOS': lambda value: value >= 1,
+    'ICU_LOS': lambda value: value >= 1,
+    'hosprate': lambda value: 0 <= value <= 1,
+    'icurate': lambda value: 0 <= value <= 1,
+    'deathrate': lambda value: 0 <= value <= 1,
+}
+
+def scenariovalues(search):
+    """Control values from a link's query string, no_update for any
+    that's missing, invalid or out of range
+    """
+    args = urllib.parse.parse_qs((search or '').lstrip('?'))
+    choices = scenariochoices()
+    values = []
+    for control, name, kind in scenario_controls:
+        try:
+            value = kind(args[name][0])
+        except (KeyError, ValueError):
+            value = None
+        if (value is None
+                or name in choices and value not in choices[name]
+                or kind is float and not math.isfinite(value)
+                or name in scenario_ranges and not scenario_ranges[name](value)):
+            value = dash.no_update
+        values.append(value)
+    values.append(args.get('region', dash.no_update))
+    return values
 
 @app.callback(
-    Output(component_id='statedeath-graph', component_property='figure'),
-    [
-        Input('state-dropdown', 'value'),
-        Input('county-dropdown', 'value'),
-        Input('silent-slider', 'value'),
-        Input('deathrate-slider', 'value'),
-        Input('hospmodel', 'value'),
-        Input('tsteps', 'value')
-    ]
+    [Output(control, 'value') for control, name, kind in scenario_controls]
+    + [Output('compare-dropdown', 'value')],
+    [Input('url', 'search')]
 )
-def statedeathgraph(state, county,
-            silent,deathrate, model, tsteps):
-    return deathgraph(state, 'All',
-            silent, deathrate, tsteps,
-            model)
+@metrics.timedCallback
+def loadscenario(search):
+    if not search:
+        raise dash.exceptions.PreventUpdate
+    return scenariovalues(search)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='cogic', function_name='scenarioLink'),
+    Output('scenario-link', 'href'),
+    [Input(control, 'value') for control, name, kind in scenario_controls]
+    + [Input('compare-dropdown', 'value')]
+)
+
+# The census, admissions and death graphs are post-processed from the
+# projection stores in the browser, see assets/clientside.js
+for region in ['county', 'state']:
+    app.clientside_callback(
+        ClientsideFunction(namespace='cogic', function_name='censusFigure'),
+        Output(region + 'model-graph', 'figure'),
+        [
+            Input(region + '-projection', 'data'),
+            Input('hospitalizationrate-slider', 'value'),
+            Input('icurate-slider', 'value'),
+            Input('hosp_LOS', 'value'),
+            Input('ICU_LOS', 'value'),
+            Input('hospmodel', 'value')
+        ]
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace='cogic', function_name='admissionsFigure'),
+        Output(region + 'admissions-graph', 'figure'),
+        [
+            Input(region + '-projection', 'data'),
+            Input('hospitalizationrate-slider', 'value'),
+            Input('icurate-slider', 'value'),
+            Input('hospmodel', 'value')
+        ]
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace='cogic', function_name='deathFigure'),
+        Output(region + 'death-graph', 'figure'),
+        [
+            Input(region + '-projection', 'data'),
+            Input('deathrate-slider', 'value'),
+            Input('hospmodel', 'value')
+        ]
+    )
+
+# /metrics and Server-Timing headers, if COGIC_METRICS=1
+metrics.install(app)
+# request profiling, see profiling.py
+profiling.install(app)
 
 if __name__ == '__main__':
+    print(startuptimer.report())
 
     application.run(debug=True)
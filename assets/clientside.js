@@ -0,0 +1,217 @@
+// Client-side post-processing of the SIR projections.
+//
+// Admissions, census and deaths are linear in the projected incidence,
+// delayed to each outcome category (see outcomeModels.py), so the server
+// only sends those once per region/asymptomatic fraction/days to project
+// (see projectionstore() in application.py) and the rate and
+// length-of-stay controls are applied here. Each function mirrors its
+// python counterpart (censusfigure, admissionsfigure, deathfigure).
+
+// same as np.round, which rounds halves to even
+function roundHalfEven(x) {
+    var r = Math.round(x);
+    if (Math.abs(x % 1) === 0.5 && r % 2 !== 0) {
+        r -= 1;
+    }
+    return r;
+}
+
+function cumsum(y) {
+    var total = 0;
+    return y.map(function(v) { return total += v; });
+}
+
+// x values are either a list of dates or a start date and step,
+// see dateaxis() in application.py
+function trace(projection, props) {
+    return Object.assign({}, projection.xaxis, props);
+}
+
+function scale(y, rate) {
+    return y.map(function(v) { return roundHalfEven(v * rate); });
+}
+
+// incidence delayed to the outcome category of a rate table column,
+// as outcomeModels.category
+function incidence(projection, key) {
+    var name = 'Hospitalized';
+    ['ICU', 'Deaths'].forEach(function(prefix) {
+        if (key.indexOf(prefix) === 0) {
+            name = prefix;
+        }
+    });
+    return projection.incidence[name];
+}
+
+function admissionRates(projection, hosprate, icurate, model) {
+    if (model in projection.admissionrates) {
+        return projection.admissionrates[model];
+    }
+    return {'Hospitalized': hosprate, 'ICU': icurate};
+}
+
+function deathRates(projection, deathrate, model) {
+    if (model in projection.deathrates) {
+        return projection.deathrates[model];
+    }
+    return {'Deaths': deathrate};
+}
+
+// census is the sum of admissions over the last LOS days
+function census(admissions, los) {
+    var cumsum = 0;
+    var shifted = 0;
+    return admissions.map(function(v, i) {
+        cumsum += v;
+        if (i >= los) {
+            shifted += admissions[i - los];
+        }
+        return cumsum - shifted;
+    });
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    cogic: {
+        censusFigure: function(projection, hosprate, icurate, hosp_LOS, ICU_LOS, model) {
+            if (!projection || hosp_LOS == null || ICU_LOS == null) {
+                return window.dash_clientside.no_update;
+            }
+            var rates = admissionRates(projection, hosprate, icurate, model);
+            var traces = Object.keys(rates).map(function(col) {
+                var los = parseInt(col.indexOf('ICU') === 0 ? ICU_LOS : hosp_LOS);
+                return trace(projection, {
+                    'y': census(scale(incidence(projection, col), rates[col]), los),
+                    'mode': 'line',
+                    'opacity': 0.7,
+                    'line': {
+                        'color': col.indexOf('Hospit') >= 0 ? 'orange' : 'red',
+                        'width': 4,
+                        'opacity': 0.5
+                    },
+                    'fill': col.indexOf('high') >= 0 ? 'tonexty' : null,
+                    'id': col + ' Census',
+                    'name': col + ' Census',
+                    'showlegend': true
+                });
+            });
+            return {'data': traces, 'layout': projection.layouts.census};
+        },
+
+        admissionsFigure: function(projection, hosprate, icurate, model) {
+            if (!projection) {
+                return window.dash_clientside.no_update;
+            }
+            var rates = admissionRates(projection, hosprate, icurate, model);
+            var traces = Object.keys(rates).map(function(dispo) {
+                return trace(projection, {
+                    'y': scale(incidence(projection, dispo), rates[dispo]),
+                    'type': 'line',
+                    'opacity': 0.7,
+                    'line': {
+                        'width': 4,
+                        'opacity': 0.5,
+                        'color': dispo.indexOf('Hospit') >= 0 ? 'orange' : 'red'
+                    },
+                    'id': dispo + ' per day',
+                    'name': dispo + ' per day',
+                    'showlegend': false,
+                    'fill': dispo.indexOf('high') >= 0 ? 'tonexty' : null
+                });
+            });
+            return {'data': traces, 'layout': projection.layouts.admissions};
+        },
+
+        deathFigure: function(projection, deathrate, model) {
+            if (!projection) {
+                return window.dash_clientside.no_update;
+            }
+            var rates = deathRates(projection, deathrate, model);
+            var deathtraces = [];
+            var deathratetraces = [];
+            Object.keys(rates).forEach(function(key) {
+                var daily = incidence(projection, key).map(function(v) {
+                    return v * rates[key];
+                });
+                deathtraces.push(trace(projection, {
+                    'y': cumsum(daily).map(roundHalfEven),
+                    'mode': 'line',
+                    'opacity': 0.7,
+                    'line': {
+                        'color': 'orange',
+                        'width': 4,
+                        'opacity': 0.5
+                    },
+                    'id': key,
+                    'name': key,
+                    'showlegend': true,
+                    'fill': key.indexOf('high') >= 0 ? 'tonexty' : null
+                }));
+                deathratetraces.push(trace(projection, {
+                    'y': daily.map(roundHalfEven),
+                    'type': 'bar',
+                    'opacity': 0.7,
+                    'color': 'red',
+                    'bar': {
+                        'width': 4,
+                        'opacity': 0.5
+                    },
+                    'id': key + ' per day',
+                    'name': key + ' per day',
+                    'showlegend': true
+                }));
+            });
+            return {
+                'data': deathtraces.concat(deathratetraces),
+                'layout': projection.layouts.deaths
+            };
+        },
+
+        exportLinks: function(format, state, county, compare, silent, tsteps,
+                              model, hosp_LOS, ICU_LOS, hosprate, icurate, deathrate,
+                              epimodel, betasource) {
+            var controls = {
+                'silent': silent, 'tsteps': tsteps, 'model': model,
+                'hosp_LOS': hosp_LOS, 'ICU_LOS': ICU_LOS,
+                'hosprate': hosprate, 'icurate': icurate, 'deathrate': deathrate,
+                'epimodel': epimodel, 'betasource': betasource
+            };
+            function href(regions) {
+                var params = regions.map(function(region) {
+                    return 'region=' + encodeURIComponent(region);
+                });
+                Object.keys(controls).forEach(function(key) {
+                    params.push(key + '=' + encodeURIComponent(controls[key]));
+                });
+                return '/export.' + format + '?' + params.join('&');
+            }
+            return [
+                href(['county:' + state + '|' + county]),
+                href(['counties:' + state]),
+                (compare && compare.length) ? href(compare) : null
+            ];
+        },
+
+        // link to the scenario, in the order of scenario_controls in
+        // application.py, see loadscenario
+        scenarioLink: function(state, county, silent, tsteps, betasource, epimodel,
+                               model, hosp_LOS, ICU_LOS, hosprate, icurate, deathrate,
+                               compare) {
+            var controls = {
+                'state': state, 'county': county, 'silent': silent, 'tsteps': tsteps,
+                'betasource': betasource, 'epimodel': epimodel, 'model': model,
+                'hosp_LOS': hosp_LOS, 'ICU_LOS': ICU_LOS,
+                'hosprate': hosprate, 'icurate': icurate, 'deathrate': deathrate
+            };
+            var params = [];
+            Object.keys(controls).forEach(function(key) {
+                if (controls[key] !== null && controls[key] !== undefined) {
+                    params.push(key + '=' + encodeURIComponent(controls[key]));
+                }
+            });
+            (compare || []).forEach(function(region) {
+                params.push('region=' + encodeURIComponent(region));
+            });
+            return '?' + params.join('&');
+        }
+    }
+});
@@ -0,0 +1,205 @@
+# backtest.py
+
+"""
+Backtests of the county projections against the cases and deaths that
+were later reported.
+
+For each cutoff date, every county is projected the way the app would
+have projected it on that date: the transmission rate estimated from
+its state's cases in the week up to the cutoff, and the county's cases
+on the cutoff as I0. The new cases and deaths projected over each
+horizon are then compared with those observed.
+
+The counts the projections start from are cleaned as of each cutoff
+(caseCleaning.AsOfCleaner), from the raw counts up to it: cleaning the
+whole series fills gaps and corrects drops with counts reported after
+the cutoff, which the app couldn't have known. The observed counts are
+the whole series cleaned.
+
+All the cutoffs and counties are solved together with
+compartmentModels.solve (with the SIR model, or any other in
+compartmentModels.models), and the state transmission rates of every
+cutoff are estimated at once from the growth of their cases.
+
+Projected cases are the reported fraction (1 - silent) of new
+infections. Projected deaths use the death rates of model, with low
+and high estimates, and the delay from infection to death, as in the
+app (see outcomeModels.py).
+
+Usage:
+    python backtest.py [--step 7] [--horizons 7 14 21 28] [--epimodel SIR] [--groups groups.csv]
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from caseCleaning import AsOfCleaner, cleanFrame
+from compartmentModels import models, solve
+from outcomeModels import delayedIncidence, pastIncidence, max_delay
+from regionGroups import populationKeys, stateGroups, loadRegionGroups
+from memoryBudget import chunkSize
+
+horizons = (7, 14, 21, 28)
+# regions solved per solve call, at most (fewer if they don't fit in
+# the memory budget, see memoryBudget.py)
+chunk_regions = 20000
+
+def cutoffIndices(days, maxhorizon, step=7, window=7):
+    """Row indices of the cutoffs: every step days counting back from
+    the last day that has maxhorizon days of data after it, and with
+    window days of data up to it.
+    """
+    last = days - 1 - maxhorizon
+    return np.arange(last, window - 2, -step)[::-1]
+
+def backtest(createcensus, uscountydata, silent, horizons=horizons, step=7,
+             cutoffs=None, model='Verity', epimodel='SIR'):
+    """Projected and observed new cases and deaths of every county,
+    for each cutoff (every step days, or the dates in cutoffs) and
+    horizon, from raw counts (loadCountyData(raw=True)). Returns a
+    DataFrame with a row per cutoff, county and horizon.
+    """
+    raw = uscountydata.xs('Confirmed', axis=1, level=-1)
+    asof = AsOfCleaner(raw.values)
+    confirmed = cleanFrame(raw)
+    deaths = cleanFrame(uscountydata.xs('Deaths', axis=1, level=-1))
+    horizons = np.asarray(horizons)
+    if cutoffs is None:
+        cut = cutoffIndices(len(confirmed), horizons.max(), step)
+    else:
+        cut = confirmed.index.get_indexer(pd.Index(cutoffs))
+        cut = cut[(cut >= 6) & (cut + horizons.max() < len(confirmed))]
+
+    # transmission rate of each state at each cutoff, from the week up
+    # to it, shape (cutoffs, states)
+    statenames, statecolumns = np.unique(raw.columns.get_level_values(0), return_inverse=True)
+    statecases = np.zeros((len(cut), len(statenames), 7))
+    for i, c in enumerate(cut):
+        np.add.at(statecases[i], statecolumns, asof.counts(c, np.arange(raw.shape[1]), 7))
+    epi = models[epimodel]
+    params = epi.parameters()
+    statebeta = epi.transmissionRate(statecases, params)
+
+    popstructure = createcensus.us_popstructure
+    found, popkeys = populationKeys(popstructure, confirmed.columns)
+    counties = confirmed.columns[found]
+    N = popstructure[popkeys].sum().values
+    states = statecolumns[found]
+    columns = np.nonzero(found)[0]
+
+    # (cutoffs, counties) arrays
+    beta = statebeta[:, states]
+    cases = confirmed.values[:, found]
+    I0 = asof.counts(cut[:, None], columns, 1)[..., 0]/(1 - silent)
+    solvable = np.isfinite(beta) & (I0 > 0)
+
+    # new infections and (delayed) infections leading to death by
+    # each horizon, of the solvable (cutoff, county) pairs only
+    which = np.nonzero(solvable)
+    t = np.arange(horizons.max() + 1)
+    infected = np.empty((len(which[0]), len(horizons)))
+    dying = np.empty_like(infected)
+    size = min(chunk_regions, chunkSize(len(t), len(epi.compartments)))
+    for i in range(0, len(which[0]), size):
+        c, k = which[0][i:i + size], which[1][i:i + size]
+        sol = solve(epi, beta[c, k], N[k], I0[c, k], t, **params)
+        infected[i:i + len(c)] = sol['S'][:, :1] - sol['S'][:, horizons]
+        history = pastIncidence(asof.counts(cut[c], columns[k], max_delay + 1), silent)
+        daily = delayedIncidence(sol['Inew'], history, ['Deaths'])['Deaths']
+        # deaths after the cutoff day
+        dying[i:i + len(c)] = np.cumsum(daily[:, 1:], axis=1)[:, horizons - 1]
+
+    deathrates = createcensus.calcCountyRateTables(popkeys)[model]['deaths']
+    c, k = which
+    after = cut[c][:, None] + horizons
+    dead = deaths.values[:, found]
+    return pd.DataFrame({
+        'cutoff': np.repeat(confirmed.index[cut[c]], len(horizons)),
+        'state': np.repeat(counties.get_level_values(0)[k], len(horizons)),
+        'county': np.repeat(counties.get_level_values(1)[k], len(horizons)),
+        'horizon': np.tile(horizons, len(c)),
+        'observed cases': (cases[after, k[:, None]] - cases[cut[c], k][:, None]).ravel(),
+        'projected cases': ((1 - silent)*infected).ravel(),
+        'observed deaths': (dead[after, k[:, None]] - dead[cut[c], k][:, None]).ravel(),
+        'projected deaths low': (deathrates['Deaths-low'].values[k][:, None]*dying).ravel(),
+        'projected deaths high': (deathrates['Deaths-high'].values[k][:, None]*dying).ravel(),
+    })
+
+def rollupResults(results, groups):
+    """backtest results summed over the counties of each group (see
+    regionGroups), with the group name in place of state and county
+    """
+    merged = results.merge(groups, on=['state', 'county'])
+    values = [c for c in results.columns if c.startswith(('observed', 'projected'))]
+    merged[values] = merged[values].multiply(merged['weight'], axis=0)
+    return merged.groupby(['group', 'cutoff', 'horizon'])[values].sum().reset_index()
+
+def errorMetrics(results, by=('horizon',)):
+    """Error of the projected new cases and deaths, over the cutoffs
+    (and regions) in each group of results by the columns in by:
+    mean error (bias), mean absolute error, weighted absolute
+    percentage error (total absolute error over total observed), and
+    for deaths the fraction observed within the low-high range.
+    """
+    frame = pd.DataFrame({
+        'cases error': results['projected cases'] - results['observed cases'],
+        'deaths error': results['projected deaths high'] - results['observed deaths'],
+        'deaths in range': (
+            (results['observed deaths'] >= results['projected deaths low'])
+            & (results['observed deaths'] <= results['projected deaths high'])
+        ),
+        'observed cases': results['observed cases'],
+        'observed deaths': results['observed deaths'],
+    })
+    frame['cases abs error'] = frame['cases error'].abs()
+    frame['deaths abs error'] = frame['deaths error'].abs()
+    grouped = frame.groupby([results[column] for column in by])
+    means = grouped.mean()
+    totals = grouped.sum()
+    return pd.DataFrame({
+        'n': grouped.size(),
+        'cases bias': means['cases error'],
+        'cases MAE': means['cases abs error'],
+        'cases WAPE': totals['cases abs error']/totals['observed cases'],
+        'deaths bias': means['deaths error'],
+        'deaths MAE': means['deaths abs error'],
+        'deaths WAPE': totals['deaths abs error']/totals['observed deaths'],
+        'deaths in range': means['deaths in range'],
+    })
+
+if __name__ == '__main__':
+    from hospCensusModels import HospitalCensus
+    from loadCaseData import loadCountyData
+
+    parser = argparse.ArgumentParser(description='Backtest the county projections')
+    parser.add_argument('--silent', type=float, default=0.5,
+                        help='fraction of infections asymptomatic/untested')
+    parser.add_argument('--step', type=int, default=7, help='days between cutoffs')
+    parser.add_argument('--horizons', type=int, nargs='+', default=list(horizons))
+    parser.add_argument('--model', default='Verity', choices=['Verity', 'CDC'])
+    parser.add_argument('--epimodel', default='SIR', choices=list(models))
+    parser.add_argument('--groups', help='region groups CSV, for errors by group '
+                        'rather than by state')
+    parser.add_argument('--output', help='CSV for the county results')
+    opts = parser.parse_args()
+
+    uscountydata = loadCountyData(raw=True)
+    results = backtest(HospitalCensus(), uscountydata, opts.silent, opts.horizons,
+                       opts.step, model=opts.model, epimodel=opts.epimodel)
+    if opts.output:
+        results.to_csv(opts.output, index=False)
+
+    if opts.groups:
+        groups = loadRegionGroups(opts.groups)
+    else:
+        groups = stateGroups(pd.MultiIndex.from_frame(results[['state', 'county']].drop_duplicates()))
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_columns', None)
+    print('{} cutoffs, {} counties'.format(
+        results['cutoff'].nunique(), len(results[['state', 'county']].drop_duplicates())))
+    print('\nAll counties')
+    print(errorMetrics(results).round(3))
+    print('\nBy region')
+    print(errorMetrics(rollupResults(results, groups), ['group', 'horizon']).round(3))
@@ -0,0 +1,193 @@
+# bedCapacity.py
+
+"""
+Time to capacity: the first day the projected hospital and ICU census
+of each county, or group of counties, exceeds its beds.
+
+Bed files are CSV with columns state, county, staffed_beds and
+icu_beds, a row per county or per hospital (rows for the same county
+are summed). Rows can instead name a group of counties from a region
+groups file (see regionGroups.py) in a group column, for capacity
+that's only known by hospital region.
+
+Every county is projected at once with regionGroups.CountyProjections
+(or a chunk at a time within the memory budget, see memoryBudget.py)
+and the crossing days are found for all of them together. This is
+meant to run as a nightly batch, which writes the table to the cache
+directory (COGIC_CACHE_DIR, default cache/) for the app to serve:
+
+    python bedCapacity.py beds.csv [--groups groups.csv] [--tsteps 365] [--budget 1024]
+"""
+
+import os
+import json
+import argparse
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from regionGroups import (CountyProjections, addRollups, laggedCensus, projectionChunks,
+                          regionCurves, splitRollup)
+
+cache_dir = os.environ.get('COGIC_CACHE_DIR', 'cache')
+capacity_cache = os.path.join(cache_dir, 'time_to_capacity.csv')
+
+def loadBedCapacity(path):
+    """Beds by county and by group, as two DataFrames indexed by
+    (state, county) and group name.
+    """
+    beds = pd.read_csv(path)
+    if 'group' not in beds:
+        beds['group'] = np.nan
+    columns = ['staffed_beds', 'icu_beds']
+    bygroup = beds['group'].notna()
+    counties = beds[~bygroup].groupby(['state', 'county'])[columns].sum()
+    groups = beds[bygroup].groupby('group')[columns].sum()
+    return counties, groups
+
+def firstCrossing(values, thresholds):
+    """Index of the first column of each row of values that is above
+    the row's threshold, NaN if it never is (or the threshold is NaN).
+    """
+    above = values > thresholds[:, None]
+    first = above.argmax(axis=1).astype(float)
+    first[~above.any(axis=1)] = np.nan
+    return first
+
+def countyCensus(projections, model, hosp_LOS, ICU_LOS):
+    """Hospital and ICU census of every county, arrays of shape
+    (counties, days), with the high estimates of model.
+    """
+    admissions = projections.ratetables[model]['admissions']
+    delayed = projections.delayed
+    return (
+        laggedCensus(admissions['Hospitalized-high'].values[:, None]*delayed['Hospitalized'],
+                     hosp_LOS),
+        laggedCensus(admissions['ICU-high'].values[:, None]*delayed['ICU'], ICU_LOS)
+    )
+
+def capacityTable(names, census, icucensus, beds, icubeds, start):
+    days = firstCrossing(census, beds)
+    icudays = firstCrossing(icucensus, icubeds)
+
+    def crossingdate(day):
+        return None if np.isnan(day) else (start + timedelta(days=int(day))).isoformat()
+
+    return pd.DataFrame({
+        'region': names,
+        'staffed beds': beds,
+        'ICU beds': icubeds,
+        'peak census': census.max(axis=1).round(),
+        'peak ICU census': icucensus.max(axis=1).round(),
+        'days to capacity': days,
+        'capacity date': [crossingdate(d) for d in days],
+        'days to ICU capacity': icudays,
+        'ICU capacity date': [crossingdate(d) for d in icudays],
+    })
+
+def timeToCapacity(projections, countybeds, groupbeds=None, groups=None,
+                   model='Verity', hosp_LOS=7, ICU_LOS=9, available=1.0,
+                   start=None):
+    """Time to capacity of every county in projections with beds in
+    countybeds, and of every group in groups with beds in groupbeds.
+    projections is a CountyProjections, or chunks of them (see
+    regionGroups.projectionChunks), which are gone through once, only
+    keeping the groups' series. available is the fraction of beds that
+    can be used for COVID-19 patients.
+    """
+    start = start or date.today()
+    if isinstance(projections, CountyProjections):
+        projections = [projections]
+    bygroup = groups is not None and groupbeds is not None and len(groupbeds)
+    if bygroup:
+        groups = groups[groups['group'].isin(groupbeds.index)]
+
+    tables, rolled, names = [], None, []
+    for chunk in projections:
+        census, icucensus = countyCensus(chunk, model, hosp_LOS, ICU_LOS)
+        beds = countybeds.reindex(chunk.counties)
+        hasbeds = beds['staffed_beds'].notna().values | beds['icu_beds'].notna().values
+        tables.append(capacityTable(
+            [county + ', ' + state for state, county in chunk.counties[hasbeds]],
+            census[hasbeds], icucensus[hasbeds],
+            available*beds['staffed_beds'].values[hasbeds],
+            available*beds['icu_beds'].values[hasbeds],
+            start
+        ))
+        if bygroup:
+            partial, names = chunk.rolledArrays(groups)
+            rolled = addRollups(rolled, partial)
+
+    if bygroup:
+        curves = {
+            name: regionCurves(proj, model, hosp_LOS, ICU_LOS)
+            for name, proj in splitRollup(rolled, names).items()
+        }
+        names = list(curves)
+        tables.append(capacityTable(
+            names,
+            np.array([curves[name]['census'] for name in names]),
+            np.array([curves[name]['ICU census'] for name in names]),
+            available*groupbeds['staffed_beds'].reindex(names).values,
+            available*groupbeds['icu_beds'].reindex(names).values,
+            start
+        ))
+
+    return pd.concat(tables, ignore_index=True).sort_values('days to capacity')
+
+def saveCapacityCache(table, params, path=capacity_cache):
+    """Writes the table, and the parameters it was computed with
+    alongside it, for the app to serve
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    table.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    with open(path + '.json', 'w') as f:
+        json.dump(params, f, indent=2)
+
+def loadCapacityCache(path=capacity_cache):
+    """The cached table and its parameters, or (None, None)"""
+    if not os.path.exists(path):
+        return None, None
+    params = dict()
+    if os.path.exists(path + '.json'):
+        with open(path + '.json') as f:
+            params = json.load(f)
+    return pd.read_csv(path), params
+
+if __name__ == '__main__':
+    from hospCensusModels import HospitalCensus
+    from loadCaseData import loadCountyData
+    from regionGroups import loadRegionGroups
+
+    parser = argparse.ArgumentParser(description='Time to bed capacity for every county')
+    parser.add_argument('beds', help='bed capacity CSV')
+    parser.add_argument('--groups', help='region groups CSV, for capacity by group')
+    parser.add_argument('--silent', type=float, default=0.5,
+                        help='fraction of infections asymptomatic/untested')
+    parser.add_argument('--tsteps', type=int, default=365, help='days to project')
+    parser.add_argument('--model', default='Verity', choices=['Verity', 'CDC'])
+    parser.add_argument('--hosp-LOS', type=int, default=7)
+    parser.add_argument('--ICU-LOS', type=int, default=9)
+    parser.add_argument('--available', type=float, default=1.0,
+                        help='fraction of beds available for COVID-19 patients')
+    parser.add_argument('--budget', type=float,
+                        help='megabytes to project at once (default COGIC_MEMORY_BUDGET)')
+    parser.add_argument('--output', default=capacity_cache)
+    opts = parser.parse_args()
+
+    countybeds, groupbeds = loadBedCapacity(opts.beds)
+    groups = loadRegionGroups(opts.groups) if opts.groups else None
+    projections = projectionChunks(HospitalCensus(), loadCountyData(), opts.silent, opts.tsteps,
+                                   budget=opts.budget)
+    table = timeToCapacity(projections, countybeds, groupbeds, groups,
+                           opts.model, opts.hosp_LOS, opts.ICU_LOS, opts.available)
+
+    params = {k: v for k, v in vars(opts).items() if k!='output'}
+    params['computed'] = date.today().isoformat()
+    saveCapacityCache(table, params, opts.output)
+    print(table.head(20).to_string(index=False))
+    print('{} regions, {} reach capacity within {} days. Written to {}'.format(
+        len(table), table['days to capacity'].notna().sum(), opts.tsteps, opts.output))
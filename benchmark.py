@@ -0,0 +1,190 @@
+"""Benchmarks for the modelling hot paths and the figure builders.
+
+Runs offline: the population and rate data come from data/, and case
+data from COGIC_CASE_DATA, or if that isn't set, a synthetic case file
+written by loadCaseData.writeSyntheticCaseData.
+
+For each benchmark reports latency percentiles (ms), throughput
+(calls/s) and the peak memory allocated by a single call (kB).
+
+Usage:
+    python benchmark.py                      # run and print
+    python benchmark.py --save               # also store as the baseline
+    python benchmark.py --compare            # compare against the baseline
+    python benchmark.py -k census -n 50      # only names containing 'census'
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from loadCaseData import useSyntheticCaseData
+
+baseline_file = 'benchmark_baseline.json'
+
+def timeit(func, repeat, warmup=3):
+    """Latency of each of repeat calls of func, in seconds"""
+    for i in range(warmup):
+        func()
+    times = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times[i] = time.perf_counter() - start
+    return times
+
+def peakmemory(func):
+    """Peak memory allocated while calling func once, in bytes"""
+    tracemalloc.start()
+    try:
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def runBenchmark(func, repeat):
+    times = timeit(func, repeat)
+    return {
+        'p50_ms': 1e3*np.percentile(times, 50),
+        'p95_ms': 1e3*np.percentile(times, 95),
+        'p99_ms': 1e3*np.percentile(times, 99),
+        'mean_ms': 1e3*times.mean(),
+        'throughput': len(times)/times.sum(),
+        'peak_kB': peakmemory(func)/1024
+    }
+
+def benchmarks(state='Minnesota', county='Hennepin', tsteps=200):
+    """name: zero-argument function for every benchmark"""
+    useSyntheticCaseData()
+    os.environ['COGIC_STARTUP'] = 'eager'
+    import application
+    from SIRModels import continuousSIR, discreteSIR, estimate_beta
+    from populationModels import census2cdc, census2verity
+    from regionGroups import CountyProjections, stateGroups
+    from backtest import backtest
+
+    createcensus = application.appdata.createcensus
+    uscountydata = application.appdata.uscountydata
+
+    data, popstructure, N = createcensus.createPopulation(state, county, uscountydata, 'Verity')
+    infected = data['state']['Confirmed'].values[-7:]
+    gamma = 1./14
+    beta = estimate_beta(infected, gamma)
+    I0 = 2*data['county']['Confirmed'].values[-1]
+    t = np.arange(tsteps)
+    sol = continuousSIR(beta, gamma, N, I0, t)
+
+    admissionrates = createcensus.calcAdmissionRates(popstructure, 0.025, 0.01, 'Verity')
+    LOS = createcensus.calcLOS(7, 9, 'Verity')
+    censuspop = createcensus.regionPopStructure(state, county)
+    censuspop = censuspop/censuspop.sum()
+    cdcpop = census2cdc(censuspop)
+
+    countyprojections = CountyProjections(createcensus, uscountydata, 0.5, tsteps)
+    states = stateGroups(countyprojections.counties)
+
+    args = (0.5, 0.025, 0.01, 0.005, 7, 9, tsteps, '', 'Verity')
+    return {
+        'continuousSIR': lambda: continuousSIR(beta, gamma, N, I0, t),
+        'discreteSIR': lambda: discreteSIR(beta, gamma, N, I0, t),
+        'estimate_beta': lambda: estimate_beta(infected, gamma),
+        'createPopulation-county': lambda: createcensus.createPopulation(
+            state, county, uscountydata, 'Verity'),
+        'createPopulation-state': lambda: createcensus.createPopulation(
+            state, 'All', uscountydata, 'Verity'),
+        'calcCensus': lambda: createcensus.calcCensus(sol['Inew'], admissionrates, LOS),
+        'calcDeathRates-Verity': lambda: createcensus.calcDeathRates(None, popstructure, 'Verity'),
+        'calcDeathRates-CDC': lambda: createcensus.calcDeathRates(None, cdcpop, 'CDC'),
+        'census2cdc': lambda: census2cdc(censuspop),
+        'census2verity': lambda: census2verity(censuspop),
+        'sirgraph-county': lambda: application.sirgraph(state, county, 0.5, tsteps),
+        'sirgraph-state': lambda: application.sirgraph(state, 'All', 0.5, tsteps),
+        'censusgraph-county': lambda: application.censusgraph(state, county, *args),
+        'admissionsgraph-county': lambda: application.admissionsgraph(state, county, *args),
+        'deathgraph-county': lambda: application.deathgraph(
+            state, county, 0.5, 0.005, tsteps, 'Verity'),
+        'CountyProjections': lambda: CountyProjections(
+            createcensus, uscountydata, 0.5, tsteps),
+        'CountyProjections-SEIRD': lambda: CountyProjections(
+            createcensus, uscountydata, 0.5, tsteps, 'SEIRD'),
+        'rollup-states': lambda: countyprojections.rollup(states),
+        'backtest': lambda: backtest(createcensus, uscountydata, 0.5),
+        'projections-callback': lambda: [
+            (application.sirfigure(run), application.projectionstore(run))
+            for run in [
+                application.runsir(state, county, 0.5, tsteps),
+                application.runsir(state, 'All', 0.5, tsteps)
+            ]
+        ],
+    }
+
+def compare(results, baseline, tolerance):
+    """Names of benchmarks whose median latency is more than
+    tolerance (fractional) above the baseline, or that have no
+    baseline.
+    """
+    regressions = []
+    print('\n{:28s}{:>12s}{:>12s}{:>9s}'.format('benchmark', 'baseline', 'now', 'change'))
+    for name, result in results.items():
+        if name not in baseline:
+            regressions.append(name)
+            print('{:28s}{:>12s}{:>12.3f}{:>9s}  NO BASELINE'.format(
+                name, '-', result['p50_ms'], ''))
+            continue
+        before = baseline[name]['p50_ms']
+        change = result['p50_ms']/before - 1
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{:28s}{:>12.3f}{:>12.3f}{:>+8.0%}{}'.format(
+            name, before, result['p50_ms'], change, flag))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='COGIC benchmarks')
+    parser.add_argument('-n', '--repeat', type=int, default=100,
+                        help='calls per benchmark')
+    parser.add_argument('-k', '--filter', default='',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare median latencies with the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown counted as a regression by --compare')
+    parser.add_argument('--baseline', default=baseline_file)
+    opts = parser.parse_args()
+
+    results = dict()
+    columns = ['p50_ms', 'p95_ms', 'p99_ms', 'throughput', 'peak_kB']
+    print('{:28s}'.format('benchmark') + ''.join('{:>12s}'.format(c) for c in columns))
+    for name, func in benchmarks().items():
+        if opts.filter not in name:
+            continue
+        results[name] = runBenchmark(func, opts.repeat)
+        print('{:28s}'.format(name) + ''.join(
+            '{:>12.3f}'.format(results[name][c]) for c in columns))
+
+    regressions = []
+    if opts.compare:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, opts.tolerance)
+
+    if opts.save:
+        with open(opts.baseline, 'w') as f:
+            json.dump({
+                'repeat': opts.repeat,
+                'python': sys.version.split()[0],
+                'numpy': np.__version__,
+                'results': results
+            }, f, indent=2)
+
+    if regressions:
+        sys.exit(1)
@@ -0,0 +1,75 @@
+"""Counts the server requests (round trips to _dash-update-component)
+and client-side callbacks triggered by changing each control of the
+app, by walking the callback graph from /_dash-dependencies.
+
+Usage: python callbackRequests.py
+"""
+import json
+from collections import defaultdict
+
+
+def parseOutputs(output):
+    """Multi-output callbacks are listed as '..a.prop...b.prop..'"""
+    if output.startswith('..'):
+        return output[2:-2].split('...')
+    return [output]
+
+def serverDependencies(server):
+    return json.loads(server.test_client().get('/_dash-dependencies').data)
+
+def callbackGraph(deps):
+    """Inputs, state and outputs of each callback in deps, the JSON served
+    at /_dash-dependencies
+    """
+    return [
+        {
+            'output': dep['output'],
+            'inputs': [i['id'] + '.' + i['property'] for i in dep['inputs']],
+            'state': [i['id'] + '.' + i['property'] for i in dep['state']],
+            'outputs': parseOutputs(dep['output']),
+            'clientside': bool(dep.get('clientside_function'))
+        } for dep in deps
+    ]
+
+def requestsPerInteraction(server):
+    """For every input, the number of server and client-side callbacks
+    fired when it changes, including callbacks chained off their
+    outputs.
+    """
+    graph = callbackGraph(serverDependencies(server))
+    byinput = defaultdict(list)
+    for callback in graph:
+        for i in callback['inputs']:
+            byinput[i].append(callback)
+
+    # inputs which aren't set by another callback are the user controls.
+    # Callbacks fired only by the page's URL (opening a scenario link,
+    # see application.loadscenario) set controls the user still changes.
+    fromurl = [c for c in graph if all(i.startswith('url.') for i in c['inputs'])]
+    outputs = set(o for callback in graph if callback not in fromurl
+                  for o in callback['outputs'])
+    controls = sorted(set(byinput) - outputs)
+
+    counts = dict()
+    for control in controls:
+        fired = []
+        changed = [control]
+        while changed:
+            prop = changed.pop()
+            for callback in byinput[prop]:
+                if callback not in fired:
+                    fired.append(callback)
+                    changed.extend(callback['outputs'])
+        counts[control] = {
+            'server': sum(not c['clientside'] for c in fired),
+            'clientside': sum(c['clientside'] for c in fired)
+        }
+    return counts
+
+if __name__ == '__main__':
+    from application import application
+
+    counts = requestsPerInteraction(application)
+    print('{:40s}{:>8s}{:>12s}'.format('control', 'server', 'clientside'))
+    for control, count in counts.items():
+        print('{:40s}{:>8d}{:>12d}'.format(control, count['server'], count['clientside']))
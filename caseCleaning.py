@@ -0,0 +1,144 @@
+# caseCleaning.py
+
+"""
+Cleaning of cumulative case and death counts, on whole
+(days, regions) arrays at once.
+
+Reported cumulative counts have gaps, days reported as zero, downward
+corrections and dumps of backlogged reports, all of which go straight
+into the log-growth rate of estimate_beta. Cleaning
+
+* fills gaps, and zeros after a region's first report, by linear
+  interpolation (holding the last value at the end),
+* makes the series non-decreasing, taking a drop as a correction of
+  the earlier counts, so they're lowered to the corrected value,
+* derives daily new counts and a smoothed version of them (trailing
+  rolling mean, or exponential filter),
+* flags days with a correction or a spike (new counts more than
+  threshold times the mean of the window before).
+
+The loaders clean counts as they're read, and the case store keeps
+all of it alongside the raw counts. AsOfCleaner cleans the raw counts
+as they'd have been cleaned on earlier days, for backtests.
+"""
+
+import numpy as np
+import pandas as pd
+
+# anomaly flag bits
+CORRECTION = 1
+SPIKE = 2
+
+smoothing = {'method': 'rolling', 'window': 7, 'alpha': 0.3}
+# spikes need at least this many new counts
+min_spike = 10
+
+def fillGaps(cumulative):
+    """cumulative with NaNs, and zeros after the first nonzero value,
+    interpolated along axis 0. Leading NaNs are zero.
+    """
+    cumulative = np.array(cumulative, dtype=float)
+    reported = np.fmax.accumulate(cumulative, axis=0) > 0
+    cumulative[(cumulative==0) & reported] = np.nan
+    return pd.DataFrame(cumulative).interpolate().fillna(0).values
+
+def monotone(cumulative):
+    """Non-decreasing cumulative counts, lowering the counts before a
+    drop to the value after it
+    """
+    return np.minimum.accumulate(cumulative[::-1], axis=0)[::-1]
+
+def dailyCounts(cumulative):
+    """Daily new counts. The first day's are unknown, and zero."""
+    return np.diff(cumulative, axis=0, prepend=cumulative[:1])
+
+def rollingMean(daily, window=7):
+    """Trailing mean over window days (fewer at the start)"""
+    total = np.cumsum(daily, axis=0)
+    total[window:] = total[window:] - total[:-window]
+    days = np.minimum(np.arange(1, len(daily) + 1), window)
+    return total/days.reshape((-1,) + (1,)*(daily.ndim - 1))
+
+def exponentialFilter(daily, alpha=0.3):
+    """Exponentially weighted mean, y[t] = alpha*x[t] + (1-alpha)*y[t-1]"""
+    # scipy.signal takes a while to import, and this is rarely used
+    from scipy.signal import lfilter
+    daily = np.asarray(daily, dtype=float)
+    zi = (1 - alpha)*daily[:1]
+    return lfilter([alpha], [1, alpha - 1], daily, axis=0, zi=zi)[0]
+
+def smooth(daily, method='rolling', window=7, alpha=0.3):
+    if method=='rolling':
+        return rollingMean(daily, window)
+    elif method=='exponential':
+        return exponentialFilter(daily, alpha)
+    raise ValueError('smoothing must be rolling or exponential')
+
+def anomalyFlags(filled, daily, window=7, threshold=5.):
+    """CORRECTION on days the gap-filled counts drop, SPIKE on days
+    with new counts above threshold times the mean of the window days
+    before (and at least min_spike)
+    """
+    flags = np.zeros(daily.shape, dtype=np.uint8)
+    flags[1:][np.diff(filled, axis=0) < 0] |= CORRECTION
+    before = np.zeros_like(daily)
+    before[1:] = rollingMean(daily, window)[:-1]
+    flags[(daily >= min_spike) & (daily > threshold*before)] |= SPIKE
+    return flags
+
+def cleanArrays(raw, method=None, window=None, alpha=None, threshold=5.):
+    """Cleaned cumulative counts, daily new counts, smoothed daily
+    counts and anomaly flags of raw, a (days, regions) array of
+    cumulative counts. Smoothing options default to smoothing.
+    """
+    options = dict(smoothing)
+    options.update({k: v for k, v in
+                    [('method', method), ('window', window), ('alpha', alpha)]
+                    if v is not None})
+    filled = fillGaps(raw)
+    clean = monotone(filled)
+    daily = dailyCounts(clean)
+    return {
+        'clean': clean,
+        'new': daily,
+        'smoothed': smooth(daily, **options),
+        'flags': anomalyFlags(filled, dailyCounts(filled).clip(0), options['window'], threshold),
+    }
+
+class AsOfCleaner:
+    """Raw cumulative counts cleaned as of earlier days, i.e. knowing
+    only the counts up to that day, for backtests. Filling gaps and
+    corrections both use later counts, so the whole series cleaned
+    leaks them into earlier days. Gives the same as fillGaps and
+    monotone of the series cut at each day, without redoing them for
+    every day.
+    """
+    def __init__(self, raw):
+        x = np.array(raw, dtype=float)
+        reported = np.fmax.accumulate(x, axis=0) > 0
+        x[(x==0) & reported] = np.nan
+        frame = pd.DataFrame(x)
+        # filled from reports on both sides, or held at the last report
+        self.interpolated = frame.interpolate().fillna(0).values
+        self.held = frame.ffill().fillna(0).values
+        # the first report on or after each day
+        days = np.arange(len(x))[:, None]
+        reports = np.where(np.isnan(x), len(x), days)
+        self.nextreport = np.minimum.accumulate(reports[::-1], axis=0)[::-1]
+
+    def counts(self, cutoffs, columns, days):
+        """Cleaned counts of the days days up to each cutoff (row
+        indices) of each column, as of the cutoff. cutoffs and columns
+        broadcast together, and the result has a last axis of days (the
+        first day repeated before the start of the series).
+        """
+        cutoffs = np.asarray(cutoffs)[..., None]
+        columns = np.asarray(columns)[..., None]
+        rows = np.maximum(cutoffs + np.arange(1 - days, 1), 0)
+        filled = np.where(self.nextreport[rows, columns] <= cutoffs,
+                          self.interpolated[rows, columns], self.held[rows, columns])
+        return np.minimum.accumulate(filled[..., ::-1], axis=-1)[..., ::-1]
+
+def cleanFrame(wide):
+    """A DataFrame of cumulative counts (a column per region), cleaned"""
+    return pd.DataFrame(monotone(fillGaps(wide.values)), index=wide.index, columns=wide.columns)
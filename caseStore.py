@@ -0,0 +1,112 @@
+# caseStore.py
+
+"""
+Columnar store of county case data, for data ingested offline (see
+ingestJHU.py) rather than read from the NYT files at startup.
+
+A store is a directory holding the dates, the (state, county) of each
+column, and arrays of shape (days, counties) saved as .npy, so they
+can be read, or memory mapped, without parsing anything. For each
+field (Confirmed, Deaths) there are the raw cumulative counts and,
+computed once as the store is written (see caseCleaning.py), the
+cleaned counts, daily new counts, smoothed daily counts and anomaly
+flags, as <field>-clean, -new, -smoothed and -flags. Stores are
+written to a temporary directory and swapped in whole, so a running
+app never sees half of one.
+
+With COGIC_CASE_STORE set to a store directory, loadCountyData and
+loadStateData read from it instead of the NYT files.
+"""
+
+import os
+import json
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from caseCleaning import cleanArrays
+
+cache_dir = os.environ.get('COGIC_CACHE_DIR', 'cache')
+default_store = os.path.join(cache_dir, 'cases')
+fields = ['Confirmed', 'Deaths']
+
+def caseStorePath():
+    """The store set by COGIC_CASE_STORE, or None"""
+    return os.environ.get('COGIC_CASE_STORE') or None
+
+def writeStore(wide, path=default_store, cleaning=None, **meta):
+    """Saves wide, a DataFrame of raw counts laid out like
+    loadCountyData's (a row per date, columns (State, County, field)),
+    as a store at path, with the cleaned arrays from
+    caseCleaning.cleanArrays with the options in cleaning. Anything in
+    meta is kept in the store's meta.json.
+    """
+    cleaning = {k: v for k, v in (cleaning or {}).items() if v is not None}
+    counties = wide.xs(fields[0], axis=1, level=-1).columns
+    tmp = '{}.tmp-{}'.format(path.rstrip(os.sep), os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'dates.npy'),
+            pd.to_datetime(wide.index).values.astype('datetime64[D]'))
+    counties.to_frame(index=False, name=['state', 'county']).to_csv(
+        os.path.join(tmp, 'counties.csv'), index=False)
+    arrays = []
+    for field in fields:
+        values = wide.xs(field, axis=1, level=-1).reindex(columns=counties).values
+        derived = {field: values.astype(float)}
+        for name, array in cleanArrays(values, **cleaning).items():
+            derived[field + '-' + name] = array
+        for name, array in derived.items():
+            np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(array))
+        arrays += list(derived)
+    meta.update(fields=fields, arrays=arrays, cleaning=cleaning, days=len(wide),
+                counties=len(counties), written=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2, default=str)
+
+    # swap the new store in
+    old = None
+    if os.path.exists(path):
+        old = tmp + '.old'
+        os.replace(path, old)
+    os.replace(tmp, path)
+    if old:
+        shutil.rmtree(old, ignore_errors=True)
+
+def readArrays(path=default_store, names=None, mmap=True):
+    """The store's dates, counties (a (State, County) MultiIndex) and
+    a dict of its arrays (or those in names) of shape
+    (days, counties), memory mapped unless mmap is False.
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    dates = pd.DatetimeIndex(np.load(os.path.join(path, 'dates.npy')))
+    counties = pd.MultiIndex.from_frame(
+        pd.read_csv(os.path.join(path, 'counties.csv'), keep_default_na=False),
+        names=['State', 'County'])
+    arrays = {
+        name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+        for name in (names or meta.get('arrays', fields))
+    }
+    return dates, counties, arrays
+
+def readStore(path=default_store, raw=False):
+    """The store's cleaned counts (or raw counts) as a DataFrame laid
+    out like loadCountyData's
+    """
+    names = [field if raw else field + '-clean' for field in fields]
+    dates, counties, arrays = readArrays(path, names, mmap=False)
+    columns = pd.MultiIndex.from_tuples(
+        [(state, county, field) for field in fields for state, county in counties],
+        names=['State', 'County', None])
+    return pd.DataFrame(
+        np.concatenate([arrays[name] for name in names], axis=1),
+        index=dates.strftime('%Y-%m-%d'), columns=columns)
+
+def stateTotals(wide):
+    """State sums of a loadCountyData-like DataFrame, laid out like
+    loadStateData's (columns (State, field))
+    """
+    return wide.T.groupby(level=[0, 2]).sum().T
@@ -0,0 +1,178 @@
+# cogic.py
+
+"""
+The modelling behind the app, without the app, for notebooks, batch
+jobs and other servers:
+
+    import cogic
+    run = cogic.project('Minnesota', 'Hennepin', tsteps=200)
+    run['sol']['Inew']                    # daily new infections
+    cogic.curves(run)['census']           # hospital census
+    projections = cogic.batchProject([('Minnesota', 'Hennepin'), ('Ohio', 'Franklin')])
+    projections.sol['I']                  # a row per county
+
+Importing it doesn't import Dash, Flask or Plotly, and doesn't load
+anything: the case data, populations and rate tables are loaded on
+first use, from the same sources as the app's (see loadCaseData.py),
+or from a case store given to loadStore(). application.py makes its
+projections with these functions, on its own copy of the data (see
+useData).
+"""
+
+from contextlib import nullcontext
+
+import numpy as np
+
+from startup import AppData
+from SIRModels import doubling_time
+from compartmentModels import models as epimodels, solve
+from outcomeModels import category, delayedIncidence, pastIncidence
+from regionGroups import CountyProjections, chunkedRollup, projectionChunks, regionCurves
+from reproductionNumber import RegionRt
+from hospCensusModels import HospitalCensus
+from loadCaseData import loadCountyData, createCountyList
+from caseStore import readStore
+
+def loadModelData(store=None, timer=None):
+    """The data projections need, as a dict: the rate tables
+    (createcensus), county cases (uscountydata, read from the case
+    store at store if given), the counties of each state
+    (uscountylist) and their Rt (regionrt). timer(name) is a context
+    manager timing each stage, e.g. StartupTimer.stage.
+    """
+    stage = timer or (lambda name: nullcontext())
+    data = dict()
+    with stage('HospitalCensus'):
+        data['createcensus'] = HospitalCensus()
+    with stage('loadCountyData'):
+        data['uscountydata'] = readStore(store) if store else loadCountyData()
+    # uscountylist[State] - > list of counties
+    with stage('createCountyList'):
+        data['uscountylist'] = createCountyList(data['uscountydata'])
+    with stage('RegionRt'):
+        data['regionrt'] = RegionRt(data['uscountydata'])
+    return data
+
+# loaded on first use
+data = AppData(loadModelData)
+
+def useData(appdata):
+    """Makes projections use appdata, anything with the attributes of
+    loadModelData's dict (e.g. an AppData). Returns it.
+    """
+    global data
+    data = appdata
+    return data
+
+def loadStore(path):
+    """Loads the case store at path (see caseStore.py) and makes
+    projections use it. Returns the data.
+    """
+    store = AppData(lambda: loadModelData(path))
+    store.load()
+    return useData(store)
+
+def project(state, county='All', silent=0.5, tsteps=200, betasource='doubling',
+            epimodel='SIR', timer=None):
+    """Projection of a county (or of a state, with county 'All') for
+    tsteps days from today, with silent the fraction of infections
+    that aren't confirmed. beta comes from the state's doubling time,
+    or with betasource 'Rt' from the region's current Rt (the state's
+    for counties with too few cases), falling back to the doubling
+    time. epimodel is one of compartmentModels.models.
+
+    Returns a dict with the solution (sol: an array per compartment,
+    and Inew), the incidence delayed to each outcome (delayed, see
+    outcomeModels), and the inputs: N, I0, beta, Td, Rt, the last
+    week of confirmed cases (known_infected, on pastdates) and the
+    infections before today (history). timer(name) is a context
+    manager timing each stage, e.g. metrics.timed.
+    """
+    stage = timer or (lambda name: nullcontext())
+    with stage('createPopulation'):
+        population, popstructure, N = data.createcensus.createPopulation(
+            state, county, data.uscountydata, None)
+
+    statedata = population['state']
+    county_data = population['county'] #this may actually also be whole state data
+    known_infected = county_data['Confirmed'].values[-7:]
+    infected_for_beta = statedata['Confirmed'].values[-7:]
+    I0 = known_infected[-1]/(1 - silent) #current cases as initial condition
+
+    model = epimodels[epimodel]
+    params = model.parameters()
+    with stage('fit'):
+        beta = model.transmissionRate(infected_for_beta, params)
+        Td = doubling_time(infected_for_beta).mean()
+        Rt = data.regionrt.latest(state, county) if betasource=='Rt' else None
+        if Rt is not None:
+            beta = model.betaFromRt(Rt['Rt'], params)
+
+    with stage('solve'):
+        sol = {
+            name: values[0]
+            # a single region is small, always in double precision
+            for name, values in solve(model, [beta], [N], [I0], np.arange(tsteps),
+                                      dtype=np.float64, **params).items()
+        }
+
+    # infections before today, whose outcomes are still to come
+    history = pastIncidence(county_data['Confirmed'].values, silent)
+    with stage('outcomes'):
+        delayed = delayedIncidence(sol['Inew'], history)
+
+    return {
+        'state': state,
+        'county': county,
+        'epimodel': epimodel,
+        'N': N,
+        'I0': I0,
+        'beta': beta,
+        'Td': Td,
+        'Rt': Rt,
+        'known_infected': known_infected,
+        'pastdates': county_data.index[-7:],
+        'history': history,
+        'sol': sol,
+        'delayed': delayed,
+    }
+
+def curves(run, model='Verity', hosp_LOS=7, ICU_LOS=9,
+           hosprate=None, icurate=None, deathrate=None):
+    """Daily admissions, hospital and ICU census and cumulative deaths
+    of a projection, as regionGroups.regionCurves: the high estimates
+    of the Verity or CDC rates of the region, or for model 'Custom'
+    the given rates
+    """
+    proj = {'delayed': run['delayed']}
+    if model in ('Verity', 'CDC'):
+        tables = data.createcensus.calcRateTables(run['state'], run['county'])[model]
+        for kind in ['admissions', 'deaths']:
+            proj[(model, kind)] = {
+                key: rate*run['delayed'][category(key)]
+                for key, rate in tables[kind].items()
+            }
+        proj[(model, 'deaths')] = {
+            key: np.cumsum(daily) for key, daily in proj[(model, 'deaths')].items()
+        }
+    return regionCurves(proj, model, hosp_LOS, ICU_LOS, hosprate, icurate, deathrate)
+
+def batchProject(counties=None, silent=0.5, tsteps=200, epimodel='SIR', groups=None,
+                 budget=None, betasource='doubling'):
+    """Projections of many counties (a list of (state, county), by
+    default every county) solved at once, as a
+    regionGroups.CountyProjections. With a groups table (see
+    regionGroups), the projections of each group instead, as
+    CountyProjections.rollup, solved in chunks of counties within the
+    memory budget (megabytes, see memoryBudget.py). betasource is as
+    for project.
+    """
+    regionrt = data.regionrt if betasource=='Rt' else None
+    if counties is None and groups is not None:
+        counties = sorted(set(zip(groups['state'], groups['county'])))
+    if groups is not None:
+        return chunkedRollup(projectionChunks(data.createcensus, data.uscountydata, silent,
+                                              tsteps, epimodel, counties, budget, regionrt),
+                             groups)
+    return CountyProjections(data.createcensus, data.uscountydata, silent, tsteps, epimodel,
+                             counties=counties, regionrt=regionrt)
@@ -0,0 +1,261 @@
+# compartmentModels.py
+
+"""
+Compartment models of the epidemic, solved for any number of regions
+at once.
+
+Each model defines its derivatives, and optionally their Jacobian,
+once over arrays of shape (compartments, regions), with parameters
+that are scalars or arrays with a value per region. solve() stacks
+the compartments of each region in turn into one system, so its
+Jacobian is banded (compartments - 1 bands either side of the
+diagonal) and regions cost the same whichever model is used, times
+the number of compartments. The system is integrated by one of the
+backends of solverBackends.py (odeint by default). For the compiled
+rk4-numba backend, a model also has a kernel, its derivatives for a
+single region written out element by element.
+
+Models are registered by name in models:
+
+* SIR, as in SIRModels.continuousSIR
+* SEIR, with infections exposed (not yet infectious) for 1/sigma days
+* SEIRD, SEIR with the deaths among those removed (a fraction ifr)
+  kept apart from the recovered
+* SIRH, SIR with a fraction hosprate of those removed going through
+  hospital for 1/delta days first
+
+Every model's transmission rate beta can be set from the growth rate
+of cases (see transmissionRate) or from Rt, which is beta/gamma for
+all of them. Any other parameter defaults to the model's defaults.
+New infections (Inew) are the negative gradient of S for every model.
+"""
+
+import numpy as np
+
+from SIRModels import batchEstimateBeta
+from solverBackends import integrate
+from memoryBudget import storageType
+
+models = dict()
+
+def register(cls):
+    """Class decorator adding an instance of a model to models"""
+    models[cls.name] = cls()
+    return cls
+
+class CompartmentModel:
+    """A model: the names of its compartments (S first, and I), the
+    defaults of its parameters other than beta and N, and the
+    derivatives of y, an array of shape (compartments, regions), given
+    a dict of parameters p.
+    """
+    name = None
+    compartments = []
+    defaults = {'gamma': 1./14}
+
+    def derivatives(self, y, p):
+        raise NotImplementedError
+
+    # kernel(y, p, dy), a staticmethod writing the derivatives of a
+    # region to dy, with p an array of the kernel_parameters
+    kernel = None
+    kernel_parameters = ('beta', 'N', 'gamma')
+
+    def jacobian(self, y, p):
+        """d derivatives[a]/d y[b], an array of shape (compartments,
+        compartments, regions), or None to let the solver estimate it
+        """
+        return None
+
+    def hasJacobian(self):
+        return type(self).jacobian is not CompartmentModel.jacobian
+
+    def parameters(self, **params):
+        p = dict(self.defaults)
+        p.update({k: v for k, v in params.items() if v is not None})
+        return p
+
+    def betaFromGrowth(self, growth, p):
+        """beta giving daily growth rate growth while S is about N"""
+        return growth + p['gamma']
+
+    def betaFromRt(self, Rt, p):
+        return Rt*p['gamma']
+
+    def transmissionRate(self, cases, p):
+        """beta from the growth of cases (last axis, e.g. the last week
+        of cumulative cases), as SIRModels.estimate_beta but for any
+        model. NaN when there's no growth to go on.
+        """
+        return self.betaFromGrowth(batchEstimateBeta(cases, 0), p)
+
+    def initial(self, N, I0, p):
+        y = np.zeros((len(self.compartments), len(N)))
+        y[0] = N - I0
+        y[self.compartments.index('I')] = I0
+        return y
+
+@register
+class SIR(CompartmentModel):
+    name = 'SIR'
+    compartments = ['S', 'I', 'R']
+
+    def derivatives(self, y, p):
+        S, I, R = y
+        new = p['beta']*S*I/p['N']
+        return [-new, new - p['gamma']*I, p['gamma']*I]
+
+    def jacobian(self, y, p):
+        S, I, R = y
+        dS, dI = p['beta']*I/p['N'], p['beta']*S/p['N']
+        J = np.zeros((3, 3, y.shape[1]))
+        J[0, 0], J[0, 1] = -dS, -dI
+        J[1, 0], J[1, 1] = dS, dI - p['gamma']
+        J[2, 1] = p['gamma']
+        return J
+
+    @staticmethod
+    def kernel(y, p, dy):
+        beta, N, gamma = p[0], p[1], p[2]
+        new = beta*y[0]*y[1]/N
+        dy[0] = -new
+        dy[1] = new - gamma*y[1]
+        dy[2] = gamma*y[1]
+
+@register
+class SEIR(CompartmentModel):
+    name = 'SEIR'
+    compartments = ['S', 'E', 'I', 'R']
+    # incubation period of 5.2 days, Li et al. 2020 (NEJM 382:1199)
+    defaults = {'gamma': 1./14, 'sigma': 1/5.2}
+
+    def derivatives(self, y, p):
+        S, E, I, R = y
+        new = p['beta']*S*I/p['N']
+        return [-new, new - p['sigma']*E, p['sigma']*E - p['gamma']*I, p['gamma']*I]
+
+    def jacobian(self, y, p):
+        S, E, I, R = y
+        dS, dI = p['beta']*I/p['N'], p['beta']*S/p['N']
+        J = np.zeros((4, 4, y.shape[1]))
+        J[0, 0], J[0, 2] = -dS, -dI
+        J[1, 0], J[1, 1], J[1, 2] = dS, -p['sigma'], dI
+        J[2, 1], J[2, 2] = p['sigma'], -p['gamma']
+        J[3, 2] = p['gamma']
+        return J
+
+    kernel_parameters = ('beta', 'N', 'gamma', 'sigma')
+
+    @staticmethod
+    def kernel(y, p, dy):
+        beta, N, gamma, sigma = p[0], p[1], p[2], p[3]
+        new = beta*y[0]*y[2]/N
+        dy[0] = -new
+        dy[1] = new - sigma*y[1]
+        dy[2] = sigma*y[1] - gamma*y[2]
+        dy[3] = gamma*y[2]
+
+    def growthRate(self, beta, p):
+        # the positive root of (r + sigma)(r + gamma) = sigma beta
+        sigma, gamma = p['sigma'], p['gamma']
+        return (np.sqrt((sigma - gamma)**2 + 4*sigma*beta) - sigma - gamma)/2
+
+    def betaFromGrowth(self, growth, p):
+        return (growth + p['sigma'])*(growth + p['gamma'])/p['sigma']
+
+    def initial(self, N, I0, p):
+        # the exposed that go with I0 infectious while growing
+        # exponentially
+        y = super().initial(N, I0, p)
+        y[1] = p['beta']*I0/(self.growthRate(p['beta'], p) + p['sigma'])
+        y[0] -= y[1]
+        return y
+
+@register
+class SEIRD(SEIR):
+    name = 'SEIRD'
+    compartments = ['S', 'E', 'I', 'R', 'D']
+    # infection fatality rate, Verity et al. 2020 (Lancet Infect Dis 20:669)
+    defaults = {'gamma': 1./14, 'sigma': 1/5.2, 'ifr': 0.0066}
+
+    def derivatives(self, y, p):
+        dS, dE, dI, removed = super().derivatives(y[:4], p)
+        return [dS, dE, dI, (1 - p['ifr'])*removed, p['ifr']*removed]
+
+    def jacobian(self, y, p):
+        J = np.zeros((5, 5, y.shape[1]))
+        J[:4, :4] = super().jacobian(y[:4], p)
+        J[3, 2], J[4, 2] = (1 - p['ifr'])*p['gamma'], p['ifr']*p['gamma']
+        return J
+
+    kernel_parameters = ('beta', 'N', 'gamma', 'sigma', 'ifr')
+
+    @staticmethod
+    def kernel(y, p, dy):
+        beta, N, gamma, sigma, ifr = p[0], p[1], p[2], p[3], p[4]
+        new = beta*y[0]*y[2]/N
+        dy[0] = -new
+        dy[1] = new - sigma*y[1]
+        dy[2] = sigma*y[1] - gamma*y[2]
+        dy[3] = (1 - ifr)*gamma*y[2]
+        dy[4] = ifr*gamma*y[2]
+
+@register
+class SIRH(CompartmentModel):
+    name = 'SIRH'
+    compartments = ['S', 'I', 'H', 'R']
+    # as the app's default hospitalization rate and length of stay
+    defaults = {'gamma': 1./14, 'hosprate': 0.025, 'delta': 1./7}
+
+    def derivatives(self, y, p):
+        S, I, H, R = y
+        new = p['beta']*S*I/p['N']
+        removed = p['gamma']*I
+        return [-new, new - removed, p['hosprate']*removed - p['delta']*H,
+                (1 - p['hosprate'])*removed + p['delta']*H]
+
+    def jacobian(self, y, p):
+        S, I, H, R = y
+        dS, dI = p['beta']*I/p['N'], p['beta']*S/p['N']
+        J = np.zeros((4, 4, y.shape[1]))
+        J[0, 0], J[0, 1] = -dS, -dI
+        J[1, 0], J[1, 1] = dS, dI - p['gamma']
+        J[2, 1], J[2, 2] = p['hosprate']*p['gamma'], -p['delta']
+        J[3, 1], J[3, 2] = (1 - p['hosprate'])*p['gamma'], p['delta']
+        return J
+
+    kernel_parameters = ('beta', 'N', 'gamma', 'hosprate', 'delta')
+
+    @staticmethod
+    def kernel(y, p, dy):
+        beta, N, gamma, hosprate, delta = p[0], p[1], p[2], p[3], p[4]
+        new = beta*y[0]*y[1]/N
+        dy[0] = -new
+        dy[1] = new - gamma*y[1]
+        dy[2] = hosprate*gamma*y[1] - delta*y[2]
+        dy[3] = (1 - hosprate)*gamma*y[1] + delta*y[2]
+
+def solve(model, beta, N, I0, timepts, jacobian=True, backend=None, rtol=None,
+          atol=None, steps=None, dtype=None, **params):
+    """The model (or the name of one in models) for many independent
+    regions at once. beta, N and I0 have a value per region, and
+    params are scalars or have one too. The solver backend and its
+    tolerances (or rk4 steps per day) default to
+    solverBackends.settings. Returns an array of shape
+    (regions, timepts) for each compartment, and Inew, of dtype
+    (default memoryBudget.storageType()).
+    """
+    model = models[model] if isinstance(model, str) else model
+    N = np.asarray(N, dtype=float)
+    p = model.parameters(beta=np.asarray(beta, dtype=float), N=N, **params)
+    k, n = len(model.compartments), len(N)
+
+    y0 = model.initial(N, np.asarray(I0, dtype=float), p).T.ravel()
+    result = integrate(model, p, y0, timepts, backend, rtol, atol, steps, jacobian)
+    states = result.reshape(len(timepts), n, k).transpose(2, 1, 0)
+
+    dtype = dtype or storageType()
+    sol = {name: values.astype(dtype, copy=False) for name, values in zip(model.compartments, states)}
+    # from the solution before it's rounded to dtype
+    sol['Inew'] = -np.gradient(states[0], axis=1).astype(dtype, copy=False)
+    return sol
@@ -0,0 +1,281 @@
+# countyMap.py
+
+"""
+A national map of counties, colored by one of a table of metrics of
+every county:
+
+* growth rate: daily growth rate of confirmed cases over the last week
+* Rt: the county's latest Rt (see reproductionNumber.py), if it had
+  enough cases to estimate it
+* peak census per 100k: projected peak hospital census per 100,000
+  people, with the high estimates of the Verity rates
+* days to capacity: days until the projected census exceeds the
+  county's staffed beds, given a bed file (see bedCapacity.py)
+
+The table comes from a nightly batch that projects every county at
+once, like bedCapacity.py, and is written to the cache directory
+(COGIC_CACHE_DIR, default cache/) for the app:
+
+    python countyMap.py [--beds beds.csv] [--tsteps 365] [--budget 1024]
+
+County shapes are read from a local GeoJSON file (COGIC_COUNTY_GEOJSON,
+default data/us_counties.geojson) with a feature per county whose id,
+or GEOID property, is its 5 digit FIPS code, and STATE (or STATEFP),
+NAME and LSAD properties, e.g. the census cartographic boundary files
+or plotly's geojson-counties-fips.json. Full resolution shapes run to
+tens of megabytes, so they're simplified (Douglas-Peucker, to
+COGIC_MAP_TOLERANCE degrees, default 0.01) and their coordinates
+rounded before they're served, or ahead of time with
+
+    python countyMap.py --simplify in.geojson out.geojson [--tolerance 0.01]
+
+Shared borders are simplified separately in each county, so at large
+tolerances there are slivers between counties.
+"""
+
+import os
+import json
+import argparse
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from SIRModels import batchEstimateBeta
+from bedCapacity import (cache_dir, countyCensus, firstCrossing, loadBedCapacity,
+                         saveCapacityCache)
+from regionGroups import CountyProjections, projectionChunks
+
+metrics_cache = os.path.join(cache_dir, 'county_metrics.csv')
+geojson_path = os.environ.get('COGIC_COUNTY_GEOJSON', os.path.join('data', 'us_counties.geojson'))
+map_tolerance = float(os.environ.get('COGIC_MAP_TOLERANCE', 0.01))
+
+# how each metric is colored
+metrics = {
+    'growth rate': {'title': 'Daily growth rate of cases', 'colorscale': 'Reds'},
+    'Rt': {'title': 'Rt', 'colorscale': 'RdBu', 'reversescale': True, 'zmid': 1},
+    'peak census per 100k': {'title': 'Peak hospital census per 100,000',
+                             'colorscale': 'Reds'},
+    'days to capacity': {'title': 'Days to bed capacity', 'colorscale': 'Reds',
+                         'reversescale': True},
+}
+
+state_fips = {
+    '01': 'Alabama', '02': 'Alaska', '04': 'Arizona', '05': 'Arkansas',
+    '06': 'California', '08': 'Colorado', '09': 'Connecticut', '10': 'Delaware',
+    '11': 'District of Columbia', '12': 'Florida', '13': 'Georgia', '15': 'Hawaii',
+    '16': 'Idaho', '17': 'Illinois', '18': 'Indiana', '19': 'Iowa', '20': 'Kansas',
+    '21': 'Kentucky', '22': 'Louisiana', '23': 'Maine', '24': 'Maryland',
+    '25': 'Massachusetts', '26': 'Michigan', '27': 'Minnesota', '28': 'Mississippi',
+    '29': 'Missouri', '30': 'Montana', '31': 'Nebraska', '32': 'Nevada',
+    '33': 'New Hampshire', '34': 'New Jersey', '35': 'New Mexico', '36': 'New York',
+    '37': 'North Carolina', '38': 'North Dakota', '39': 'Ohio', '40': 'Oklahoma',
+    '41': 'Oregon', '42': 'Pennsylvania', '44': 'Rhode Island', '45': 'South Carolina',
+    '46': 'South Dakota', '47': 'Tennessee', '48': 'Texas', '49': 'Utah',
+    '50': 'Vermont', '51': 'Virginia', '53': 'Washington', '54': 'West Virginia',
+    '55': 'Wisconsin', '56': 'Wyoming', '72': 'Puerto Rico',
+}
+
+# the NYT reports the five boroughs as one
+combined_counties = {
+    ('New York', 'New York City'): ['36005', '36047', '36061', '36081', '36085'],
+}
+
+def countyMetrics(projections, regionrt, uscountydata, countybeds=None,
+                  model='Verity', hosp_LOS=7, ICU_LOS=9, available=1.0):
+    """The metrics of every county in projections (a
+    regionGroups.CountyProjections, or chunks of them from
+    regionGroups.projectionChunks), as a DataFrame with a row per
+    county. Days to capacity are NaN without countybeds (see
+    bedCapacity.loadBedCapacity).
+    """
+    if isinstance(projections, CountyProjections):
+        projections = [projections]
+    return pd.concat([
+        chunkMetrics(chunk, regionrt, uscountydata, countybeds, model, hosp_LOS, ICU_LOS,
+                     available)
+        for chunk in projections
+    ], ignore_index=True)
+
+def chunkMetrics(projections, regionrt, uscountydata, countybeds, model, hosp_LOS, ICU_LOS,
+                 available):
+    states, counties = projections.counties.get_level_values(0), projections.counties.get_level_values(1)
+    confirmed = uscountydata.xs('Confirmed', axis=1, level=-1)[projections.counties]
+    census, icucensus = countyCensus(projections, model, hosp_LOS, ICU_LOS)
+
+    rt = np.full(len(counties), np.nan)
+    for i, region in enumerate(projections.counties):
+        latest = regionrt.latest(*region)
+        # only the county's own, not its state's
+        if latest is not None and latest['county']:
+            rt[i] = latest['Rt']
+
+    days = np.full(len(counties), np.nan)
+    if countybeds is not None:
+        beds = countybeds['staffed_beds'].reindex(projections.counties).values
+        days = firstCrossing(census, available*beds)
+
+    return pd.DataFrame({
+        'state': states,
+        'county': counties,
+        'population': projections.N,
+        'growth rate': batchEstimateBeta(confirmed.values[-7:].T, 0),
+        'Rt': rt,
+        'peak census per 100k': 1e5*census.max(axis=1)/projections.N,
+        'days to capacity': days,
+    })
+
+def simplifyLine(points, tolerance):
+    """Douglas-Peucker: the points of a line (an array of shape
+    (points, 2)) that keep it within tolerance of the original
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        inner = points[first + 1:last]
+        dx, dy = end - start
+        length = np.hypot(dx, dy)
+        if length:
+            distance = np.abs(dx*(inner[:, 1] - start[1]) - dy*(inner[:, 0] - start[0]))/length
+        else:
+            # a closed ring
+            distance = np.hypot(*(inner - start).T)
+        i = distance.argmax()
+        if distance[i] > tolerance:
+            keep[first + 1 + i] = True
+            stack += [(first, first + 1 + i), (first + 1 + i, last)]
+    return points[keep]
+
+def simplifyRing(ring, tolerance, precision):
+    points = np.asarray(ring, dtype=float)
+    simple = simplifyLine(points, tolerance) if tolerance else points
+    if len(simple) < 4:
+        # too small to simplify
+        simple = points
+    simple = simple.round(precision)
+    # drop points that rounded onto the one before
+    repeated = np.r_[False, (np.diff(simple, axis=0)==0).all(axis=1)]
+    return simple[~repeated].tolist()
+
+def simplifyShapes(geojson, tolerance=map_tolerance, precision=3):
+    """A copy of a GeoJSON FeatureCollection of (Multi)Polygons with
+    every ring simplified to tolerance (degrees), coordinates rounded
+    to precision decimals, and only the properties used here kept
+    """
+    features = []
+    for feature in geojson['features']:
+        geometry = feature['geometry']
+        polygons = geometry['coordinates']
+        if geometry['type']=='Polygon':
+            polygons = [polygons]
+        coordinates = [
+            [simplifyRing(ring, tolerance, precision) for ring in polygon]
+            for polygon in polygons
+        ]
+        properties = feature.get('properties', {})
+        features.append({
+            'type': 'Feature',
+            'id': featureId(feature),
+            'properties': {
+                'STATE': properties.get('STATE', properties.get('STATEFP')),
+                'NAME': properties.get('NAME'),
+                'LSAD': properties.get('LSAD'),
+            },
+            'geometry': {'type': 'MultiPolygon', 'coordinates': coordinates},
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+def featureId(feature):
+    return str(feature.get('id') or feature['properties']['GEOID']).zfill(5)
+
+def loadShapes(path=geojson_path, tolerance=map_tolerance):
+    """The county shapes at path, simplified. None if there's no file."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        raw = f.read()
+    try:
+        text = raw.decode('utf-8')
+    except UnicodeDecodeError:
+        # the 2010 census files are latin-1
+        text = raw.decode('latin-1')
+    return simplifyShapes(json.loads(text), tolerance)
+
+def countyFips(geojson):
+    """FIPS code of each (state, county) of the case data with a shape
+    in geojson, as a dict of lists (New York City has five)
+    """
+    fips = dict()
+    for feature in geojson['features']:
+        properties = feature['properties']
+        state = state_fips.get(str(properties.get('STATE')).zfill(2))
+        name = properties.get('NAME')
+        if state is None or name is None:
+            continue
+        # independent cities are 'Baltimore city' in the case data
+        if properties.get('LSAD')=='city' and not name.endswith('City'):
+            name = name + ' city'
+        fips[(state, name)] = [featureId(feature)]
+    fips.update(combined_counties)
+    return fips
+
+def mapLocations(table, geojson):
+    """The FIPS codes of the rows of a metrics table and the row each
+    comes from, to look up the values of a metric of every shape with
+    one index
+    """
+    fips = countyFips(geojson)
+    locations, rows = [], []
+    for i, region in enumerate(zip(table['state'], table['county'])):
+        for code in fips.get(region, []):
+            locations.append(code)
+            rows.append(i)
+    return locations, np.array(rows, dtype=int)
+
+if __name__ == '__main__':
+    from hospCensusModels import HospitalCensus
+    from loadCaseData import loadCountyData
+    from reproductionNumber import RegionRt
+
+    parser = argparse.ArgumentParser(description='County metrics for the national map')
+    parser.add_argument('--beds', help='bed capacity CSV, for days to capacity')
+    parser.add_argument('--silent', type=float, default=0.5,
+                        help='fraction of infections asymptomatic/untested')
+    parser.add_argument('--tsteps', type=int, default=365, help='days to project')
+    parser.add_argument('--hosp-LOS', type=int, default=7)
+    parser.add_argument('--available', type=float, default=1.0,
+                        help='fraction of beds available for COVID-19 patients')
+    parser.add_argument('--budget', type=float,
+                        help='megabytes to project at once (default COGIC_MEMORY_BUDGET)')
+    parser.add_argument('--output', default=metrics_cache)
+    parser.add_argument('--simplify', nargs=2, metavar=('INPUT', 'OUTPUT'),
+                        help='write a simplified copy of a county GeoJSON file instead')
+    parser.add_argument('--tolerance', type=float, default=map_tolerance,
+                        help='simplification tolerance, degrees')
+    opts = parser.parse_args()
+
+    if opts.simplify:
+        source, target = opts.simplify
+        shapes = loadShapes(source, opts.tolerance)
+        with open(target, 'w') as f:
+            json.dump(shapes, f, separators=(',', ':'))
+        print('{} counties, {:.0f}kB -> {:.0f}kB'.format(
+            len(shapes['features']), os.path.getsize(source)/1e3, os.path.getsize(target)/1e3))
+    else:
+        countybeds = loadBedCapacity(opts.beds)[0] if opts.beds else None
+        uscountydata = loadCountyData()
+        projections = projectionChunks(HospitalCensus(), uscountydata, opts.silent, opts.tsteps,
+                                       budget=opts.budget)
+        table = countyMetrics(projections, RegionRt(uscountydata), uscountydata, countybeds,
+                              hosp_LOS=opts.hosp_LOS, available=opts.available)
+
+        params = {k: v for k, v in vars(opts).items() if k not in ('output', 'simplify', 'tolerance')}
+        params['computed'] = date.today().isoformat()
+        saveCapacityCache(table, params, opts.output)
+        print(table.describe().T.to_string())
+        print('{} counties. Written to {}'.format(len(table), opts.output))
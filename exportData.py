@@ -0,0 +1,176 @@
+# exportData.py
+
+"""
+Export of projected series (S, I, R or the compartments of the
+epidemic model, incidence, and admissions,
+census and deaths of each type) for a set of regions, as CSV, Parquet
+or Excel.
+
+Regions are exported a chunk at a time: each chunk of at most
+chunk_counties counties is solved with regionGroups.CountyProjections,
+turned into rows, written and dropped before the next, so exporting
+every county never holds more than one chunk in memory. CSV and
+Parquet (one row group per chunk) are streamed as they're written.
+Excel files can only be written whole, so they're built in a
+temporary file with openpyxl's write-only mode and then streamed.
+
+Parquet needs pyarrow and Excel needs openpyxl, which aren't required
+by the app otherwise.
+"""
+
+import io
+import tempfile
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from regionGroups import CountyProjections, laggedCensus
+
+chunk_counties = 250
+
+formats = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+def chunkGroups(groups, size=chunk_counties):
+    """Splits a groups table (see regionGroups) into pieces of whole
+    groups with at most size counties each, unless a single group is
+    bigger.
+    """
+    chunk, counties = [], 0
+    for name, members in groups.groupby('group', sort=False):
+        if chunk and counties + len(members) > size:
+            yield pd.concat(chunk)
+            chunk, counties = [], 0
+        chunk.append(members)
+        counties += len(members)
+    if chunk:
+        yield pd.concat(chunk)
+
+def regionRows(name, proj, start, model, hosp_LOS, ICU_LOS,
+               hosprate=None, icurate=None, deathrate=None, compartments=('S', 'I', 'R')):
+    """A DataFrame of one rolled-up region's series, a row per day"""
+    days = len(proj['Inew'])
+    columns = {
+        'date': pd.date_range(start, periods=days),
+        'region': name,
+        **{compartment: proj[compartment] for compartment in compartments},
+        'Inew': proj['Inew'],
+    }
+    if model in ('Verity', 'CDC'):
+        admissions = proj[(model, 'admissions')]
+        deaths = proj[(model, 'deaths')]
+    else:
+        delayed = proj['delayed']
+        admissions = {'Hospitalized': hosprate*delayed['Hospitalized'],
+                      'ICU': icurate*delayed['ICU']}
+        deaths = {'Deaths': deathrate*np.cumsum(delayed['Deaths'])}
+    for key, values in admissions.items():
+        columns[key + ' admissions'] = values
+    for key, values in admissions.items():
+        LOS = ICU_LOS if key.startswith('ICU') else hosp_LOS
+        columns[key + ' census'] = laggedCensus(values[None, :], LOS)[0]
+    for key, values in deaths.items():
+        columns[key] = values
+    return pd.DataFrame(columns)
+
+def exportChunks(createcensus, uscountydata, groups, silent, tsteps,
+                 model='Verity', hosp_LOS=7, ICU_LOS=9,
+                 hosprate=None, icurate=None, deathrate=None, epimodel='SIR',
+                 start=None, size=chunk_counties, regionrt=None):
+    """DataFrames of the series of every region in groups, a chunk of
+    regions at a time. With regionrt, transmission rates come from Rt
+    (see CountyProjections).
+    """
+    start = start or date.today()
+    for chunk in chunkGroups(groups, size):
+        counties = list(set(zip(chunk['state'], chunk['county'])))
+        projections = CountyProjections(createcensus, uscountydata, silent, tsteps,
+                                        epimodel, counties=counties, regionrt=regionrt)
+        rolled = projections.rollup(chunk)
+        yield pd.concat([
+            regionRows(name, proj, start, model, hosp_LOS, ICU_LOS,
+                       hosprate, icurate, deathrate, projections.compartments)
+            for name, proj in rolled.items()
+        ], ignore_index=True).round(2)
+
+def streamCSV(chunks):
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header, date_format='%Y-%m-%d')
+        header = False
+
+class _Sink(io.RawIOBase):
+    """Write-only file that keeps what's written until it's taken"""
+    def __init__(self):
+        self.buffer = bytearray()
+    def writable(self):
+        return True
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+def streamParquet(chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _Sink()
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.take()
+    if writer is not None:
+        writer.close()
+        yield sink.take()
+
+def streamExcel(chunks):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('projections')
+    header = True
+    for chunk in chunks:
+        if header:
+            sheet.append(list(chunk.columns))
+            header = False
+        chunk = chunk.assign(date=chunk['date'].dt.date)
+        for row in chunk.itertuples(index=False):
+            sheet.append(list(row))
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            data = f.read(1 << 16)
+            if not data:
+                break
+            yield data
+
+writers = {
+    'csv': streamCSV,
+    'parquet': streamParquet,
+    'xlsx': streamExcel,
+}
+
+def checkFormat(fmt):
+    """Raises ValueError for an unknown format or one whose library
+    isn't installed
+    """
+    if fmt not in writers:
+        raise ValueError('format must be one of ' + ', '.join(writers))
+    try:
+        if fmt=='parquet':
+            import pyarrow.parquet
+        elif fmt=='xlsx':
+            import openpyxl
+    except ImportError as e:
+        raise ValueError('{} export needs {}'.format(fmt, e.name))
@@ -0,0 +1,32 @@
+# gunicorn.conf.py
+
+"""
+Pre-forking deployment:
+
+    gunicorn -c gunicorn.conf.py application:application
+
+The app, and with it the case, population and rate data, is loaded
+once in the master process before the workers are forked, so they
+share it copy-on-write rather than each downloading and holding
+their own copy. Use workerMemory.py to see per-worker memory.
+"""
+
+import os
+import multiprocessing
+
+from startup import freezeForFork
+
+# workers only share the data if it's loaded before they're forked
+os.environ['COGIC_STARTUP'] = 'eager'
+preload_app = True
+
+bind = os.environ.get('COGIC_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('COGIC_WORKERS', multiprocessing.cpu_count()))
+pidfile = os.environ.get('COGIC_PIDFILE', '/tmp/cogic-gunicorn.pid')
+
+def when_ready(server):
+    # called in the master after the app is loaded, before any workers
+    import application
+    application.preload()
+    freezeForFork()
+    server.log.info('data loaded, forking workers\n' + application.startuptimer.report())
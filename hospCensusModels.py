@@ -2,7 +2,7 @@
 
 import pandas as pd
 import numpy as np
-from populationModels import census2cdc, census2verity, loadUSCountyPopStructure
+from populationModels import census2cdc, census2verity, loadUSCountyPopStructure, ageBinMatrix
 
 # CDC data from MMWR data, corrected to NYC population
 # structure and
@@ -95,18 +95,14 @@ class HospitalCensus:
         for i in [x for x in set(tmpdata.columns.get_level_values(0))]:
             statedata[i] = tmpdata[i].sum(axis=1)
 
+        popstructure = self.regionPopStructure(state, county)
         if county=='All':
-            statekey = state.replace(' ','')
-            popstructure = self.us_popstructure[statekey].sum(axis=1)
             data = {
                 'state': statedata,
                 'county':statedata
                 }
         else:
             # for individual county
-            statekey = state.replace(' ','')
-            countykey = county.replace(' City','')
-            popstructure = self.us_popstructure[statekey][countykey]
             data = {
                 'state': statedata,
                 'county':data[state][county]
@@ -125,6 +121,59 @@ class HospitalCensus:
 
         return (data, popstructure, N)
 
+    def regionPopStructure(self, state, county):
+        """Census population by 5 year age range for a county,
+        or the whole state if county is 'All'.
+        """
+        statekey = state.replace(' ','')
+        if county=='All':
+            return self.us_popstructure[statekey].sum(axis=1)
+        countykey = county.replace(' City','')
+        return self.us_popstructure[statekey][countykey]
+
+    def calcRateTables(self, state, county):
+        """Admission and death rates of every published rate model
+        for a region, keyed by model name. These depend only on the
+        age structure of the region, not on any of the sliders.
+        """
+        popstructure = self.regionPopStructure(state, county)
+        popstructure = popstructure / popstructure.sum()
+        tables = dict()
+        for model, convert in [('Verity', census2verity), ('CDC', census2cdc)]:
+            modelpop = convert(popstructure)
+            tables[model] = {
+                'admissions': self.calcAdmissionRates(modelpop, None, None, model),
+                'deaths': self.calcDeathRates(None, modelpop, model)
+            }
+        return tables
+
+    def calcCountyRateTables(self, counties=None):
+        """calcRateTables for every county at once, or those in
+        counties. The tables are DataFrames indexed by the
+        (State, County) keys of us_popstructure, with a column per
+        admission or death type.
+        """
+        popstructure = self.us_popstructure
+        if counties is not None:
+            popstructure = popstructure[counties]
+        popstructure = popstructure / popstructure.sum()
+        tables = dict()
+        for model, convert, admissions, deaths, hospfactor, deathfactor in [
+            ('Verity', census2verity, self.verityadmissions, self.veritydeaths, 1, 1),
+            ('CDC', census2cdc, self.cdcadmissions, self.cdcdeaths,
+             cdc_hosp_correction_factor, cdc_deaths_correction_factor)
+        ]:
+            modelpop = (ageBinMatrix(convert) @ popstructure.values).T
+            tables[model] = {
+                'admissions': pd.DataFrame(
+                    modelpop @ admissions.values * hospfactor,
+                    index=popstructure.columns, columns=admissions.columns),
+                'deaths': pd.DataFrame(
+                    modelpop @ deaths.values * deathfactor,
+                    index=popstructure.columns, columns=deaths.columns)
+            }
+        return tables
+
     def calcAdmissionRates(self, popstructure, hosprate, icurate, model=None):
         if model=='CDC':
             admissionrates = self.calcCDCAdmissionRates(popstructure)
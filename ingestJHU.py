@@ -0,0 +1,137 @@
+# ingestJHU.py
+
+"""
+Ingest of the JHU CSSE daily reports into the case store (see
+caseStore.py), from a local clone of
+https://github.com/CSSEGISandData/COVID-19:
+
+    python ingestJHU.py COVID-19/csse_covid_19_data/csse_covid_19_daily_reports
+
+Each report (MM-DD-YYYY.csv, cumulative counts as of that day) is
+parsed in a pool of worker processes. Only lines mentioning the US are
+parsed at all, and the column names of the different versions of the
+report format are mapped to one set. Parsed reports are cached by file
+name, size and modification time, so a re-run after a git pull only
+parses the new or changed days.
+
+County rows only start with the 03-22-2020 report, when Admin2 was
+added, so earlier reports contribute nothing.
+"""
+
+import io
+import os
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from caseStore import cache_dir, default_store, writeStore
+
+report_cache = os.path.join(cache_dir, 'jhu')
+
+# the names each version of the report format has used for the
+# columns we need
+columns = {
+    'Province/State': 'state',
+    'Province_State': 'state',
+    'Country/Region': 'country',
+    'Country_Region': 'country',
+    'Admin2': 'county',
+    'Confirmed': 'Confirmed',
+    'Deaths': 'Deaths',
+}
+
+def reportDate(path):
+    return pd.to_datetime(os.path.basename(path)[:-4], format='%m-%d-%Y')
+
+def parseReport(path):
+    """The US county rows of a daily report, as a DataFrame with
+    columns date, state, county, Confirmed and Deaths
+    """
+    with open(path, encoding='utf-8-sig') as f:
+        header = f.readline()
+        lines = [line for line in f if 'US' in line]
+    frame = pd.read_csv(
+        io.StringIO(header + ''.join(lines)),
+        usecols=lambda column: column.strip() in columns,
+        dtype={'Admin2': str, 'FIPS': str})
+    frame = frame.rename(columns=lambda column: columns[column.strip()])
+    if 'county' not in frame:
+        return pd.DataFrame(columns=['date', 'state', 'county'] + ['Confirmed', 'Deaths'])
+
+    frame = frame[(frame['country']=='US') & frame['county'].notna()]
+    frame = frame.groupby(['state', 'county'], as_index=False)[['Confirmed', 'Deaths']].sum()
+    frame.insert(0, 'date', reportDate(path))
+    return frame
+
+def cacheFile(path, cachedir=report_cache):
+    stat = os.stat(path)
+    return os.path.join(cachedir, '{}-{}-{}.pkl'.format(
+        os.path.basename(path)[:-4], stat.st_size, stat.st_mtime_ns))
+
+def parseAndCache(path, cachefile):
+    parseReport(path).to_pickle(cachefile)
+
+def countyTable(reports):
+    """Parsed reports as a DataFrame laid out like loadCountyData's,
+    uncleaned, with NaN for days a county wasn't reported
+    """
+    wide = pd.concat(reports, ignore_index=True).pivot_table(
+        index='date',
+        columns=['state', 'county'],
+        values=['Confirmed', 'Deaths'],
+        aggfunc='sum'
+    ).swaplevel(0, -1, axis=1).swaplevel(0, -2, axis=1)
+    wide.columns.names = ['State', 'County', None]
+    # days without a report are gaps too
+    wide = wide.reindex(pd.date_range(wide.index.min(), wide.index.max()))
+    wide.index = wide.index.strftime('%Y-%m-%d')
+    return wide
+
+def ingest(reportdir, store=default_store, cachedir=report_cache, workers=None,
+           cleaning=None):
+    """Parses the daily reports in reportdir that aren't cached yet,
+    and writes all of them to the case store, cleaned with the
+    cleaning options (see caseCleaning.cleanArrays). Returns the
+    number of reports parsed and the number read from the cache.
+    """
+    paths = sorted(
+        glob.glob(os.path.join(reportdir, '*.csv')),
+        key=reportDate)
+    os.makedirs(cachedir, exist_ok=True)
+    cachefiles = [cacheFile(path, cachedir) for path in paths]
+    todo = [(path, cachefile) for path, cachefile in zip(paths, cachefiles)
+            if not os.path.exists(cachefile)]
+
+    if todo:
+        with ProcessPoolExecutor(workers) as pool:
+            list(pool.map(parseAndCache, *zip(*todo)))
+        # older versions of reports that were re-parsed
+        current = set(cachefiles)
+        for path, cachefile in todo:
+            stem = os.path.basename(path)[:-4]
+            for stale in glob.glob(os.path.join(cachedir, stem + '-*.pkl')):
+                if stale not in current:
+                    os.remove(stale)
+
+    wide = countyTable([pd.read_pickle(cachefile) for cachefile in cachefiles])
+    writeStore(wide, store, cleaning, source=os.path.abspath(reportdir), reports=len(paths))
+    return len(todo), len(paths) - len(todo)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest JHU daily reports into the case store')
+    parser.add_argument('reportdir', help='csse_covid_19_daily_reports directory')
+    parser.add_argument('--store', default=default_store, help='case store directory')
+    parser.add_argument('--cache', default=report_cache, help='parsed report cache')
+    parser.add_argument('--workers', type=int, help='parsing processes (default: CPUs)')
+    parser.add_argument('--smoothing', choices=['rolling', 'exponential'],
+                        help='smoothing of daily counts (default rolling)')
+    parser.add_argument('--window', type=int, help='rolling mean window, days (default 7)')
+    parser.add_argument('--alpha', type=float, help='exponential filter weight (default 0.3)')
+    opts = parser.parse_args()
+
+    cleaning = {'method': opts.smoothing, 'window': opts.window, 'alpha': opts.alpha}
+    parsed, cached = ingest(opts.reportdir, opts.store, opts.cache, opts.workers, cleaning)
+    print('{} reports parsed, {} cached. Written to {}'.format(parsed, cached, opts.store))
+    print('Use it with COGIC_CASE_STORE={}'.format(opts.store))
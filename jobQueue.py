@@ -0,0 +1,227 @@
+"""SQLite-backed queue for long-running computations.
+
+Jobs are identified by a hash of their kind, parameters and the
+versions of the code and data they're computed from, so the same
+scenario submitted twice (or by two users) is computed once, a
+finished result is returned straight away until it's pruned, and a
+deploy or new data makes new jobs rather than serving old results. Job
+functions are registered by kind with register(), take the job's
+parameters and a progress(fraction, message) function, and return
+something JSON-serializable.
+
+The queue is a file, so every gunicorn worker shares it: a job
+submitted through one worker can be polled through another. Each
+process that submits jobs runs worker threads that claim and run them
+(started on the first submit, so they're started after gunicorn
+forks). Extra worker processes can be run with
+
+    python jobQueue.py [threads]
+
+COGIC_JOB_DB sets the database file, by default in the temp directory.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import plotly
+
+logger = logging.getLogger(__name__)
+
+job_db = os.environ.get('COGIC_JOB_DB',
+                        os.path.join(tempfile.gettempdir(), 'cogic-jobs.sqlite'))
+
+# jobs running for longer than this are assumed to belong to a worker
+# that died, and are queued again, seconds
+job_timeout = 600
+# finished jobs are deleted after this long, seconds
+job_ttl = 24*3600
+
+schema = '''
+create table if not exists jobs (
+    id text primary key,
+    kind text not null,
+    params text not null,
+    status text not null,
+    progress real not null default 0,
+    message text not null default '',
+    result text,
+    error text,
+    worker text,
+    created real not null,
+    started real,
+    finished real
+)
+'''
+
+jobfunctions = dict()
+
+def register(kind, func):
+    jobfunctions[kind] = func
+
+def jobId(kind, params, versions=None):
+    key = json.dumps([kind, params, versions], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+class JobQueue:
+    def __init__(self, path=job_db):
+        self.path = path
+        self.workers = []
+        self.workerpid = None
+        with self.connect() as db:
+            db.execute('pragma journal_mode=wal')
+            db.execute(schema)
+
+    @contextmanager
+    def connect(self):
+        # a connection per call, since connections can't be shared
+        # between threads. Autocommits each statement.
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def submit(self, kind, params, workers=1, versions=None):
+        """Queues a job, unless the same job is already queued, running
+        or done. versions (e.g. scenarioStore's model and data
+        versions) only go into the job id. Returns the job id.
+        """
+        if kind not in jobfunctions:
+            raise ValueError('unknown job kind ' + kind)
+        self.startWorkers(workers)
+        id = jobId(kind, params, versions)
+        with self.connect() as db:
+            db.execute(
+                'insert or ignore into jobs (id, kind, params, status, created) '
+                "values (?, ?, ?, 'queued', ?)",
+                (id, kind, json.dumps(params), time.time()))
+            # retry failed jobs
+            db.execute(
+                "update jobs set status='queued', error=null, progress=0, message='' "
+                "where id=? and status='failed'", (id,))
+        return id
+
+    def status(self, id):
+        """Dict with the status (queued, running, done or failed),
+        progress, message, the number of jobs ahead of a queued job, and
+        the result once done. None for an unknown id.
+        """
+        with self.connect() as db:
+            row = db.execute('select * from jobs where id=?', (id,)).fetchone()
+            if row is None:
+                return None
+            job = {
+                'id': id,
+                'status': row['status'],
+                'progress': row['progress'],
+                'message': row['message'],
+                'error': row['error'],
+                'result': json.loads(row['result']) if row['result'] else None
+            }
+            if row['status']=='queued':
+                job['ahead'] = db.execute(
+                    "select count(*) from jobs where status='queued' and created<?",
+                    (row['created'],)).fetchone()[0]
+        return job
+
+    def claim(self, worker):
+        """Marks the oldest queued job as running by worker and returns
+        it, or None if there isn't one.
+        """
+        with self.connect() as db:
+            db.execute('begin immediate')
+            try:
+                db.execute(
+                    "update jobs set status='queued', worker=null "
+                    "where status='running' and started<?", (time.time() - job_timeout,))
+                row = db.execute(
+                    "select id, kind, params from jobs where status='queued' "
+                    "order by created limit 1").fetchone()
+                if row is not None:
+                    db.execute(
+                        "update jobs set status='running', worker=?, started=? where id=?",
+                        (worker, time.time(), row['id']))
+            except Exception:
+                db.execute('rollback')
+                raise
+            db.execute('commit')
+        return row
+
+    def progress(self, id, fraction, message=''):
+        with self.connect() as db:
+            db.execute('update jobs set progress=?, message=? where id=?',
+                       (fraction, message, id))
+
+    def finish(self, id, result=None, error=None):
+        with self.connect() as db:
+            db.execute(
+                'update jobs set status=?, result=?, error=?, progress=?, finished=? '
+                'where id=?',
+                ('failed' if error else 'done',
+                 None if error else json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder),
+                 error, 0 if error else 1, time.time(), id))
+
+    def prune(self):
+        with self.connect() as db:
+            db.execute("delete from jobs where status in ('done', 'failed') and finished<?",
+                       (time.time() - job_ttl,))
+
+    def runJob(self, row):
+        params = json.loads(row['params'])
+        def progress(fraction, message=''):
+            self.progress(row['id'], fraction, message)
+        try:
+            result = jobfunctions[row['kind']](params, progress)
+        except Exception as e:
+            logger.exception('job %s failed', row['id'])
+            self.finish(row['id'], error=repr(e))
+        else:
+            self.finish(row['id'], result)
+
+    def work(self, stop=None, idle=0.2):
+        """Runs queued jobs until stop (a threading.Event) is set"""
+        worker = '{}-{}'.format(os.getpid(), uuid.uuid4().hex[:8])
+        lastprune = 0
+        while stop is None or not stop.is_set():
+            row = self.claim(worker)
+            if row is None:
+                if time.time() - lastprune > 3600:
+                    self.prune()
+                    lastprune = time.time()
+                time.sleep(idle)
+            else:
+                self.runJob(row)
+
+    def startWorkers(self, n):
+        """Starts n worker threads in this process, once"""
+        if self.workerpid==os.getpid():
+            return
+        self.workerpid = os.getpid()
+        self.workers = [
+            threading.Thread(target=self.work, name='cogic-job-{}'.format(i), daemon=True)
+            for i in range(n)
+        ]
+        for thread in self.workers:
+            thread.start()
+
+if __name__ == '__main__':
+    # the job functions are registered by the app
+    import application
+
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    logging.basicConfig(level=logging.INFO)
+    queue = application.jobqueue or JobQueue()
+    logger.info('running %d job worker(s) on %s', threads, queue.path)
+    for i in range(threads - 1):
+        threading.Thread(target=queue.work, daemon=True).start()
+    queue.work()
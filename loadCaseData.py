@@ -1,7 +1,24 @@
 # Functions for loading case and demographic data
+import os
+import tempfile
+import numpy as np
 import pandas as pd
 from collections import defaultdict 
 
+from caseStore import caseStorePath, readStore, stateTotals
+from caseCleaning import cleanFrame
+
+nyt_url = 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/'
+
+def caseDataPath(filename):
+    """NYT case data are read from github, unless COGIC_CASE_DATA
+    is set to a local directory holding copies of the files.
+    """
+    casedir = os.environ.get('COGIC_CASE_DATA')
+    if casedir:
+        return os.path.join(casedir, filename)
+    return nyt_url + filename
+
 
 def createCountyList(df):
     """Adapted from Geeks from Geeks
@@ -18,32 +35,96 @@ def createCountyList(df):
 # this could be created with the county data below
 def loadStateData(t0='2020-03-10'):
     """Loads the current us state-level data on confirmed cases,
-    deaths, and recovered from JHU github.
+    deaths, and recovered from JHU github. Counts are cleaned with
+    caseCleaning.
 
     Returns a dataframe with multiindex columns.
     df[State][Confirmed/Infected/Deaths/Recovered]
     """
-    df = pd.read_csv('https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv')
+    if caseStorePath():
+        return stateTotals(readStore(caseStorePath())).loc[t0:]
+    df = pd.read_csv(caseDataPath('us-states.csv'))
     df.columns = ['date','State','fips','Confirmed','Deaths']
     df = df.pivot(
         index='date',
         columns='State',
         values=['Confirmed', 'Deaths']
-    ).interpolate().fillna(0)
-    df = df.swaplevel(-2,-1, axis=1)
+    )
+    df = cleanFrame(df).swaplevel(-2,-1, axis=1)
     return df.loc[t0:]
 
-def loadCountyData(t0='2020-03-10'):
+def loadCountyData(t0='2020-03-10', raw=False):
     """Loads the current us state-level data on confirmed cases,
-    deaths, and recovered from New York Times github.
+    deaths, and recovered from New York Times github. Counts are
+    cleaned with caseCleaning, unless raw.
 
     Returns a dataframe with multiindex columns.
     df[State][Confirmed/Infected/Deaths/Recovered]
     """
-    df = pd.read_csv('https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv')
+    if caseStorePath():
+        return readStore(caseStorePath(), raw=raw).loc[t0:]
+    df = pd.read_csv(caseDataPath('us-counties.csv'))
     df.columns = ['date','County','State','fips','Confirmed','Deaths']
-    return df.pivot_table(
+    wide = df.pivot_table(
         index='date',
         columns=['State','County'],
         values=['Confirmed','Deaths']
-    ).fillna(0).swaplevel(0,-1,axis=1).swaplevel(0,-2,axis=1).loc[t0:]
+    )
+    if not raw:
+        wide = cleanFrame(wide)
+    return wide.swaplevel(0,-1,axis=1).swaplevel(0,-2,axis=1).loc[t0:]
+
+def writeSyntheticCaseData(casedir, t0='2020-03-01', days=60, seed=0):
+    """Writes stand-in us-states.csv and us-counties.csv files in the
+    NYT format to casedir, for every county in the population data,
+    so the app can run offline with COGIC_CASE_DATA=casedir.
+    Cases grow exponentially at a random rate for each county.
+    """
+    from populationModels import loadUSCountyPopStructure, loadUSPopulation
+
+    popstructure = loadUSCountyPopStructure()
+    # state names in popstructure have no whitespace
+    statenames = {
+        state.replace(' ',''): state for state in loadUSPopulation().index
+    }
+    regions = popstructure.columns
+    population = popstructure.sum().values
+
+    rng = np.random.RandomState(seed)
+    growth = rng.uniform(0.05, 0.2, len(regions))
+    t = np.arange(days)
+    cases = np.floor(
+        np.maximum(1, 1e-5*population)[:,None] * np.exp(growth[:,None]*t)
+    )
+    cases = np.minimum(cases, np.floor(0.05*population)[:,None])
+    deaths = np.floor(0.02*cases)
+
+    dates = pd.date_range(t0, periods=days).strftime('%Y-%m-%d')
+    counties = pd.DataFrame({
+        'date': np.tile(dates, len(regions)),
+        'county': np.repeat(regions.get_level_values('County'), days),
+        'state': np.repeat(
+            [statenames[state] for state in regions.get_level_values('State')],
+            days
+            ),
+        'fips': np.repeat(np.arange(len(regions)), days),
+        'cases': cases.ravel(),
+        'deaths': deaths.ravel()
+    })
+    counties.to_csv(os.path.join(casedir, 'us-counties.csv'), index=False)
+
+    states = counties.groupby(['date','state'])[['cases','deaths']].sum().reset_index()
+    states.insert(2, 'fips', 0)
+    states.to_csv(os.path.join(casedir, 'us-states.csv'), index=False)
+
+def useSyntheticCaseData():
+    """Points the loaders at a synthetic case file, written to the temp
+    directory on first use, unless COGIC_CASE_DATA is already set.
+    For benchmarks and load tests that need to run offline.
+    """
+    if not os.environ.get('COGIC_CASE_DATA'):
+        casedir = os.path.join(tempfile.gettempdir(), 'cogic-synthetic-cases')
+        if not os.path.exists(casedir):
+            os.makedirs(casedir)
+            writeSyntheticCaseData(casedir)
+        os.environ['COGIC_CASE_DATA'] = casedir
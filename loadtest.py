@@ -0,0 +1,315 @@
+"""Load test that replays Dash callback traffic against the app.
+
+Each session loads the page, fires the callbacks Dash fires on page
+load, then makes a series of interactions: picking a state and county
+(weighted by population), dragging the asymptomatic slider, changing
+the days to project, and moving the client-side controls, which cost
+no server requests. Server requests are posted to
+_dash-update-component exactly as dash-renderer would, following the
+app's /_dash-dependencies.
+
+By default the app is run in-process (application.server) on a
+synthetic case file, so no network is needed. --url targets a running
+server instead. Sessions can be written out with --record and replayed
+with --replay.
+
+Usage:
+    python loadtest.py --sessions 50 --concurrency 8
+    python loadtest.py --url http://127.0.0.1:8000 --record sessions.jsonl
+    python loadtest.py --replay sessions.jsonl --concurrency 16
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from callbackRequests import callbackGraph
+from populationModels import loadUSPopulation, loadUSCountyPopStructure
+
+# relative frequency of each kind of interaction in synthetic sessions
+interaction_weights = {
+    'state': 1,
+    'county': 3,
+    'silent': 3,
+    'tsteps': 1,
+    'clientside': 4,
+    'compare': 1,
+}
+
+# controls handled client-side, see assets/clientside.js
+clientside_controls = {
+    'hospitalizationrate-slider.value': [0.01, 0.025, 0.05, 0.1],
+    'icurate-slider.value': [0.0, 0.01, 0.02, 0.05],
+    'deathrate-slider.value': [0.001, 0.005, 0.01, 0.03],
+    'hospmodel.value': ['Verity', 'CDC', 'Custom'],
+    'hosp_LOS.value': [5, 7, 10],
+    'ICU_LOS.value': [7, 9, 14],
+}
+
+initial_values = {
+    'state-dropdown.value': 'Minnesota',
+    'county-dropdown.value': 'Brown',
+    'silent-slider.value': 0.5,
+    'tsteps.value': 200,
+    'beta-source.value': 'doubling',
+    'epi-model.value': 'SIR',
+    'hospitalizationrate-slider.value': 0.025,
+    'icurate-slider.value': 0.01,
+    'deathrate-slider.value': 0.005,
+    'hospmodel.value': 'Verity',
+    'hosp_LOS.value': 7,
+    'ICU_LOS.value': 9,
+    'compare-dropdown.value': [],
+    'capacity-table.page_current': 0,
+    'capacity-table.page_size': 25,
+    'capacity-table.sort_by': [],
+    'map-metric.value': 'growth rate',
+}
+
+def callbackName(callback):
+    name = callback['outputs'][0]
+    if len(callback['outputs']) > 1:
+        name += ' +{}'.format(len(callback['outputs']) - 1)
+    return name
+
+class InProcessClient:
+    """Flask test client for application.server, one per thread"""
+    def __init__(self, server):
+        self.server = server
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.server.test_client()
+        response = self.local.client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+class HTTPClient:
+    """requests session to a running server, one per thread"""
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        import requests
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        response = self.local.session.request(method, self.url + path, json=body)
+        return response.status_code, response.content
+
+def populationWeights():
+    """Population of each state, and of each county by state, keyed
+    by the names used in the app's dropdowns.
+    """
+    statepop = loadUSPopulation()['Population']
+    countypop = loadUSCountyPopStructure().sum()
+    # state names in the county population data have no whitespace
+    statenames = {state.replace(' ',''): state for state in statepop.index}
+    counties = defaultdict(dict)
+    for (state, county), pop in countypop.items():
+        counties[statenames.get(state, state)][county] = pop
+    return statepop.to_dict(), counties
+
+def syntheticSession(rng, statepop, interactions):
+    """A list of (control, value) changes. County and comparison
+    choices are made while the session runs, from the options the
+    server returns, so they're recorded with the value None.
+    """
+    states = list(statepop)
+    p = np.array([statepop[s] for s in states], dtype=float)
+    kinds = list(interaction_weights)
+    w = np.array([interaction_weights[k] for k in kinds], dtype=float)
+
+    session = []
+    for i in range(interactions):
+        kind = kinds[rng.choice(len(kinds), p=w/w.sum())]
+        if kind=='state':
+            session.append(('state-dropdown.value', states[rng.choice(len(states), p=p/p.sum())]))
+            session.append(('county-dropdown.value', None))
+        elif kind=='county':
+            session.append(('county-dropdown.value', None))
+        elif kind=='silent':
+            # a drag only sends the value it's released at
+            session.append(('silent-slider.value', round(float(rng.uniform(0, 0.95)), 2)))
+        elif kind=='tsteps':
+            session.append(('tsteps.value', int(rng.choice([100, 200, 300, 365]))))
+        elif kind=='compare':
+            session.append(('compare-dropdown.value', None))
+        else:
+            control = sorted(clientside_controls)[rng.choice(len(clientside_controls))]
+            values = clientside_controls[control]
+            session.append((control, values[rng.choice(len(values))]))
+    return session
+
+class LoadTest:
+    def __init__(self, client, think=0.0, seed=0):
+        self.client = client
+        self.think = think
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.bytes = defaultdict(int)
+
+        status, deps = client.request('GET', '/_dash-dependencies')
+        self.graph = [c for c in callbackGraph(json.loads(deps)) if not c['clientside']]
+        self.statepop, self.countypop = populationWeights()
+
+    def timed(self, name, method, path, body=None):
+        start = time.perf_counter()
+        try:
+            status, data = self.client.request(method, path, body)
+        except Exception:
+            status, data = None, b''
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            self.bytes[name] += len(data)
+            # 204 is a callback that raised PreventUpdate
+            if status not in (200, 204):
+                self.errors[name] += 1
+        return status, data
+
+    def fire(self, callback, values, changed):
+        body = {
+            'output': callback['output'],
+            'inputs': [
+                dict(zip(['id', 'property'], i.split('.')), value=values.get(i))
+                for i in callback['inputs']
+            ],
+            'state': [
+                dict(zip(['id', 'property'], i.split('.')), value=values.get(i))
+                for i in callback['state']
+            ],
+            'changedPropIds': changed
+        }
+        status, data = self.timed(
+            callbackName(callback), 'POST', '/_dash-update-component', body)
+        if status==200:
+            # remember outputs that are inputs to other callbacks,
+            # e.g. the county options
+            response = json.loads(data)['response']
+            if 'props' in response:
+                values[callback['outputs'][0]] = response['props'][
+                    callback['outputs'][0].split('.')[1]]
+
+    def change(self, values, control):
+        """Fire the server callbacks that take control as an input"""
+        for callback in self.graph:
+            if control in callback['inputs']:
+                self.fire(callback, values, [control])
+
+    def pickCounty(self, values, rng):
+        options = [o['value'] for o in values.get('county-dropdown.options') or []]
+        if not options:
+            return values['county-dropdown.value']
+        pop = self.countypop[values['state-dropdown.value']]
+        p = np.array([pop.get(c.replace(' City',''), 1) for c in options], dtype=float)
+        return options[rng.choice(len(options), p=p/p.sum())]
+
+    def pickComparison(self, values, rng):
+        """2 to 5 of the regions offered for comparison"""
+        options = [o['value'] for o in values.get('compare-dropdown.options') or []]
+        if not options:
+            return []
+        n = min(len(options), rng.randint(2, 6))
+        return [options[i] for i in rng.choice(len(options), n, replace=False)]
+
+    def runSession(self, session, rng):
+        self.timed('page', 'GET', '/')
+        self.timed('layout', 'GET', '/_dash-layout')
+        self.timed('dependencies', 'GET', '/_dash-dependencies')
+
+        # on page load dash-renderer fires every callback once
+        values = dict(initial_values)
+        for callback in self.graph:
+            self.fire(callback, values, [])
+
+        for control, value in session:
+            if self.think:
+                time.sleep(rng.exponential(self.think))
+            if control=='county-dropdown.value' and value is None:
+                value = self.pickCounty(values, rng)
+            if control=='compare-dropdown.value' and value is None:
+                value = self.pickComparison(values, rng)
+            values[control] = value
+            self.change(values, control)
+
+    def run(self, sessions, concurrency):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            futures = [
+                pool.submit(self.runSession, session, np.random.RandomState(self.seed + i))
+                for i, session in enumerate(sessions)
+            ]
+            for future in futures:
+                future.result()
+        return time.perf_counter() - start
+
+    def report(self, elapsed):
+        columns = ['requests', 'errors', 'err%', 'p50_ms', 'p95_ms', 'p99_ms', 'kB/req']
+        lines = ['{:32s}'.format('request') + ''.join('{:>10s}'.format(c) for c in columns)]
+        total = 0
+        for name, times in sorted(self.latencies.items()):
+            times = 1e3*np.array(times)
+            total += len(times)
+            lines.append('{:32s}{:>10d}{:>10d}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+                name, len(times), self.errors[name],
+                100*self.errors[name]/len(times),
+                np.percentile(times, 50), np.percentile(times, 95), np.percentile(times, 99),
+                self.bytes[name]/len(times)/1024
+            ))
+        errors = sum(self.errors.values())
+        lines.append('')
+        lines.append('{} requests in {:.1f}s, {:.1f} requests/s, {} errors ({:.1f}%)'.format(
+            total, elapsed, total/elapsed, errors, 100*errors/max(total, 1)))
+        return '\n'.join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='COGIC load test')
+    parser.add_argument('--url', help='running server to test, instead of in-process')
+    parser.add_argument('--sessions', type=int, default=20, help='synthetic sessions')
+    parser.add_argument('--interactions', type=int, default=20,
+                        help='interactions per synthetic session')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent sessions')
+    parser.add_argument('--think', type=float, default=0.0,
+                        help='mean think time between interactions, seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record', help='write the sessions to this file (json lines)')
+    parser.add_argument('--replay', help='replay sessions from this file')
+    opts = parser.parse_args()
+
+    if opts.url:
+        client = HTTPClient(opts.url)
+    else:
+        from loadCaseData import useSyntheticCaseData
+        useSyntheticCaseData()
+        os.environ['COGIC_STARTUP'] = 'eager'
+        from application import application
+        client = InProcessClient(application)
+
+    loadtest = LoadTest(client, think=opts.think, seed=opts.seed)
+
+    if opts.replay:
+        with open(opts.replay) as f:
+            sessions = [[tuple(change) for change in json.loads(line)] for line in f]
+    else:
+        rng = np.random.RandomState(opts.seed)
+        sessions = [
+            syntheticSession(rng, loadtest.statepop, opts.interactions)
+            for i in range(opts.sessions)
+        ]
+    if opts.record:
+        with open(opts.record, 'w') as f:
+            for session in sessions:
+                f.write(json.dumps(session) + '\n')
+
+    elapsed = loadtest.run(sessions, opts.concurrency)
+    print(loadtest.report(elapsed))
+    sys.exit(1 if sum(loadtest.errors.values()) else 0)
@@ -0,0 +1,67 @@
+# memoryBudget.py
+
+"""
+Precision and memory budget of batch projections.
+
+Projecting every county for a year holds a series per county, day and
+compartment, plus the solver's and the outcome convolutions' working
+copies, about 11 + compartments values per county and day at the peak
+(measured with tracemalloc), so in double precision 3000 counties for
+365 days take ~130MB, and more for longer horizons or more regions
+(e.g. backtest cutoffs). compartments + 4 of those values (the
+compartments, incidence and the three delayed incidences) are kept in
+the storage dtype, 8 or 4 bytes, and the other 7 are the solver's
+double precision working copies.
+
+Settings, starting from the environment:
+
+    COGIC_PRECISION      'double' (default) or 'single', the dtype the
+                         projected series are kept in. Solving and
+                         convolving are always done in double
+                         precision, only the results are stored in
+                         single.
+    COGIC_MEMORY_BUDGET  megabytes a batch may use at once (default
+                         1024). Bigger batches are projected a chunk of
+                         regions at a time, and reduced (peaks,
+                         crossings, roll-ups) chunk by chunk, see
+                         regionGroups.projectionChunks.
+"""
+
+import os
+
+import numpy as np
+
+settings = {
+    'precision': os.environ.get('COGIC_PRECISION', 'double'),
+    'budget': float(os.environ.get('COGIC_MEMORY_BUDGET', 1024)),
+}
+dtypes = {'double': np.float64, 'single': np.float32}
+# series per region kept in the storage dtype, besides the
+# compartments, and double precision working copies
+stored_series = 4
+working_series = 7
+
+def storageType(precision=None):
+    """dtype projected series are kept in"""
+    precision = precision or settings['precision']
+    if precision not in dtypes:
+        raise ValueError('unknown precision ' + precision)
+    return dtypes[precision]
+
+def regionBytes(tsteps, compartments, precision=None):
+    """Peak memory of projecting one region for tsteps days, with
+    series kept at precision (default settings)
+    """
+    itemsize = np.dtype(storageType(precision)).itemsize
+    return ((compartments + stored_series)*itemsize + working_series*8)*tsteps
+
+def chunkSize(tsteps, compartments, budget=None, precision=None):
+    """Regions that can be projected at once within budget (megabytes),
+    at regionBytes each
+    """
+    budget = settings['budget'] if budget is None else budget
+    return max(1, int(budget*1e6//regionBytes(tsteps, compartments, precision)))
+
+def chunkSlices(n, size):
+    """Slices splitting range(n) into pieces of at most size"""
+    return [slice(i, min(i + size, n)) for i in range(0, n, size)]
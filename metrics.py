@@ -0,0 +1,179 @@
+"""Timing instrumentation for the modelling pipeline and the Dash
+callbacks.
+
+Set COGIC_METRICS=1 to enable. Timings are aggregated into histograms
+in-process and served in Prometheus text format at /metrics, and each
+response gets a Server-Timing header with the stages it ran, which
+shows up in the browser's network panel. When disabled, timed() and
+timedCallback() cost a flag check and nothing is recorded.
+
+Stages are timed with
+
+    with metrics.timed('solve'):
+        ...
+
+and callbacks by decorating them with timedCallback. Serializing the
+callback outputs is timed as the 'serialize' stage.
+
+Each gunicorn worker keeps its own histograms, so /metrics reports
+the worker that answers the scrape.
+"""
+
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+import flask
+
+enabled = os.environ.get('COGIC_METRICS', '0')=='1'
+
+# histogram bucket upper bounds, seconds
+buckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+class Histogram:
+    """Counts of observations per bucket, by label value"""
+    def __init__(self, name, label, description):
+        self.name = name
+        self.label = label
+        self.description = description
+        self.lock = threading.Lock()
+        self.series = dict()
+
+    def observe(self, labelvalue, seconds):
+        with self.lock:
+            if labelvalue not in self.series:
+                self.series[labelvalue] = {'counts': [0]*(len(buckets) + 1), 'sum': 0.0}
+            series = self.series[labelvalue]
+            series['counts'][bisect.bisect_left(buckets, seconds)] += 1
+            series['sum'] += seconds
+
+    def exposition(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} histogram'.format(self.name)
+        ]
+        with self.lock:
+            for labelvalue, series in sorted(self.series.items()):
+                label = '{}="{}"'.format(self.label, labelvalue.replace('"', '\\"'))
+                total = 0
+                for le, count in zip(buckets + ['+Inf'], series['counts']):
+                    total += count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, label, le, total))
+                lines.append('{}_sum{{{}}} {}'.format(self.name, label, series['sum']))
+                lines.append('{}_count{{{}}} {}'.format(self.name, label, total))
+        return lines
+
+stages = Histogram('cogic_stage_seconds', 'stage',
+                   'Time spent in each stage of the modelling pipeline.')
+callbacks = Histogram('cogic_callback_seconds', 'callback',
+                      'Time spent in each Dash callback function.')
+requests = Histogram('cogic_request_seconds', 'handler',
+                     'Time to handle each request, by route.')
+
+def record(histogram, name, seconds):
+    histogram.observe(name, seconds)
+    # and for the Server-Timing header of the current request
+    if flask.has_request_context():
+        timings = flask.g.setdefault('cogic_timings', dict())
+        timings[name] = timings.get(name, 0.0) + seconds
+
+@contextmanager
+def _timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stages, name, time.perf_counter() - start)
+
+# reused by every timed() call while disabled
+_untimed = nullcontext()
+
+def timed(name):
+    """Context manager recording the time spent in a stage"""
+    if enabled:
+        return _timed(name)
+    return _untimed
+
+def timedCallback(func):
+    """Decorator recording the time spent in a callback function.
+    Goes below @app.callback.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            record(callbacks, func.__name__, elapsed)
+            if flask.has_request_context():
+                flask.g.cogic_callback = elapsed
+    return wrapper
+
+def _timedSerialization(dispatch):
+    """Wraps the function Dash calls for a callback, which calls the
+    callback and serializes its outputs. The serialization is the
+    difference from the time recorded by timedCallback.
+    """
+    @wraps(dispatch)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return dispatch(*args, **kwargs)
+        start = time.perf_counter()
+        response = dispatch(*args, **kwargs)
+        body = flask.g.pop('cogic_callback', None)
+        if body is not None:
+            record(stages, 'serialize', time.perf_counter() - start - body)
+        return response
+    return wrapper
+
+def exposition():
+    lines = []
+    for histogram in [stages, callbacks, requests]:
+        lines += histogram.exposition()
+    return '\n'.join(lines) + '\n'
+
+def install(app):
+    """Adds the /metrics route and request timing to a Dash app.
+    Call after the callbacks are registered.
+    """
+    for callback in app.callback_map.values():
+        # client-side callbacks have no python function
+        if 'callback' in callback:
+            callback['callback'] = _timedSerialization(callback['callback'])
+
+    server = app.server
+
+    @server.before_request
+    def starttimer():
+        if enabled:
+            flask.g.cogic_start = time.perf_counter()
+
+    @server.after_request
+    def servertiming(response):
+        start = flask.g.get('cogic_start') if enabled else None
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        rule = flask.request.url_rule
+        requests.observe(rule.rule if rule else 'unmatched', elapsed)
+
+        timings = flask.g.get('cogic_timings', dict())
+        header = [
+            '{};dur={:.2f}'.format(name, 1e3*seconds)
+            for name, seconds in timings.items()
+        ]
+        header.append('total;dur={:.2f}'.format(1e3*elapsed))
+        response.headers['Server-Timing'] = ', '.join(header)
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        if not enabled:
+            flask.abort(404)
+        return flask.Response(exposition(), mimetype='text/plain; version=0.0.4')
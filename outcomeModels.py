@@ -0,0 +1,111 @@
+# outcomeModels.py
+
+"""
+Hospital admissions and deaths from incidence, with the delay from
+infection to each outcome.
+
+An infection on day s leads to an admission (or ICU admission, or
+death) on day t with probability rate * delay(t - s), where the delay
+from infection is the incubation period followed by the delay from
+symptom onset to the outcome, each a gamma distribution discretized
+to days. So the outcomes of a region are its incidence convolved with
+each delay distribution and scaled by the rates. Outcomes on the
+first days of a projection come mostly from infections before it, so
+the convolution can be given the region's past infections as history.
+
+Everything is done in the frequency domain, for any number of
+regions and categories at once: one FFT of the incidence of each
+region, one of each delay, and one inverse FFT per region and
+category. Delays can differ by age band (kernels of shape
+(categories, bands, days)), with the rates of each band as weights;
+with one band per category, as used by the app, the rates are applied
+afterwards.
+"""
+
+import numpy as np
+from scipy.special import gammainc
+from scipy.fft import rfft, irfft, next_fast_len
+
+# gamma distributions, days. Incubation from Lauer et al. 2020 (Ann
+# Intern Med 172:577), onset to admission from Wang et al. 2020 (JAMA
+# 323:1061), to ICU from Huang et al. 2020 (Lancet 395:497) and to
+# death from Verity et al. 2020 (Lancet Infect Dis 20:669).
+incubation = {'mean': 5.5, 'sd': 2.7}
+onset_delays = {
+    'Hospitalized': {'mean': 7.0, 'sd': 4.0},
+    'ICU': {'mean': 10.0, 'sd': 5.0},
+    'Deaths': {'mean': 17.8, 'sd': 8.0},
+}
+categories = list(onset_delays)
+# longest delay, days
+max_delay = 60
+
+def category(key):
+    """Outcome category of a rate table column, e.g. ICU-high -> ICU"""
+    for name in ['ICU', 'Deaths']:
+        if key.startswith(name):
+            return name
+    return 'Hospitalized'
+
+def gammaDelay(mean, sd, days=max_delay):
+    """Gamma distribution discretized to days 0..days-1, day s getting
+    the probability between s - 1/2 and s + 1/2
+    """
+    shape = (mean/sd)**2
+    # the gamma cdf
+    cdf = gammainc(shape, (np.arange(days) + 0.5)*mean/sd**2)
+    return np.diff(cdf, prepend=0)
+
+def infectionDelays(categories=categories, days=max_delay):
+    """Delay from infection to each outcome category, an array of
+    shape (categories, days)
+    """
+    incubating = gammaDelay(**incubation, days=days)
+    kernels = np.array([
+        np.convolve(incubating, gammaDelay(**onset_delays[name], days=days))[:days]
+        for name in categories
+    ])
+    return kernels/kernels.sum(axis=1, keepdims=True)
+
+def convolveOutcomes(incidence, rates, kernels, history=None):
+    """Daily outcomes from incidence, an array of shape (..., days)
+    with a row per region. kernels are delay distributions of shape
+    (categories, bands, delays), and rates the rate of each category
+    and band, of shape (..., categories, bands) or (categories, bands).
+    history, of shape (..., past days), is the incidence of the days
+    before. Returns an array of shape (..., categories, days):
+
+        out[..., k, t] = sum over b, s of rates[..., k, b] kernels[k, b, s] x[..., t - s]
+
+    with x the history followed by incidence.
+    """
+    incidence = np.asarray(incidence, dtype=float)
+    days = incidence.shape[-1]
+    past = 0
+    if history is not None:
+        past = history.shape[-1]
+        incidence = np.concatenate([np.broadcast_to(
+            history, incidence.shape[:-1] + (past,)), incidence], axis=-1)
+    n = next_fast_len(incidence.shape[-1] + kernels.shape[-1] - 1)
+    spectrum = np.einsum('...kb,kbf,...f->...kf',
+                         rates, rfft(kernels, n), rfft(incidence, n))
+    return irfft(spectrum, n)[..., past:past + days]
+
+def delayedIncidence(incidence, history=None, categories=categories):
+    """incidence convolved with the delay to each outcome category,
+    as a dict of arrays shaped like incidence. Multiplied by a rate,
+    these are the daily admissions or deaths of the category.
+    """
+    kernels = infectionDelays(categories)[:, None, :]
+    delayed = convolveOutcomes(incidence, np.ones((len(categories), 1)), kernels, history)
+    # kept in the precision of incidence (see memoryBudget.py)
+    dtype = np.result_type(np.asarray(incidence).dtype, np.float32)
+    return {name: delayed[..., i, :].astype(dtype, copy=False) for i, name in enumerate(categories)}
+
+def pastIncidence(cumulative, silent, days=max_delay):
+    """Estimated daily infections of the last days before a
+    projection, from cumulative confirmed cases along the last axis
+    (the infections the SIR model's I0 stands for)
+    """
+    cumulative = np.asarray(cumulative, dtype=float)[..., -(days + 1):]
+    return np.diff(cumulative, axis=-1).clip(0)/(1 - silent)
@@ -0,0 +1,43 @@
+"""Reports the serialized size of each server callback output for a
+region, with and without compact payloads (COGIC_COMPACT_PAYLOADS).
+
+Usage: python payloadSizes.py [state] [county] [tsteps]
+"""
+import sys
+import json
+
+import plotly
+
+import application
+
+outputs = ['countysir-graph', 'county-projection', 'statesir-graph', 'state-projection']
+
+def payloadBytes(state, county, silent, tsteps, compact):
+    """Bytes per output of updateprojections, serialized the way
+    Dash serializes callback responses.
+    """
+    application.compact_payloads = compact
+    results = []
+    for region in [county, 'All']:
+        run = application.runsir(state, region, silent, tsteps)
+        results += [application.sirfigure(run), application.projectionstore(run)]
+    return {
+        output: len(json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder))
+        for output, result in zip(outputs, results)
+    }
+
+if __name__ == '__main__':
+    state = sys.argv[1] if len(sys.argv) > 1 else 'Minnesota'
+    county = sys.argv[2] if len(sys.argv) > 2 else 'Brown'
+    tsteps = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    full = payloadBytes(state, county, 0.5, tsteps, compact=False)
+    compact = payloadBytes(state, county, 0.5, tsteps, compact=True)
+
+    print('{:20s}{:>10s}{:>10s}{:>8s}'.format('output', 'full', 'compact', 'ratio'))
+    for output in outputs:
+        print('{:20s}{:>10d}{:>10d}{:>8.2f}'.format(
+            output, full[output], compact[output], compact[output]/full[output]))
+    print('{:20s}{:>10d}{:>10d}{:>8.2f}'.format(
+        'total', sum(full.values()), sum(compact.values()),
+        sum(compact.values())/sum(full.values())))
@@ -7,6 +7,7 @@ E.g, conversion between census and CDC age categories,
 
 import pandas as pd
 import numpy as np
+from functools import lru_cache
 
 def loadUSPopulation():
     return pd.read_csv('data/us_population-2019.csv').set_index('State')
@@ -61,6 +62,18 @@ def census2verity(series):
     verity.index = [0,10,20,30,40,50,60,70,80]
     return verity
 
+@lru_cache(maxsize=None)
+def ageBinMatrix(convert, ages=tuple(range(0, 90, 5))):
+    """Matrix M with M @ popstructure == convert(popstructure) for
+    census2cdc or census2verity, so the conversion can be applied to
+    the age structures of many regions at once (one per column).
+    """
+    identity = np.eye(len(ages))
+    return np.column_stack([
+        convert(pd.Series(identity[i], index=ages)).values
+        for i in range(len(ages))
+    ])
+
 def buildUSCountyAgeStructure():
     """Build population by age file for counties 
     by state
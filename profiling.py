@@ -0,0 +1,205 @@
+"""Opt-in profiling of requests to the running app.
+
+A sampled fraction of callback requests is profiled, either with a
+statistical stack sampler, which writes folded stacks (one
+'frame;frame;frame count' line per stack) that flamegraph.pl and
+speedscope read directly, or with cProfile, which writes .prof files
+for pstats or snakeviz. Profiles go to COGIC_PROFILE_DIR (default
+profiles/), one file per request, named after the callback.
+
+Settings, starting from the environment:
+    COGIC_PROFILE       off (default), sample or cprofile
+    COGIC_PROFILE_RATE  fraction of requests profiled (default 0.1)
+    COGIC_PROFILE_INTERVAL  seconds between stack samples (default 0.001)
+
+They can be changed without a restart by POSTing JSON with any of
+mode, rate and interval to /profiling, with the X-Admin-Token header
+set to COGIC_ADMIN_TOKEN. The endpoint doesn't exist unless that's set.
+Settings are kept in settings.json in the profile directory, which
+every worker re-reads at most once a second, so they apply to all
+gunicorn workers.
+
+To merge folded profiles into one flame graph:
+    python profiling.py profiles/*.folded | flamegraph.pl > flame.svg
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import cProfile
+import threading
+from collections import Counter
+
+import flask
+
+profile_dir = os.environ.get('COGIC_PROFILE_DIR', 'profiles')
+settings_file = os.path.join(profile_dir, 'settings.json')
+modes = ['off', 'sample', 'cprofile']
+
+settings = {
+    'mode': os.environ.get('COGIC_PROFILE', 'off'),
+    'rate': float(os.environ.get('COGIC_PROFILE_RATE', 0.1)),
+    'interval': float(os.environ.get('COGIC_PROFILE_INTERVAL', 0.001)),
+    # only requests to these paths are profiled
+    'paths': ['/_dash-update-component']
+}
+_checked = {'time': 0.0, 'mtime': None}
+
+def currentSettings():
+    """settings, updated from settings_file if it has changed. The
+    file is checked at most once a second.
+    """
+    now = time.monotonic()
+    if now - _checked['time'] < 1:
+        return settings
+    _checked['time'] = now
+    try:
+        mtime = os.stat(settings_file).st_mtime
+    except OSError:
+        return settings
+    if mtime!=_checked['mtime']:
+        _checked['mtime'] = mtime
+        try:
+            with open(settings_file) as f:
+                settings.update(json.load(f))
+        except ValueError:
+            pass
+    return settings
+
+def updateSettings(changes):
+    """Validates changes and saves them to settings_file for every worker"""
+    if not isinstance(changes, dict):
+        raise ValueError('settings must be a JSON object')
+    unknown = set(changes) - {'mode', 'rate', 'interval'}
+    if unknown:
+        raise ValueError('unknown settings ' + ', '.join(sorted(map(str, unknown))))
+    changes = dict(changes)
+    if changes.get('mode', 'off') not in modes:
+        raise ValueError('mode must be one of ' + ', '.join(modes))
+    # stored as numbers, since every worker compares with them
+    for key in ['rate', 'interval']:
+        if key in changes:
+            changes[key] = float(changes[key])
+            if not math.isfinite(changes[key]):
+                raise ValueError(key + ' must be a finite number')
+    if not 0 <= changes.get('rate', 0) <= 1:
+        raise ValueError('rate must be between 0 and 1')
+    if changes.get('interval', 1) <= 0:
+        raise ValueError('interval must be positive')
+    settings.update(changes)
+    os.makedirs(profile_dir, exist_ok=True)
+    tmp = settings_file + '.{}.tmp'.format(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(settings, f)
+    os.replace(tmp, settings_file)
+    return settings
+
+def frameName(frame):
+    code = frame.f_code
+    return '{} ({}:{})'.format(
+        code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+    ).replace(';', ':')
+
+class StackSampler:
+    """Samples the stack of a thread every interval seconds from a
+    second thread, counting each distinct stack.
+    """
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='cogic-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frameName(frame))
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.counts
+
+def writeFolded(counts, path):
+    with open(path, 'w') as f:
+        for stack, count in counts.most_common():
+            f.write('{} {}\n'.format(stack, count))
+
+def callbackName(app):
+    """Name of the callback function handling the current request"""
+    body = flask.request.get_json(silent=True) or {}
+    callback = app.callback_map.get(body.get('output'), {}).get('callback')
+    return getattr(callback, '__name__', 'request')
+
+def install(app):
+    """Adds request profiling and the /profiling endpoint to a Dash app"""
+    server = app.server
+
+    @server.before_request
+    def startprofile():
+        current = currentSettings()
+        if (current['mode']=='off' or flask.request.path not in current['paths']
+                or random.random() >= current['rate']):
+            return
+        if current['mode']=='sample':
+            flask.g.cogic_profiler = StackSampler(
+                threading.get_ident(), current['interval']).start()
+        else:
+            flask.g.cogic_profiler = cProfile.Profile()
+            flask.g.cogic_profiler.enable()
+
+    @server.after_request
+    def stopprofile(response):
+        profiler = flask.g.pop('cogic_profiler', None)
+        if profiler is None:
+            return response
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, '{}-{}-{}'.format(
+            callbackName(app), time.strftime('%Y%m%dT%H%M%S'), os.getpid()))
+        if isinstance(profiler, StackSampler):
+            path += '-{}.folded'.format(id(profiler))
+            writeFolded(profiler.stop(), path)
+        else:
+            profiler.disable()
+            path += '-{}.prof'.format(id(profiler))
+            profiler.dump_stats(path)
+        return response
+
+    token = os.environ.get('COGIC_ADMIN_TOKEN')
+    if not token:
+        return
+
+    @server.route('/profiling', methods=['GET', 'POST'])
+    def profilingsettings():
+        if flask.request.headers.get('X-Admin-Token')!=token:
+            flask.abort(403)
+        if flask.request.method=='POST':
+            try:
+                updateSettings(flask.request.get_json(force=True))
+            except (ValueError, TypeError) as e:
+                return flask.jsonify({'error': str(e)}), 400
+        return flask.jsonify(currentSettings())
+
+if __name__ == '__main__':
+    # merge folded profiles given as arguments
+    counts = Counter()
+    for path in sys.argv[1:]:
+        with open(path) as f:
+            for line in f:
+                stack, count = line.rstrip('\n').rsplit(' ', 1)
+                counts[stack] += int(count)
+    for stack, count in counts.most_common():
+        print(stack, count)
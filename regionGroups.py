@@ -0,0 +1,290 @@
+# regionGroups.py
+
+"""
+Roll-ups of county projections to larger regions: states, hospital
+service areas, health regions or any other group of counties.
+
+The SIR model (or another of compartmentModels.models) is solved once
+for every county with compartmentModels.solve,
+and the incidence, admissions and deaths of a group are sums of its
+counties', computed for all groups at once as a product with a sparse
+aggregation matrix. A county can be split between groups with
+weights. Admissions and deaths come from each county's incidence
+delayed to the outcome (outcomeModels.delayedIncidence), including
+its infections before the projection.
+
+Group files are CSV with columns group, state, county and optionally
+weight (default 1), using the state and county names of the app's
+dropdowns, e.g. data/region_groups_example.csv.
+
+Usage: python regionGroups.py [groups.csv] [silent] [tsteps]
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from compartmentModels import models, solve
+from outcomeModels import category, delayedIncidence, pastIncidence
+from memoryBudget import chunkSize, chunkSlices
+
+def loadRegionGroups(path):
+    groups = pd.read_csv(path)
+    if 'weight' not in groups:
+        groups['weight'] = 1.0
+    return groups[['group', 'state', 'county', 'weight']]
+
+def stateGroups(counties):
+    """A group per state, from the (state, county) pairs in counties"""
+    return pd.DataFrame({
+        'group': counties.get_level_values(0),
+        'state': counties.get_level_values(0),
+        'county': counties.get_level_values(1),
+        'weight': 1.0
+    })
+
+def aggregationMatrix(groups, counties):
+    """Sparse matrix A with a row per group and a column per county in
+    counties (a (state, county) MultiIndex), so that A @ X sums rows
+    of X by group. Returns A and the group names in row order.
+    Counties not in counties are ignored.
+    """
+    names = pd.Index(groups['group'].unique())
+    columns = counties.get_indexer(pd.MultiIndex.from_arrays([groups['state'], groups['county']]))
+    found = columns >= 0
+    A = sparse.csr_matrix(
+        (groups['weight'].values[found],
+         (names.get_indexer(groups['group'].values[found]), columns[found])),
+        shape=(len(names), len(counties))
+    )
+    return A, list(names)
+
+def laggedCensus(admissions, LOS):
+    """calcCensus for arrays of daily admissions, one row per region"""
+    cumulative = np.cumsum(admissions, axis=1)
+    lagged = np.zeros_like(cumulative)
+    lagged[:, LOS:] = cumulative[:, :-LOS] if LOS else cumulative
+    return cumulative - lagged
+
+def populationKeys(popstructure, counties):
+    """Which of counties, (state, county) pairs of the case data, have
+    population data, and the popstructure keys of those that do (see
+    HospitalCensus.regionPopStructure for the name differences).
+    """
+    popkeys = pd.MultiIndex.from_tuples([
+        (state.replace(' ',''), county.replace(' City',''))
+        for state, county in counties
+    ])
+    found = popstructure.columns.get_indexer(popkeys) >= 0
+    return found, popkeys[found]
+
+class CountyProjections:
+    """SIR projections of every county with both case and population
+    data, or only those in counties (a list of (state, county)),
+    computed the same way as the app's county projection: the
+    county's population and current cases, and the transmission rate
+    of its state. epimodel is the name of the compartment model. With
+    regionrt (a reproductionNumber.RegionRt), the transmission rate
+    comes from each county's latest Rt where there is one, as with
+    cogic.project's betasource 'Rt'.
+    """
+    def __init__(self, createcensus, uscountydata, silent, tsteps, epimodel='SIR',
+                 counties=None, regionrt=None):
+        model = models[epimodel]
+        params = model.parameters()
+        confirmed = uscountydata.xs('Confirmed', axis=1, level=-1)
+        # transmission rates from the last week of each state's cases
+        lastweek = confirmed.iloc[-7:]
+        if counties is not None:
+            states = set(state for state, county in counties)
+            lastweek = lastweek[[state for state in lastweek.columns.levels[0] if state in states]]
+            columns = confirmed.columns.get_indexer(pd.MultiIndex.from_tuples(counties))
+            confirmed = confirmed.iloc[:, columns[columns >= 0]]
+        statebeta = {
+            state: model.transmissionRate(cases.values, params)
+            for state, cases in lastweek.T.groupby(level=0).sum().T.items()
+        }
+
+        popstructure = createcensus.us_popstructure
+        found, popkeys = populationKeys(popstructure, confirmed.columns)
+        self.counties = confirmed.columns[found]
+
+        N = popstructure[popkeys].sum().values
+        I0 = confirmed[self.counties].values[-1]/(1 - silent)
+        beta = np.array([statebeta[state] for state in self.counties.get_level_values(0)])
+        if regionrt is not None:
+            for i, region in enumerate(self.counties):
+                Rt = regionrt.latest(*region)
+                if Rt is not None:
+                    beta[i] = model.betaFromRt(Rt['Rt'], params)
+
+        self.t = np.arange(tsteps)
+        self.N = N
+        self.compartments = model.compartments
+        self.sol = solve(model, beta, N, I0, self.t, **params)
+        # incidence delayed to each outcome category, with the
+        # infections of the days before
+        history = pastIncidence(confirmed[self.counties].values.T, silent)
+        self.delayed = delayedIncidence(self.sol['Inew'], history)
+
+        # rates in the same order as the counties
+        self.ratetables = {
+            model: {
+                kind: table.loc[popkeys].set_axis(self.counties)
+                for kind, table in tables.items()
+            }
+            for model, tables in createcensus.calcCountyRateTables(popkeys).items()
+        }
+
+    def rollup(self, groups):
+        """Projections of each group: population, each compartment (S,
+        I, R, ...), incidence,
+        incidence delayed to each outcome category (a dict under
+        'delayed'), and daily admissions and cumulative deaths of
+        each type for each rate model, keyed by
+        (model, 'admissions'/'deaths'). Returns a dict keyed by group
+        name.
+        """
+        return splitRollup(*self.rolledArrays(groups))
+
+    def rolledArrays(self, groups):
+        """rollup as arrays with a row per group, and the group names.
+        Sums of the counties in the projections, so the rolled arrays
+        of projections of different counties add up (see
+        chunkedRollup).
+        """
+        A, names = aggregationMatrix(groups, self.counties)
+        rolled = {
+            'N': A @ self.N,
+            **{name: A @ self.sol[name] for name in self.compartments},
+            'Inew': A @ self.sol['Inew'],
+            'delayed': {name: A @ series for name, series in self.delayed.items()},
+        }
+        # admissions and deaths are fractions of the delayed
+        # incidence, as in the app's graphs
+        for model, tables in self.ratetables.items():
+            for kind in ['admissions', 'deaths']:
+                table = tables[kind]
+                # scaling the columns of A by the rates is cheaper than
+                # scaling every county's series
+                rolled[(model, kind)] = {
+                    key: A.multiply(table[key].values[None, :]).tocsr() @ self.delayed[category(key)]
+                    for key in table.columns
+                }
+            rolled[(model, 'deaths')] = {
+                key: np.cumsum(daily, axis=1) for key, daily in rolled[(model, 'deaths')].items()
+            }
+        return rolled, names
+
+def splitRollup(rolled, names):
+    """The rolled arrays of CountyProjections.rolledArrays as a dict
+    of projections keyed by group name
+    """
+    return {
+        name: {
+            key: (
+                {k: v[i] for k, v in value.items()} if isinstance(value, dict)
+                else value[i]
+            ) for key, value in rolled.items()
+        } for i, name in enumerate(names)
+    }
+
+def addRollups(total, rolled):
+    """Sum of two sets of rolled arrays (total None for the first)"""
+    if total is None:
+        return rolled
+    return {
+        key: (
+            {k: v + rolled[key][k] for k, v in value.items()} if isinstance(value, dict)
+            else value + rolled[key]
+        ) for key, value in total.items()
+    }
+
+def projectionChunks(createcensus, uscountydata, silent, tsteps, epimodel='SIR',
+                     counties=None, budget=None, regionrt=None):
+    """CountyProjections of counties (by default every county), a
+    chunk at a time, in chunks that fit in the memory budget
+    (megabytes, default memoryBudget.settings). A single chunk,
+    projected as one CountyProjections, when they all fit.
+    """
+    regions = counties
+    if regions is None:
+        regions = list(uscountydata.columns.droplevel(-1).unique())
+    size = chunkSize(tsteps, len(models[epimodel].compartments), budget)
+    if size >= len(regions):
+        yield CountyProjections(createcensus, uscountydata, silent, tsteps, epimodel,
+                                counties=counties, regionrt=regionrt)
+        return
+    for chunk in chunkSlices(len(regions), size):
+        yield CountyProjections(createcensus, uscountydata, silent, tsteps, epimodel,
+                                counties=regions[chunk], regionrt=regionrt)
+
+def chunkedRollup(chunks, groups):
+    """CountyProjections.rollup of the counties of all chunks
+    (CountyProjections of different counties, e.g. from
+    projectionChunks), summed a chunk at a time so only the groups'
+    series are kept
+    """
+    total, names = None, []
+    for projections in chunks:
+        rolled, names = projections.rolledArrays(groups)
+        total = addRollups(total, rolled)
+    return splitRollup(total, names)
+
+def regionCurves(proj, model='Verity', hosp_LOS=7, ICU_LOS=9,
+                 hosprate=None, icurate=None, deathrate=None):
+    """Daily hospital admissions, hospital and ICU census and
+    cumulative deaths of a rolled-up region, using the high estimates
+    of model, or for the 'Custom' model the given rates.
+    """
+    if model in ('Verity', 'CDC'):
+        admissions = proj[(model, 'admissions')]
+        hospitalized, icu = admissions['Hospitalized-high'], admissions['ICU-high']
+        deaths = proj[(model, 'deaths')]['Deaths-high']
+    else:
+        delayed = proj['delayed']
+        hospitalized, icu = hosprate*delayed['Hospitalized'], icurate*delayed['ICU']
+        deaths = deathrate*np.cumsum(delayed['Deaths'])
+    return {
+        'admissions': hospitalized,
+        'census': laggedCensus(hospitalized[None, :], hosp_LOS)[0],
+        'ICU census': laggedCensus(icu[None, :], ICU_LOS)[0],
+        'deaths': deaths
+    }
+
+def summary(projections, model='Verity', hosp_LOS=7, ICU_LOS=9,
+            hosprate=None, icurate=None, deathrate=None):
+    """Peak incidence, peak census and total deaths of each rolled-up
+    region, from regionCurves.
+    """
+    rows = dict()
+    for name, proj in projections.items():
+        curves = regionCurves(proj, model, hosp_LOS, ICU_LOS, hosprate, icurate, deathrate)
+        rows[name] = {
+            'population': proj['N'],
+            'peak incidence': proj['Inew'].max(),
+            'peak day': int(curves['census'].argmax()),
+            'peak hospital census': curves['census'].max(),
+            'peak ICU census': curves['ICU census'].max(),
+            'deaths': curves['deaths'][-1],
+        }
+    return pd.DataFrame(rows).T
+
+if __name__ == '__main__':
+    from hospCensusModels import HospitalCensus
+    from loadCaseData import loadCountyData
+
+    silent = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    tsteps = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    uscountydata = loadCountyData()
+    if len(sys.argv) > 1:
+        groups = loadRegionGroups(sys.argv[1])
+    else:
+        groups = stateGroups(uscountydata.columns.droplevel(-1).unique())
+    counties = sorted(set(zip(groups['state'], groups['county'])))
+    chunks = projectionChunks(HospitalCensus(), uscountydata, silent, tsteps, counties=counties)
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_columns', None)
+    print(summary(chunkedRollup(chunks, groups)).round(0))
@@ -0,0 +1,173 @@
+# reproductionNumber.py
+
+"""
+Effective reproduction number (Rt) of every region, from the
+renewal equation (Cori et al. 2013, Am J Epidemiol 178:1505).
+
+New cases on day t are Rt times the infectiousness of earlier cases,
+the sum of cases s days before weighted by the serial interval
+distribution w(s). With a gamma(a, b) prior and Rt taken as constant
+over a window of days, the posterior of Rt is gamma with shape
+a + (cases in the window) and scale 1/(1/b + infectiousness in the
+window).
+
+The infectiousness of every region is one FFT convolution of the
+(days, regions) array of smoothed new cases with w, and the window
+sums are cumulative sums, so Rt of every county and state, every day,
+takes a fraction of a second. RtTracker extends the series as days are
+appended without recomputing the earlier ones.
+
+In the SIR model Rt = beta/gamma, so gamma*Rt is an alternative to
+the doubling-time estimate of beta.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.special import gammainc, gammaincinv
+from scipy.fft import rfft, irfft, next_fast_len
+
+from caseCleaning import dailyCounts, smooth
+
+# Nishiura et al. 2020, Int J Infect Dis 93:284, days
+serial_interval = {'mean': 4.7, 'sd': 2.9}
+# gamma prior of Rt, as in EpiEstim
+prior = {'a': 1., 'b': 5.}
+# Rt of a county with fewer cases than this in the window isn't used
+# for its projection; its state's is
+min_cases = 20
+
+def serialInterval(mean=serial_interval['mean'], sd=serial_interval['sd'], days=21):
+    """Gamma serial interval distribution discretized to days
+    1..days, as an array starting at day 1
+    """
+    shape = (mean/sd)**2
+    # day s gets the mass between s - 1/2 and s + 1/2, and day 1
+    # everything before
+    cdf = gammainc(shape, (np.arange(days + 1) + 0.5)*mean/sd**2)
+    w = np.diff(cdf, prepend=0)[1:]
+    w[0] += cdf[0]
+    return w/w.sum()
+
+def infectiousness(incidence, w):
+    """Sum of the cases of each earlier day weighted by the serial
+    interval, along axis 0 of incidence
+    """
+    kernel = np.concatenate([[0], w]).reshape((-1,) + (1,)*(incidence.ndim - 1))
+    n = next_fast_len(len(incidence) + len(kernel) - 1)
+    Lambda = irfft(rfft(incidence, n, axis=0)*rfft(kernel, n, axis=0), n, axis=0)[:len(incidence)]
+    # FFT round-off leaves tiny values where it should be zero
+    Lambda[Lambda < 1e-8] = 0
+    return Lambda
+
+def windowSums(x, window):
+    total = np.cumsum(x, axis=0)
+    total[window:] = total[window:] - total[:-window]
+    return total
+
+def estimateRt(incidence, w=None, window=7, a=prior['a'], b=prior['b']):
+    """Posterior shape and scale of Rt on each day for each region,
+    from incidence, a (days, regions) array of new cases. The scale is
+    NaN on days with no earlier cases to go on.
+    """
+    w = serialInterval() if w is None else w
+    incidence = np.asarray(incidence, dtype=float).clip(0)
+    cases = windowSums(incidence, window)
+    Lambda = windowSums(infectiousness(incidence, w), window)
+    with np.errstate(divide='ignore'):
+        scale = np.where(Lambda > 0, 1/(1/b + Lambda), np.nan)
+    return a + cases, scale, cases
+
+class RtTracker:
+    """Rt series of a set of regions, from a (days, regions) array of
+    new cases, that can be extended a day or more at a time with
+    append().
+    """
+    def __init__(self, incidence, w=None, window=7, a=prior['a'], b=prior['b']):
+        self.w = serialInterval() if w is None else w
+        self.window = window
+        self.a, self.b = a, b
+        incidence = np.asarray(incidence, dtype=float)
+        self.shape, self.scale, self.cases = estimateRt(incidence, self.w, window, a, b)
+        self.tail = incidence[-self.history():]
+
+    def history(self):
+        # days of cases before a new day that its Rt depends on:
+        # infectiousness over the window needs the serial interval
+        # before the first day of the window
+        return len(self.w) + self.window - 1
+
+    def append(self, incidence):
+        """Adds the Rt of new days of cases, computed from only the
+        last history() days before them. Returns the new rows of the
+        posterior shape and scale.
+        """
+        incidence = np.asarray(incidence, dtype=float)
+        days = len(incidence)
+        both = np.concatenate([self.tail, incidence])
+        shape, scale, cases = estimateRt(both, self.w, self.window, self.a, self.b)
+        self.shape = np.concatenate([self.shape, shape[-days:]])
+        self.scale = np.concatenate([self.scale, scale[-days:]])
+        self.cases = np.concatenate([self.cases, cases[-days:]])
+        self.tail = both[-self.history():]
+        return shape[-days:], scale[-days:]
+
+    @property
+    def mean(self):
+        return self.shape*self.scale
+
+    def quantile(self, q, day=-1):
+        """Posterior quantile q of Rt on day (by default the last)"""
+        return gammaincinv(self.shape[day], q)*self.scale[day]
+
+def regionIncidence(uscountydata, method=None, window=None):
+    """Smoothed daily new cases of every county and state, as a
+    (days, regions) array and the (state, county) of each region,
+    with county 'All' for states
+    """
+    confirmed = uscountydata.xs('Confirmed', axis=1, level=-1)
+    states = confirmed.T.groupby(level=0).sum().T
+    regions = confirmed.columns.append(
+        pd.MultiIndex.from_arrays([states.columns, ['All']*len(states.columns)]))
+    cumulative = np.concatenate([confirmed.values, states.values], axis=1)
+    options = {k: v for k, v in [('method', method), ('window', window)] if v is not None}
+    return smooth(dailyCounts(cumulative), **options), regions
+
+class RegionRt:
+    """Rt of every county and state in uscountydata (see
+    regionIncidence), with the latest value looked up by region
+    """
+    def __init__(self, uscountydata, **options):
+        incidence, self.regions = regionIncidence(uscountydata)
+        self.dates = uscountydata.index
+        self.tracker = RtTracker(incidence, **options)
+
+    def append(self, uscountydata):
+        """Extends the series with the days of uscountydata after the
+        last one tracked. uscountydata has to include the regions'
+        earlier days of cases too, for the smoothing.
+        """
+        incidence, regions = regionIncidence(uscountydata)
+        incidence = pd.DataFrame(incidence, columns=regions).reindex(columns=self.regions).fillna(0)
+        new = ~uscountydata.index.isin(self.dates)
+        self.tracker.append(incidence.values[new])
+        self.dates = self.dates.append(uscountydata.index[new])
+
+    def latest(self, state, county='All'):
+        """Latest Rt of a county (or state, for county 'All'), and its
+        credible interval. Counties with fewer than min_cases cases in
+        the window get their state's. None if there's no estimate.
+        """
+        i = self.regions.get_indexer([(state, county)])[0]
+        if county!='All' and (i < 0 or self.tracker.cases[-1, i] < min_cases):
+            i = self.regions.get_indexer([(state, 'All')])[0]
+        if i < 0 or np.isnan(self.tracker.scale[-1, i]):
+            return None
+        shape, scale = self.tracker.shape[-1, i], self.tracker.scale[-1, i]
+        low, high = gammaincinv(shape, [0.025, 0.975])*scale
+        return {'Rt': shape*scale, 'low': low, 'high': high,
+                'county': self.regions[i][1]!='All'}
+
+    def series(self, state, county='All'):
+        """Daily mean Rt of a region, as a Series by date"""
+        i = self.regions.get_indexer([(state, county)])[0]
+        return pd.Series(self.tracker.mean[:, i], index=self.dates)
@@ -0,0 +1,151 @@
+# scenarioStore.py
+
+"""
+Content-addressed store of computed results, for sharing them between
+users, gunicorn workers and restarts.
+
+A result is stored under a hash of what it was computed from: its
+kind, its parameters, the version of the modelling code (a hash of the
+modelling modules' source, the solver settings and the precision) and
+the version of the data (a hash of the case data, or of the case
+store's metadata). The same scenario asked for by any number of users,
+or opened from a shared link, is computed once and read back after
+that, and anything computed from old code or data is never served,
+only pruned. Concurrent requests for the same scenario
+in one process wait for the first to finish; across processes they
+might both compute it.
+
+Results are stored as gzipped JSON files in COGIC_SCENARIO_STORE
+(default cache/scenarios), for COGIC_SCENARIO_TTL seconds (default a
+week) after they were last written.
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+
+import numpy as np
+import plotly
+
+logger = logging.getLogger(__name__)
+
+store_dir = os.environ.get('COGIC_SCENARIO_STORE',
+                           os.path.join(os.environ.get('COGIC_CACHE_DIR', 'cache'), 'scenarios'))
+store_ttl = float(os.environ.get('COGIC_SCENARIO_TTL', 7*24*3600))
+
+# modules whose code changes the results
+model_modules = [
+    'cogic', 'SIRModels', 'compartmentModels', 'solverBackends', 'outcomeModels',
+    'reproductionNumber', 'hospCensusModels', 'populationModels', 'regionGroups',
+    'caseCleaning', 'memoryBudget',
+]
+
+def modelVersion(modules=model_modules):
+    """Hash of the source of the modelling modules, the solver
+    settings and the precision
+    """
+    from solverBackends import settings
+    from memoryBudget import settings as memory
+    digest = hashlib.sha1(json.dumps([settings, memory['precision']], sort_keys=True).encode())
+    for name in modules:
+        __import__(name)
+        with open(sys.modules[name].__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def dataVersion(frame, store=None):
+    """Hash of a DataFrame, e.g. the county case data, or if it was read
+    from a case store, of the store's meta.json (rewritten with every
+    store, see caseStore.writeStore)
+    """
+    if store:
+        with open(os.path.join(store, 'meta.json'), 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()[:16]
+    digest = hashlib.sha1(np.ascontiguousarray(frame.values).tobytes())
+    digest.update(repr(list(frame.index)).encode())
+    digest.update(repr(list(frame.columns)).encode())
+    return digest.hexdigest()[:16]
+
+def contentKey(kind, params, versions):
+    key = json.dumps([kind, params, versions], sort_keys=True, default=str)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+class ScenarioStore:
+    """Results by content key. versions is a function returning the
+    model and data versions (e.g. as a dict), called for each lookup
+    so that new data are picked up.
+    """
+    def __init__(self, versions, path=store_dir, ttl=store_ttl):
+        self.versions = versions
+        self.path = path
+        self.ttl = ttl
+        self.locks = dict()
+        self.lock = threading.Lock()
+        self.pruned = 0
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key + '.json.gz')
+
+    def get(self, key):
+        """The result stored under key, or None"""
+        try:
+            with gzip.open(self.filename(key), 'rt') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, result):
+        filename = self.filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # written under a temporary name, so readers never see half a file
+        tmp = '{}.{}.tmp'.format(filename, uuid.uuid4().hex)
+        with gzip.open(tmp, 'wt') as f:
+            json.dump(result, f, cls=plotly.utils.PlotlyJSONEncoder)
+        os.replace(tmp, filename)
+        if time.time() - self.pruned > 3600:
+            self.prune()
+
+    def keyLock(self, key):
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def cached(self, kind, params, compute):
+        """The result of compute() for params, from the store if it's
+        been computed before. Results are returned as read back from
+        JSON, so the same whether computed or not.
+        """
+        key = contentKey(kind, params, self.versions())
+        result = self.get(key)
+        if result is not None:
+            return result
+        with self.keyLock(key):
+            # computed while we waited
+            result = self.get(key)
+            if result is None:
+                result = json.loads(json.dumps(compute(), cls=plotly.utils.PlotlyJSONEncoder))
+                try:
+                    self.put(key, result)
+                except OSError:
+                    logger.exception('could not store scenario %s', key)
+        with self.lock:
+            self.locks.pop(key, None)
+        return result
+
+    def prune(self):
+        """Deletes results older than ttl"""
+        self.pruned = time.time()
+        cutoff = self.pruned - self.ttl
+        for root, dirs, files in os.walk(self.path):
+            for name in files:
+                filename = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(filename) < cutoff:
+                        os.remove(filename)
+                except OSError:
+                    pass
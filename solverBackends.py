@@ -0,0 +1,249 @@
+# solverBackends.py
+
+"""
+ODE solver backends for compartmentModels.solve.
+
+Every backend integrates the state of solve() (the compartments of
+each region in turn) from y0 and returns it at timepts, as an array of
+shape (timepts, regions*compartments):
+
+* odeint: LSODA from ODEPACK, given the model's analytic Jacobian in
+  banded form, which it uses if the problem turns stiff
+* RK45, DOP853, LSODA, BDF, Radau: scipy's solve_ivp methods. LSODA
+  gets the banded Jacobian too, BDF and Radau a sparse one.
+* rk4: fixed-step classic Runge-Kutta over every region at once, with
+  steps steps per day and no error control
+* rk4-numba: the same, with the loop and the model's kernel (the
+  derivatives of one region) compiled by Numba. Only there if numba
+  is installed, for models that have a kernel.
+
+Settings, starting from the environment:
+    COGIC_SOLVER        backend (default odeint)
+    COGIC_SOLVER_RTOL   relative tolerance (default the backend's)
+    COGIC_SOLVER_ATOL   absolute tolerance (default the backend's)
+    COGIC_SOLVER_STEPS  rk4 steps per day (default 4)
+
+    python solverBackends.py [--regions 3000] [--budget 1e-4]
+
+reports the time of each backend and its error against odeint with
+tight tolerances, to pick the fastest backend within an error budget.
+"""
+
+import os
+import time
+import argparse
+import threading
+from contextlib import nullcontext
+
+import numpy as np
+from scipy import sparse
+from scipy.integrate import odeint, solve_ivp
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+def _tolerance(name):
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+settings = {
+    'backend': os.environ.get('COGIC_SOLVER', 'odeint'),
+    'rtol': _tolerance('COGIC_SOLVER_RTOL'),
+    'atol': _tolerance('COGIC_SOLVER_ATOL'),
+    'steps': int(os.environ.get('COGIC_SOLVER_STEPS', 4)),
+}
+ivp_methods = ['RK45', 'DOP853', 'LSODA', 'BDF', 'Radau']
+
+# ODEPACK keeps the problem being solved in globals, so solves in
+# different threads of the app would trample on each other
+odepack_lock = threading.Lock()
+
+def bandedJacobian(J):
+    """A (compartments, compartments, regions) Jacobian in ODEPACK's
+    banded layout, for the state of solve(): row a - b + k - 1, column
+    (region, b) holds J[a, b] of a model with k compartments
+    """
+    k, n = J.shape[0], J.shape[2]
+    banded = np.zeros((2*k - 1, n, k))
+    for a in range(k):
+        for b in range(k):
+            banded[a - b + k - 1, :, b] = J[a, b]
+    return banded.reshape(2*k - 1, n*k)
+
+def sparseJacobian(banded):
+    """bandedJacobian as a sparse matrix"""
+    bands, size = banded.shape
+    mu = bands//2
+    return sparse.dia_matrix((banded, mu - np.arange(bands)), shape=(size, size)).tocsc()
+
+def tolerances(rtol, atol):
+    return {k: v for k, v in [('rtol', rtol), ('atol', atol)] if v is not None}
+
+def integrateOdeint(f, jac, y0, timepts, bands, rtol=None, atol=None):
+    Dfun = (lambda y, t: jac(y)) if jac else None
+    with odepack_lock:
+        return odeint(lambda y, t: f(y), y0, timepts, Dfun=Dfun, ml=bands, mu=bands,
+                      **tolerances(rtol, atol))
+
+def integrateIVP(method, f, jac, y0, timepts, bands, rtol=None, atol=None):
+    options = tolerances(rtol, atol)
+    if method=='LSODA':
+        options.update(lband=bands, uband=bands)
+        if jac:
+            # ODEPACK wants bands more rows for the factorization, which
+            # solve_ivp doesn't add (odeint does)
+            options['jac'] = lambda t, y: np.vstack([jac(y), np.zeros((bands, len(y)))])
+    elif method in ('BDF', 'Radau'):
+        if jac:
+            options['jac'] = lambda t, y: sparseJacobian(jac(y))
+        else:
+            options['jac_sparsity'] = sparseJacobian(np.ones((2*bands + 1, len(y0))))
+    with odepack_lock if method=='LSODA' else nullcontext():
+        sol = solve_ivp(lambda t, y: f(y), (timepts[0], timepts[-1]), y0,
+                        method=method, t_eval=timepts, **options)
+    # like odeint, return what there is rather than raise
+    result = np.full((len(timepts), len(y0)), np.nan)
+    result[:sol.y.shape[1]] = sol.y.T
+    return result
+
+def integrateRK4(f, y0, timepts, steps):
+    y = np.asarray(y0, dtype=float)
+    result = np.empty((len(timepts), len(y)))
+    result[0] = y
+    for i in range(1, len(timepts)):
+        h = (timepts[i] - timepts[i - 1])/steps
+        for step in range(steps):
+            k1 = f(y)
+            k2 = f(y + h/2*k1)
+            k3 = f(y + h/2*k2)
+            k4 = f(y + h*k3)
+            y = y + h/6*(k1 + 2*k2 + 2*k3 + k4)
+        result[i] = y
+    return result
+
+def rk4Loop(kernel, y0, params, timepts, steps):
+    """integrateRK4 one region at a time, with kernel(y, p, dy) the
+    derivatives of a region with parameters p, written to dy. Meant to
+    be compiled by Numba. y0 has shape (regions, compartments) and
+    params (regions, parameters).
+    """
+    n, k = y0.shape
+    result = np.empty((len(timepts), n, k))
+    k1, k2, k3, k4 = np.empty(k), np.empty(k), np.empty(k), np.empty(k)
+    for r in range(n):
+        y = y0[r].copy()
+        p = params[r]
+        result[0, r] = y
+        for i in range(1, len(timepts)):
+            h = (timepts[i] - timepts[i - 1])/steps
+            for step in range(steps):
+                kernel(y, p, k1)
+                kernel(y + h/2*k1, p, k2)
+                kernel(y + h/2*k2, p, k3)
+                kernel(y + h*k3, p, k4)
+                y = y + h/6*(k1 + 2*k2 + 2*k3 + k4)
+            result[i, r] = y
+    return result
+
+_compiled = dict()
+
+def compiled(function):
+    if function not in _compiled:
+        _compiled[function] = numba.njit(function)
+    return _compiled[function]
+
+def available(model=None):
+    """Names of the backends that can be used (for model)"""
+    names = ['odeint'] + ivp_methods + ['rk4']
+    if numba is not None and (model is None or getattr(model, 'kernel', None)):
+        names.append('rk4-numba')
+    return names
+
+def integrate(model, p, y0, timepts, backend=None, rtol=None, atol=None, steps=None,
+              jacobian=True):
+    """Integrates model with parameters p from y0 (the state of
+    compartmentModels.solve) with backend, falling back to settings
+    for anything not given
+    """
+    backend = backend or settings['backend']
+    rtol = settings['rtol'] if rtol is None else rtol
+    atol = settings['atol'] if atol is None else atol
+    steps = steps or settings['steps']
+    k = len(model.compartments)
+    n = len(y0)//k
+    timepts = np.asarray(timepts, dtype=float)
+
+    if backend=='rk4-numba':
+        if backend not in available(model):
+            raise ValueError('rk4-numba needs numba, and a model with a kernel')
+        params = np.stack([np.broadcast_to(np.asarray(p[name], dtype=float), n)
+                           for name in model.kernel_parameters], axis=1)
+        result = compiled(rk4Loop)(compiled(model.kernel), y0.reshape(n, k), params,
+                                   timepts, steps)
+        return result.reshape(len(timepts), n*k)
+
+    def f(y):
+        return np.array(model.derivatives(y.reshape(n, k).T, p)).T.ravel()
+
+    def banded(y):
+        return bandedJacobian(model.jacobian(y.reshape(n, k).T, p))
+
+    jac = banded if jacobian and model.hasJacobian() else None
+
+    if backend=='odeint':
+        return integrateOdeint(f, jac, y0, timepts, k - 1, rtol, atol)
+    elif backend in ivp_methods:
+        return integrateIVP(backend, f, jac, y0, timepts, k - 1, rtol, atol)
+    elif backend=='rk4':
+        return integrateRK4(f, y0, timepts, steps)
+    raise ValueError('unknown solver backend ' + backend)
+
+def report(regions=3000, tsteps=200, models=None, budget=1e-4, seed=0, **options):
+    """Time and error of every backend available for each model (a
+    dict per backend and model, as they're done), on regions random
+    regions. The error is the largest difference from
+    odeint with rtol=atol=1e-10 of any compartment of any region on
+    any day, as a fraction of the region's population. options
+    (rtol, atol, steps) go to every backend.
+    """
+    from compartmentModels import models as registry, solve
+
+    rng = np.random.default_rng(seed)
+    N = np.exp(rng.uniform(np.log(1e3), np.log(1e7), regions))
+    I0 = N*np.exp(rng.uniform(np.log(1e-5), np.log(1e-2), regions))
+    beta = rng.uniform(0.1, 0.35, regions)
+    t = np.arange(tsteps)
+
+    for name in models or registry:
+        model = registry[name]
+        reference = solve(model, beta, N, I0, t, backend='odeint', rtol=1e-10, atol=1e-10)
+        for backend in available(model):
+            if backend=='rk4-numba':
+                # compile first
+                solve(model, beta[:1], N[:1], I0[:1], t[:2], backend=backend, **options)
+            start = time.perf_counter()
+            sol = solve(model, beta, N, I0, t, backend=backend, **options)
+            elapsed = time.perf_counter() - start
+            error = max((np.abs(sol[c] - reference[c]).max(axis=1)/N).max()
+                        for c in model.compartments)
+            yield {'model': name, 'backend': backend, 'seconds': elapsed,
+                   'error': error, 'within budget': error <= budget}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time and accuracy of the solver backends')
+    parser.add_argument('--regions', type=int, default=3000)
+    parser.add_argument('--tsteps', type=int, default=200)
+    parser.add_argument('--models', nargs='+', help='models (default all)')
+    parser.add_argument('--budget', type=float, default=1e-4,
+                        help='largest error allowed, as a fraction of population')
+    parser.add_argument('--rtol', type=float, help='relative tolerance')
+    parser.add_argument('--atol', type=float, help='absolute tolerance')
+    parser.add_argument('--steps', type=int, help='rk4 steps per day')
+    opts = parser.parse_args()
+
+    print('{:<8} {:<10} {:>9} {:>10}  {}'.format('model', 'backend', 'seconds', 'error', 'within budget'))
+    for row in report(opts.regions, opts.tsteps, opts.models, opts.budget,
+                      rtol=opts.rtol, atol=opts.atol, steps=opts.steps):
+        print('{model:<8} {backend:<10} {seconds:>9.3f} {error:>10.2e}  {within budget}'.format(**row))
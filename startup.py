@@ -0,0 +1,129 @@
+# startup.py
+
+"""
+Startup timing and lazy loading of the data the app is built on.
+
+COGIC_STARTUP selects when the data is loaded:
+    eager - while application.py is imported (default)
+    lazy - on first use, i.e. the first page load or callback
+    background - in a warm-up thread started at import
+"""
+
+import os
+import gc
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+startup_modes = ['eager', 'lazy', 'background']
+
+def startupMode():
+    mode = os.environ.get('COGIC_STARTUP', 'eager')
+    if mode not in startup_modes:
+        raise ValueError('COGIC_STARTUP must be one of ' + ', '.join(startup_modes))
+    return mode
+
+class StartupTimer:
+    """Wall clock time of each startup stage, in seconds.
+    Sequential module-level steps are recorded with mark(), which
+    times everything since the previous mark, and anything else
+    with the stage() context manager.
+    """
+    def __init__(self):
+        self.t0 = self.lastmark = time.perf_counter()
+        self.stages = dict()
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.stages[name] = now - self.lastmark
+        self.lastmark = now
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = time.perf_counter() - start
+
+    def report(self):
+        lines = ['{:30s}{:>10s}'.format('stage', 'seconds')]
+        lines += [
+            '{:30s}{:>10.3f}'.format(name, seconds)
+            for name, seconds in self.stages.items()
+        ]
+        lines.append('{:30s}{:>10.3f}'.format('total', sum(self.stages.values())))
+        return '\n'.join(lines)
+
+class AppData:
+    """Holds the data loaded by loader, a function returning a dict
+    of name: value. The values are available as attributes, and the
+    first attribute access loads them if load() or warmup() hasn't
+    already. Concurrent accesses wait for a single load.
+    """
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self.ready = threading.Event()
+        self.error = None
+
+    def load(self):
+        with self._lock:
+            if self.ready.is_set():
+                return
+            try:
+                self.__dict__.update(self._loader())
+            except Exception as e:
+                self.error = repr(e)
+                raise
+            self.error = None
+            self.ready.set()
+
+    def warmup(self):
+        """Load in a daemon thread. Errors are kept in self.error,
+        and loading is retried on the next attribute access.
+        """
+        def run():
+            try:
+                self.load()
+            except Exception:
+                logger.exception('data warm-up failed')
+        thread = threading.Thread(target=run, name='cogic-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def __getattr__(self, name):
+        # only called for attributes that haven't been loaded yet
+        ready = self.__dict__.get('ready')
+        if name.startswith('_') or ready is None or ready.is_set():
+            raise AttributeError(name)
+        self.load()
+        return getattr(self, name)
+
+def freezeForFork():
+    """Call in the master process once everything is loaded, just
+    before forking workers. Moves every object allocated so far into
+    the garbage collector's permanent generation, so collections in
+    the workers don't write to, and un-share, the pages they're on.
+    """
+    gc.collect()
+    gc.freeze()
+
+def memoryUsage(pid='self'):
+    """Resident memory of a process in kB, from /proc/<pid>/smaps_rollup
+    (Linux only). Rss counts shared pages in full, Pss divides them
+    between the processes sharing them, and Private_* is the memory
+    only this process uses.
+    """
+    usage = dict()
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields)==3 and fields[2]=='kB':
+                usage[fields[0].rstrip(':')] = int(fields[1])
+    usage['Private'] = usage.get('Private_Clean', 0) + usage.get('Private_Dirty', 0)
+    usage['Shared'] = usage.get('Shared_Clean', 0) + usage.get('Shared_Dirty', 0)
+    return usage
@@ -2,8 +2,6 @@
 import pandas as pd
 import numpy as np
 import json
-from github import Github
-from io import BytesIO
 
 
 def fitExponential(x,y):
@@ -45,38 +43,3 @@ def unserialize(results):
     results['data'] = json.loads(results['data'])
     results['data'] = pd.Series(results['data'])
     return results
-
-def getCountyData():
-    g = Github('groe0029@umn.edu','jyntej-3zYtku-juwsok')
-
-    repo = g.get_repo("CSSEGISandData/COVID-19")
-
-    dataframes = []
-    for file in repo.get_contents('csse_covid_19_data/csse_covid_19_daily_reports'):
-        if file.name.split('.')[-1]=='csv':
-            df = pd.read_csv(BytesIO(file.decoded_content))
-            dataframes.append(df)
-
-    for i,df in enumerate(dataframes):
-        if 'Country_Region' in df.columns:
-            dataframes[i]['Country/Region'] = df['Country_Region']
-        if 'Province_State' in df.columns:
-            dataframes[i]['Province/State'] = df['Province_State']
-        if 'Last Update' in df.columns:
-            dataframes[i]['Last_Update'] = df['Last Update']
-
-    data = pd.concat(dataframes).fillna(0)
-    data = data.drop(['Country_Region','Province_State', 'Last Update','Combined_Key',
-                    'FIPS','Active'],axis=1)
-    data['Last_Update'] = pd.to_datetime(data['Last_Update']).dt.normalize()
-
-    countydata = data[data['Country/Region']=='US']
-    countydata = countydata[[True if ',' not in str(x) else False for x in countydata['Province/State'].values]]
-    #usdata = usdata.groupby(['Province/State','Last_Update']).sum()
-
-    return countydata
-
-def getandsaveCountyData():
-    countydata = getCountyData()
-    countydata.to_csv('data/countydata.csv')
-
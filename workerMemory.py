@@ -0,0 +1,33 @@
+"""Per-worker memory of a running pre-forked server (gunicorn.conf.py).
+Rss counts shared pages in full for every worker, so it overstates
+what each worker costs. Private is what each worker adds, and Pss
+sums to the total memory used by the server.
+
+Usage: python workerMemory.py [pidfile]
+"""
+import sys
+
+from startup import memoryUsage
+
+def workerPids(masterpid):
+    with open('/proc/{0}/task/{0}/children'.format(masterpid)) as f:
+        return [int(pid) for pid in f.read().split()]
+
+def serverMemory(masterpid):
+    """memoryUsage() of the master and each of its workers, keyed by pid"""
+    pids = [masterpid] + workerPids(masterpid)
+    return {pid: memoryUsage(pid) for pid in pids}
+
+if __name__ == '__main__':
+    pidfile = sys.argv[1] if len(sys.argv) > 1 else '/tmp/cogic-gunicorn.pid'
+    with open(pidfile) as f:
+        masterpid = int(f.read())
+
+    usage = serverMemory(masterpid)
+    columns = ['Rss', 'Pss', 'Shared', 'Private']
+    print('{:10s}{:>8s}'.format('process', 'pid') + ''.join('{:>12s}'.format(c + ' MB') for c in columns))
+    for pid, mem in usage.items():
+        name = 'master' if pid==masterpid else 'worker'
+        print('{:10s}{:>8d}'.format(name, pid) + ''.join('{:>12.1f}'.format(mem[c]/1024) for c in columns))
+    print('{:18s}'.format('total') + ''.join(
+        '{:>12.1f}'.format(sum(mem[c] for mem in usage.values())/1024) for c in columns))